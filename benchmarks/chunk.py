@@ -0,0 +1,32 @@
+"""
+Measures packed array throughput. Run with ``python -m benchmarks.chunk``.
+"""
+
+import random
+import time
+
+from quarry.types.chunk import PackedArray
+
+
+def bench_packed_array():
+    for spanning in (False, True):
+        for value_width in (4, 8, 14):
+            array = PackedArray.empty(4096, 64, value_width, spanning)
+            array[:] = [random.getrandbits(value_width) for _ in range(4096)]
+            data = array.to_bytes()
+
+            start = time.perf_counter()
+            for _ in range(20):
+                array = PackedArray.from_block_bytes(
+                    data, value_width, spanning)
+                values = array[:]
+                array[:] = values
+                array.to_bytes()
+            elapsed = time.perf_counter() - start
+
+            print("PackedArray spanning=%s value_width=%d: "
+                  "%.0f sections/s" % (spanning, value_width, 20 / elapsed))
+
+
+if __name__ == '__main__':
+    bench_packed_array()
@@ -0,0 +1,129 @@
+"""
+Measures NBT and SNBT throughput and memory use, using the generated chunks
+and SNBT corpus shared with the test suite, and the data packs shipped with
+quarry. Run with ``python -m benchmarks.nbt``.
+"""
+
+import glob
+import gzip
+import io
+import os.path
+import time
+import tracemalloc
+
+from quarry.data import data_packs
+from quarry.types.nbt import TagCompound, TagByte, TagRoot, NBTInterner, \
+    iter_events
+
+from tests.types.nbt_data import make_chunk, make_snbt_corpus
+
+
+def bench_chunk_throughput():
+    data = make_chunk().to_bytes()
+
+    start = time.perf_counter()
+    for _ in range(10):
+        chunk = TagRoot.from_bytes(data)
+    elapsed = time.perf_counter() - start
+
+    print("NBT decode: %.1f chunks/s, %.1f MB/s" % (
+        10 / elapsed, 10 * len(data) / elapsed / 1e6))
+
+    start = time.perf_counter()
+    for _ in range(10):
+        chunk.to_bytes()
+    elapsed = time.perf_counter() - start
+
+    print("NBT encode: %.1f chunks/s, %.1f MB/s" % (
+        10 / elapsed, 10 * len(data) / elapsed / 1e6))
+
+
+def bench_data_pack_throughput():
+    paths = glob.glob(os.path.join(
+        os.path.dirname(data_packs.__file__), "data_packs", "*.nbt"))
+    files = []
+    for path in paths:
+        with gzip.open(path) as fd:
+            files.append(fd.read())
+    size = sum(len(data) for data in files)
+
+    start = time.perf_counter()
+    for _ in range(10):
+        for data in files:
+            TagRoot.from_bytes(data)
+    elapsed = time.perf_counter() - start
+
+    print("NBT decode (data packs): %.1f MB/s" % (10 * size / elapsed / 1e6))
+
+
+def bench_lazy_reencode():
+    data = make_chunk().to_bytes()
+
+    # Editing one block entity after reading all of them
+    lazy = TagRoot.from_bytes(data, lazy=True)
+    for block_entity in lazy.body.value['block_entities'].value:
+        block_entity.value['id']
+    lazy.body.set_at_path('block_entities[3].keepPacked', TagByte(1))
+    eager = TagRoot.from_bytes(data)
+    eager.body.set_at_path('block_entities[3].keepPacked', TagByte(1))
+
+    timings = []
+    for tag in (eager, lazy):
+        start = time.perf_counter()
+        for _ in range(10):
+            tag.to_bytes()
+        timings.append((time.perf_counter() - start) / 10 * 1000)
+    print("NBT re-encode: %.2f ms, %.2f ms lazy" % tuple(timings))
+
+
+def measure_chunks(data, **kwargs):
+    """
+    Returns the memory in bytes used by each of a number of decoded chunks.
+    """
+
+    tracemalloc.start()
+    chunks = [TagRoot.from_bytes(data, **kwargs) for _ in range(10)]
+    size = tracemalloc.get_traced_memory()[0] / len(chunks)
+    tracemalloc.stop()
+    return size
+
+
+def bench_chunk_memory():
+    data = make_chunk().to_bytes()
+
+    print("NBT memory: %d bytes/chunk, %d bytes/chunk compact, "
+          "%d bytes/chunk interned" % (
+              measure_chunks(data),
+              measure_chunks(data, compact=True),
+              measure_chunks(data, interner=NBTInterner())))
+
+    peaks = []
+    for scan in (lambda: TagRoot.from_bytes(data),
+                 lambda: sum(1 for _ in iter_events(io.BytesIO(data)))):
+        tracemalloc.start()
+        scan()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    print("NBT peak memory: %d bytes decoded, %d bytes as events" %
+          tuple(peaks))
+
+
+def bench_mojangson_throughput():
+    corpus = make_snbt_corpus()
+    size = sum(len(text) for text in corpus)
+
+    start = time.perf_counter()
+    for _ in range(5):
+        for text in corpus:
+            TagCompound.from_mojangson(text)
+    elapsed = time.perf_counter() - start
+
+    print("SNBT parse: %.1f MB/s" % (5 * size / elapsed / 1e6))
+
+
+if __name__ == '__main__':
+    bench_chunk_throughput()
+    bench_data_pack_throughput()
+    bench_lazy_reencode()
+    bench_chunk_memory()
+    bench_mojangson_throughput()
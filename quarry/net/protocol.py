@@ -1,8 +1,12 @@
+import collections
+import concurrent.futures
+import functools
 import logging
-from twisted.internet import protocol
+import zlib
+from twisted.internet import protocol, reactor
 
 from quarry.data import packets
-from quarry.types.buffer import BufferUnderrun, buff_types
+from quarry.types.buffer import BufferUnderrun, BufferWriter, buff_types
 from quarry.net.crypto import Cipher
 from quarry.net.ticker import Ticker
 
@@ -56,12 +60,22 @@ class Protocol(protocol.Protocol, PacketDispatcher, object):
     in_game = False
     closed = False
 
+    #: Whether to defer decompression of received packets until their bodies
+    #: are read. Useful when most packets are forwarded or ignored.
+    lazy_decompression = False
+
+    #: The number of bytes of received packets that were never decompressed,
+    #: according to their headers. Packets that are decompressed have their
+    #: length checked against the header.
+    uninflated_bytes = 0
+
     def __init__(self, factory, remote_addr):
         self.factory = factory
         self.remote_addr = remote_addr
+        self.send_queue = collections.deque()
 
         self.buff_type = self.factory.get_buff_type(self.protocol_version)
-        self.recv_buff = self.buff_type()
+        self.recv_buff = self.buff_type.receiver()
         self.cipher = Cipher()
 
         self.logger = logging.getLogger("%s{%s}" % (
@@ -125,9 +139,12 @@ class Protocol(protocol.Protocol, PacketDispatcher, object):
             else:
                 self.logger.debug(reason)
 
-            self.transport.loseConnection()
             self.closed = True
 
+            # Wait for queued packets to be sent before disconnecting
+            if not self.send_queue:
+                self.transport.loseConnection()
+
     def log_packet(self, prefix, name):
         """Logs a packet at debug level"""
 
@@ -223,17 +240,24 @@ class Protocol(protocol.Protocol, PacketDispatcher, object):
 
         # Read some packets
         while not self.closed:
-            # Save the buffer, in case we read an incomplete packet
-            self.recv_buff.save()
-
-            # Read the packet
             try:
-                buff = self.recv_buff.unpack_packet(
-                    self.buff_type,
-                    self.compression_threshold)
+                # Read the packet frame, if it's complete
+                body = self.recv_buff.unpack_packet_frame(
+                    self.factory.max_packet_length)
+                if body is None:
+                    break
+
+                # Decompress the packet
+                buff = self.buff_type(body).unpack_packet_body(
+                    self.compression_threshold,
+                    self.factory.max_packet_length,
+                    self.lazy_decompression)
 
             except BufferUnderrun:
-                self.recv_buff.restore()
+                self.protocol_error(ProtocolError("Packet frame is too short"))
+                break
+            except ValueError as e:
+                self.protocol_error(ProtocolError(str(e)))
                 break
 
             try:
@@ -245,8 +269,13 @@ class Protocol(protocol.Protocol, PacketDispatcher, object):
                     self.packet_received(buff, name)
                 except BufferUnderrun:
                     raise ProtocolError("Packet is too short: %s" % name)
+                except ValueError as e:
+                    raise ProtocolError("%s: %s" % (e, name))
                 if len(buff) > 0:
                     raise ProtocolError("Packet is too long: %s" % name)
+                if buff.inflater is not None:
+                    self.uninflated_bytes += \
+                        buff.inflate_length - len(buff.buff)
 
                 # Reset the inactivity timer
                 self.connection_timer.restart()
@@ -254,6 +283,9 @@ class Protocol(protocol.Protocol, PacketDispatcher, object):
             except ProtocolError as e:
                 self.protocol_error(e)
 
+        # Discard data we've read
+        self.recv_buff.save()
+
     def packet_received(self, buff, name):
         """
         Called when a packet is received from the remote. Usually this method
@@ -278,26 +310,114 @@ class Protocol(protocol.Protocol, PacketDispatcher, object):
         buff.discard()
 
     def send_packet(self, name, *data):
-        """Sends a packet to the remote."""
+        """
+        Sends a packet to the remote. The payload may be given as byte strings
+        or as a single :class:`~quarry.types.buffer.BufferWriter`, in which
+        case the packet headers are written in place.
+
+        Large packets may be compressed in a thread pool, as configured by the
+        factory. Packets are always sent in order.
+        """
 
         if self.closed:
             return
 
         self.log_packet("# send", name)
 
-        data = b"".join(data)
+        ident = self.get_packet_ident(name)
+        args = (self.compression_threshold,
+                self.factory.compression_level,
+                self.factory.compression_strategy)
+
+        if len(data) == 1 and isinstance(data[0], BufferWriter):
+            # Pack packet in place
+            length = len(data[0])
+            pack = functools.partial(data[0].pack_packet, ident, *args)
+
+        else:
+            data = b"".join(data)
+
+            # Prepend ident
+            data = self.buff_type.pack_varint(ident) + data
+
+            # Pack packet
+            length = len(data)
+            pack = functools.partial(self.buff_type.pack_packet, data, *args)
+
+        thread_threshold = self.factory.compression_thread_threshold
+        if self.compression_threshold >= 0 \
+                and thread_threshold is not None \
+                and length >= max(thread_threshold, self.compression_threshold):
+            # Compress in a worker thread
+            future = self.factory.get_compression_executor().submit(pack)
+            future.add_done_callback(
+                lambda _: reactor.callFromThread(self.flush_send_queue))
+            self.send_queue.append(future)
+        else:
+            self.send_queue.append(pack())
+
+        self.flush_send_queue()
+
+    def forward_packet(self, name, buff):
+        """
+        Sends the unread remainder of a received packet to the remote. If the
+        packet was lazily decompressed and only its ID has been read, its
+        compressed body is sent without being decompressed and recompressed.
+        """
+
+        ident = self.buff_type.pack_varint(self.get_packet_ident(name))
+        if buff.compressed is not None \
+                and buff.inflater is not None \
+                and 0 <= self.compression_threshold <= buff.inflate_length \
+                and buff.buff[:buff.pos] == ident \
+                and not self.closed:
+
+            self.log_packet("# send", name)
 
-        # Prepend ident
-        data = self.buff_type.pack_varint(self.get_packet_ident(name)) + data
+            data = self.buff_type.pack_varint(buff.inflate_length) + \
+                buff.compressed
+            data = self.buff_type.pack_varint(len(data)) + data
+            self.send_queue.append(data)
+            self.flush_send_queue()
+            buff.discard()
 
-        # Pack packet
-        data = self.buff_type.pack_packet(data, self.compression_threshold)
+        else:
+            self.send_packet(name, buff.read())
 
-        # Encrypt
-        data = self.cipher.encrypt(data)
+    def flush_send_queue(self):
+        """
+        Encrypts and sends packed packets from the front of the send queue,
+        stopping at the first packet still being compressed. If a packet
+        failed to compress, the queue is discarded and the connection closed.
 
-        # Send
-        self.transport.write(data)
+        You should not need to call this method.
+        """
+
+        queue = self.send_queue
+        while queue:
+            data = queue[0]
+            if isinstance(data, concurrent.futures.Future):
+                if not data.done():
+                    return
+                try:
+                    data = data.result()
+                except Exception as e:
+                    # Later packets can't be sent without this one, so drop
+                    # them and the connection.
+                    queue.clear()
+                    self.protocol_error(
+                        ProtocolError("Failed to pack packet: %s" % e))
+                    break
+            queue.popleft()
+
+            # Encrypt
+            data = self.cipher.encrypt(data)
+
+            # Send
+            self.transport.write(data)
+
+        if self.closed and self.transport.connected:
+            self.transport.loseConnection()
 
 
 class Factory(protocol.Factory, object):
@@ -305,13 +425,44 @@ class Factory(protocol.Factory, object):
     ticker_type = Ticker
     log_level = logging.INFO
     connection_timeout = 30
+
+    #: Maximum length of a received packet in bytes, both before and after
+    #: decompression. Longer packets are rejected as a protocol error.
+    max_packet_length = 8388608
     force_protocol_version = None
 
+    #: The zlib compression level used for sent packets, from 0 to 9, or -1
+    #: for zlib's default.
+    compression_level = -1
+
+    #: The zlib compression strategy used for sent packets.
+    compression_strategy = zlib.Z_DEFAULT_STRATEGY
+
+    #: Packets at least this long (in bytes) are compressed in a thread pool
+    #: rather than in the reactor thread. ``None`` disables the thread pool.
+    compression_thread_threshold = None
+
+    #: The maximum number of threads used to compress packets.
+    compression_threads = None
+
+    compression_executor = None
+
     minecraft_versions = packets.minecraft_versions
 
     def buildProtocol(self, addr):
         return self.protocol(self, addr)
 
+    def get_compression_executor(self):
+        """
+        Gets the thread pool used to compress large packets, creating it if
+        necessary.
+        """
+        if self.compression_executor is None:
+            self.compression_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.compression_threads,
+                thread_name_prefix="quarry-compression")
+        return self.compression_executor
+
     def get_buff_type(self, protocol_version):
         """
         Gets a buffer type for the given protocol version.
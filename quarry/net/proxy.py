@@ -36,7 +36,7 @@ def _enable_fast_forwarding(endpoint1, endpoint2):
     if len(endpoint1.recv_buff) > 0:
         endpoint2.transport.write(
             endpoint2.cipher.encrypt(
-                endpoint1.recv_buff.read()))
+                bytes(endpoint1.recv_buff.read())))
 
     def data_received(data):
         endpoint2.transport.write(
@@ -47,6 +47,8 @@ def _enable_fast_forwarding(endpoint1, endpoint2):
 
 
 class Upstream(ClientProtocol):
+    lazy_decompression = True
+
     def setup(self):
         self.bridge = self.factory.bridge
         self.bridge.upstream = self
@@ -221,9 +223,9 @@ class Bridge(PacketDispatcher):
         implementation forwards the packet.
         """
         if direction == "downstream":
-            self.downstream.send_packet(name, buff.read())
+            self.downstream.forward_packet(name, buff)
         elif direction == "upstream":
-            self.upstream.send_packet(name, buff.read())
+            self.upstream.forward_packet(name, buff)
 
     def packet_downstream_set_compression(self, buff):
         self.upstream.set_compression(buff.unpack_varint())
@@ -231,6 +233,7 @@ class Bridge(PacketDispatcher):
 
 class Downstream(ServerProtocol):
     bridge = None
+    lazy_decompression = True
 
     def setup(self):
         self.bridge = self.factory.bridge_class(self.factory, self)
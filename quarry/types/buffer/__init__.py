@@ -2,6 +2,7 @@ class BufferUnderrun(Exception):
     pass
 
 
+from quarry.types.buffer.writer import BufferWriter
 from quarry.types.buffer.v1_7 import Buffer1_7
 from quarry.types.buffer.v1_9 import Buffer1_9
 from quarry.types.buffer.v1_13 import Buffer1_13
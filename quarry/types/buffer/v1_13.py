@@ -12,14 +12,14 @@ class Buffer1_13(Buffer1_9):
         if not palette:
             return b""
         else:
-            return cls.pack_varint(len(palette)) + b"".join(
-                cls.pack_varint(x) for x in palette)
+            return cls.pack_varint(len(palette)) + \
+                cls.pack_varint_array(palette)
 
     def unpack_chunk_section_palette(self, value_width):
         if value_width > 8:
             return []
         else:
-            return [self.unpack_varint() for _ in range(self.unpack_varint())]
+            return self.unpack_varint_array(self.unpack_varint())
 
     # Slot --------------------------------------------------------------------
 
@@ -59,29 +59,29 @@ class Buffer1_13(Buffer1_9):
         """
 
         pack_position = lambda pos: cls.pack_position(*pos)
-        out = b""
+        out = cls.writer()
         for ty_key, val in metadata.items():
             ty, key = ty_key
-            out += cls.pack('BB', key, ty)
-            if   ty == 0:  out += cls.pack('b', val)
-            elif ty == 1:  out += cls.pack_varint(val)
-            elif ty == 2:  out += cls.pack('f', val)
-            elif ty == 3:  out += cls.pack_string(val)
-            elif ty == 4:  out += cls.pack_chat(val)
-            elif ty == 5:  out += cls.pack_optional(cls.pack_chat, val)
-            elif ty == 6:  out += cls.pack_slot(**val)
-            elif ty == 7:  out += cls.pack('?', val)
-            elif ty == 8:  out += cls.pack_rotation(*val)
-            elif ty == 9:  out += cls.pack_position(*val)
-            elif ty == 10: out += cls.pack_optional(pack_position, val)
-            elif ty == 11: out += cls.pack_direction(val)
-            elif ty == 12: out += cls.pack_optional(cls.pack_uuid, val)
-            elif ty == 13: out += cls.pack_block(val)
-            elif ty == 14: out += cls.pack_nbt(val)
-            elif ty == 15: out += cls.pack_particle(*val)
+            out.write_struct('BB', key, ty)
+            if   ty == 0:  out.write_struct('b', val)
+            elif ty == 1:  out.write_varint(val)
+            elif ty == 2:  out.write_struct('f', val)
+            elif ty == 3:  out.write_string(val)
+            elif ty == 4:  out.write_chat(val)
+            elif ty == 5:  out.write_optional(cls.pack_chat, val)
+            elif ty == 6:  out.write_slot(**val)
+            elif ty == 7:  out.write_struct('?', val)
+            elif ty == 8:  out.write_rotation(*val)
+            elif ty == 9:  out.write_position(*val)
+            elif ty == 10: out.write_optional(pack_position, val)
+            elif ty == 11: out.write_direction(val)
+            elif ty == 12: out.write_optional(cls.pack_uuid, val)
+            elif ty == 13: out.write_block(val)
+            elif ty == 14: out.write_nbt(val)
+            elif ty == 15: out.write_particle(*val)
             else: raise ValueError("Unknown entity metadata type: %d" % ty)
-        out += cls.pack('B', 255)
-        return out
+        out.write_struct('B', 255)
+        return out.to_bytes()
 
     def unpack_entity_metadata(self):
         """
@@ -195,8 +195,7 @@ class Buffer1_13(Buffer1_9):
         flags = self.unpack('B')
         node['type'] = ['root', 'literal', 'argument'][flags & 0x03]
         node['executable'] = bool(flags & 0x04)
-        node['children'] = [self.unpack_varint() for _ in
-                            range(self.unpack_varint())]
+        node['children'] = self.unpack_varint_array(self.unpack_varint())
         node['redirect'] = self.unpack_varint() if flags & 0x08 else None
         node['name'] = self.unpack_string() if node['type'] != 'root' else None
 
@@ -257,13 +256,14 @@ class Buffer1_13(Buffer1_9):
             idx += 1
 
         # Pack nodes
-        out = cls.pack_varint(len(nodes))
+        out = cls.writer()
+        out.write_varint(len(nodes))
         for node in nodes:
-            out += cls.pack_command_node(node, nodes)
+            out.write_command_node(node, nodes)
 
-        out += cls.pack_varint(nodes.index(root_node))
+        out.write_varint(nodes.index(root_node))
 
-        return out
+        return out.to_bytes()
 
     @classmethod
     def pack_command_node(cls, node, nodes):
@@ -271,33 +271,32 @@ class Buffer1_13(Buffer1_9):
         Packs a command node.
         """
 
-        out = b""
+        out = cls.writer()
 
         flags = (
             ['root', 'literal', 'argument'].index(node['type']) |
             int(node['executable']) << 2 |
             int(node['redirect'] is not None) << 3 |
             int(node['suggestions'] is not None) << 4)
-        out += cls.pack('B', flags)
-        out += cls.pack_varint(len(node['children']))
-
-        for child in node['children'].values():
-            out += cls.pack_varint(nodes.index(child))
+        out.write_struct('B', flags)
+        out.write_varint(len(node['children']))
+        out.write_varint_array(
+            nodes.index(child) for child in node['children'].values())
 
         if node['redirect'] is not None:
-            out += cls.pack_varint(nodes.index(node['redirect']))
+            out.write_varint(nodes.index(node['redirect']))
 
         if node['name'] is not None:
-            out += cls.pack_string(node['name'])
+            out.write_string(node['name'])
 
         if node['type'] == 'argument':
-            out += cls.pack_string(node['parser'])
-            out += cls.pack_command_node_properties(node['parser'],
-                                                    node['properties'])
+            out.write_string(node['parser'])
+            out.write_command_node_properties(node['parser'],
+                                              node['properties'])
         if node['suggestions'] is not None:
-            out += cls.pack_string(node['suggestions'])
+            out.write_string(node['suggestions'])
 
-        return out
+        return out.to_bytes()
 
     @classmethod
     def pack_command_node_properties(cls, parser, properties):
@@ -371,31 +370,33 @@ class Buffer1_13(Buffer1_9):
         """
         Packs a crafting recipe.
         """
-        data = cls.pack_string(name) + cls.pack_string(type)
+        data = cls.writer()
+        data.write_string(name)
+        data.write_string(type)
 
         if type == 'crafting_shapeless':
-            data += cls.pack_string(recipe['group'])
-            data += cls.pack_varint(len(recipe['ingredients']))
+            data.write_string(recipe['group'])
+            data.write_varint(len(recipe['ingredients']))
             for ingredient in recipe['ingredients']:
-                data += cls.pack_ingredient(ingredient)
-            data += cls.pack_slot(**recipe['result'])
+                data.write_ingredient(ingredient)
+            data.write_slot(**recipe['result'])
 
         elif type == 'crafting_shaped':
-            data += cls.pack_varint(recipe['width'])
-            data += cls.pack_varint(recipe['height'])
-            data += cls.pack_string(recipe['group'])
+            data.write_varint(recipe['width'])
+            data.write_varint(recipe['height'])
+            data.write_string(recipe['group'])
             for ingredient in recipe['ingredients']:
-                data += cls.pack_ingredient(ingredient)
-            data += cls.pack_slot(**recipe['result'])
+                data.write_ingredient(ingredient)
+            data.write_slot(**recipe['result'])
 
         elif type == 'smelting':
-            data += cls.pack_string(recipe['group'])
-            data += cls.pack_ingredient(recipe['ingredient'])
-            data += cls.pack_slot(**recipe['result'])
-            data += cls.pack('f', recipe['experience'])
-            data += cls.pack_varint(recipe['cooking_time'])
+            data.write_string(recipe['group'])
+            data.write_ingredient(recipe['ingredient'])
+            data.write_slot(**recipe['result'])
+            data.write_struct('f', recipe['experience'])
+            data.write_varint(recipe['cooking_time'])
 
-        return data
+        return data.to_bytes()
 
     def unpack_ingredient(self):
         """
@@ -408,7 +409,8 @@ class Buffer1_13(Buffer1_9):
         """
         Packs a crafting recipe ingredient alternation.
         """
-        data = cls.pack_varint(len(ingredient))
+        data = cls.writer()
+        data.write_varint(len(ingredient))
         for slot in ingredient:
-            data += cls.pack_slot(**slot)
-        return data
+            data.write_slot(**slot)
+        return data.to_bytes()
@@ -18,10 +18,11 @@ class Buffer1_14(Buffer1_13_2):
         ``quarry.types.chunk.BlockArray``.
         """
 
-        out = cls.pack('HB', blocks.non_air, blocks.storage.value_width)
-        out += cls.pack_chunk_section_palette(blocks.palette)
-        out += cls.pack_chunk_section_array(blocks.to_bytes())
-        return out
+        out = cls.writer()
+        out.write_struct('HB', blocks.non_air, blocks.storage.value_width)
+        out.write_chunk_section_palette(blocks.palette)
+        out.write_chunk_section_array(blocks.to_bytes())
+        return out.to_bytes()
 
     def unpack_chunk_section(self, overworld=True):
         """
@@ -82,32 +83,32 @@ class Buffer1_14(Buffer1_13_2):
         """
 
         pack_position = lambda pos: cls.pack_position(*pos)
-        out = b""
+        out = cls.writer()
         for ty_key, val in metadata.items():
             ty, key = ty_key
-            out += cls.pack('BB', key, ty)
-            if   ty == 0:  out += cls.pack('b', val)
-            elif ty == 1:  out += cls.pack_varint(val)
-            elif ty == 2:  out += cls.pack('f', val)
-            elif ty == 3:  out += cls.pack_string(val)
-            elif ty == 4:  out += cls.pack_chat(val)
-            elif ty == 5:  out += cls.pack_optional(cls.pack_chat, val)
-            elif ty == 6:  out += cls.pack_slot(**val)
-            elif ty == 7:  out += cls.pack('?', val)
-            elif ty == 8:  out += cls.pack_rotation(*val)
-            elif ty == 9:  out += cls.pack_position(*val)
-            elif ty == 10: out += cls.pack_optional(pack_position, val)
-            elif ty == 11: out += cls.pack_direction(val)
-            elif ty == 12: out += cls.pack_optional(cls.pack_uuid, val)
-            elif ty == 13: out += cls.pack_block(val)
-            elif ty == 14: out += cls.pack_nbt(val)
-            elif ty == 15: out += cls.pack_particle(*val)
-            elif ty == 16: out += cls.pack_villager(*val)
-            elif ty == 17: out += cls.pack_optional_varint(val)
-            elif ty == 18: out += cls.pack_pose(val)
+            out.write_struct('BB', key, ty)
+            if   ty == 0:  out.write_struct('b', val)
+            elif ty == 1:  out.write_varint(val)
+            elif ty == 2:  out.write_struct('f', val)
+            elif ty == 3:  out.write_string(val)
+            elif ty == 4:  out.write_chat(val)
+            elif ty == 5:  out.write_optional(cls.pack_chat, val)
+            elif ty == 6:  out.write_slot(**val)
+            elif ty == 7:  out.write_struct('?', val)
+            elif ty == 8:  out.write_rotation(*val)
+            elif ty == 9:  out.write_position(*val)
+            elif ty == 10: out.write_optional(pack_position, val)
+            elif ty == 11: out.write_direction(val)
+            elif ty == 12: out.write_optional(cls.pack_uuid, val)
+            elif ty == 13: out.write_block(val)
+            elif ty == 14: out.write_nbt(val)
+            elif ty == 15: out.write_particle(*val)
+            elif ty == 16: out.write_villager(*val)
+            elif ty == 17: out.write_optional_varint(val)
+            elif ty == 18: out.write_pose(val)
             else: raise ValueError("Unknown entity metadata type: %d" % ty)
-        out += cls.pack('B', 255)
-        return out
+        out.write_struct('B', 255)
+        return out.to_bytes()
 
     def unpack_entity_metadata(self):
         """
@@ -267,28 +268,30 @@ class Buffer1_14(Buffer1_13_2):
         """
         Packs a crafting recipe.
         """
-        data = cls.pack_string(type) + cls.pack_string(name)
+        data = cls.writer()
+        data.write_string(type)
+        data.write_string(name)
 
         if type == 'minecraft:crafting_shapeless':
-            data += cls.pack_string(recipe['group'])
-            data += cls.pack_varint(len(recipe['ingredients']))
+            data.write_string(recipe['group'])
+            data.write_varint(len(recipe['ingredients']))
             for ingredient in recipe['ingredients']:
-                data += cls.pack_ingredient(ingredient)
-            data += cls.pack_slot(**recipe['result'])
+                data.write_ingredient(ingredient)
+            data.write_slot(**recipe['result'])
 
         elif type == 'minecraft:crafting_shaped':
-            data += cls.pack_varint(recipe['width'])
-            data += cls.pack_varint(recipe['height'])
-            data += cls.pack_string(recipe['group'])
+            data.write_varint(recipe['width'])
+            data.write_varint(recipe['height'])
+            data.write_string(recipe['group'])
             for ingredient in recipe['ingredients']:
-                data += cls.pack_ingredient(ingredient)
-            data += cls.pack_slot(**recipe['result'])
+                data.write_ingredient(ingredient)
+            data.write_slot(**recipe['result'])
 
         elif type in smelt_types:
-            data += cls.pack_string(recipe['group'])
-            data += cls.pack_ingredient(recipe['ingredient'])
-            data += cls.pack_slot(**recipe['result'])
-            data += cls.pack('f', recipe['experience'])
-            data += cls.pack_varint(recipe['cooking_time'])
+            data.write_string(recipe['group'])
+            data.write_ingredient(recipe['ingredient'])
+            data.write_slot(**recipe['result'])
+            data.write_struct('f', recipe['experience'])
+            data.write_varint(recipe['cooking_time'])
 
-        return data
+        return data.to_bytes()
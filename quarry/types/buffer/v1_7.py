@@ -3,24 +3,65 @@ import string
 import struct
 import zlib
 
-from quarry.types.buffer import BufferUnderrun
+from quarry.types.buffer import BufferUnderrun, BufferWriter
 from quarry.types.registry import OpaqueRegistry
 from quarry.types.uuid import UUID
 
 
 directions = ("down", "up", "north", "south", "west", "east")
 
+# Compiled structs, keyed by format. Pre-populated with the fixed formats used
+# by NBT and packet framing.
+_structs = {fmt: struct.Struct(">" + fmt) for fmt in (
+    "?", "b", "B", "h", "H", "i", "I", "q", "Q", "f", "d", "bi", "IB")}
+_structs_max = 256
+
+# Number of bytes initially decompressed from lazily-decompressed packets
+lazy_length = 16
+
+# Packed single-byte varints
+_varints = tuple(bytes((number,)) for number in range(0x80))
+
 
 class Buffer1_7(object):
     buff = b""
     pos = 0
+    start = 0
+    frame = None
+    inflater = None
+    inflate_length = None
+    compressed = None
     registry = OpaqueRegistry(13)
 
     def __init__(self, data=None):
         if data:
             self.buff = data
 
+    @classmethod
+    def receiver(cls):
+        """
+        Creates an empty buffer suitable for accumulating data received from
+        the network. The buffer is backed by a growable ``bytearray``;
+        :meth:`read` returns ``memoryview`` slices of it, and packets unpacked
+        with :meth:`unpack_packet` share its memory rather than copying it.
+        """
+
+        obj = cls()
+        obj.buff = bytearray()
+        return obj
+
+    @classmethod
+    def writer(cls):
+        """
+        Creates a :class:`~quarry.types.buffer.BufferWriter` that packs data
+        using this buffer type.
+        """
+
+        return BufferWriter(cls)
+
     def __len__(self):
+        if self.inflater is not None:
+            return self.inflate_length - self.pos
         return len(self.buff) - self.pos
 
     def add(self, data):
@@ -28,15 +69,35 @@ class Buffer1_7(object):
         Add some bytes to the end of the buffer.
         """
 
-        self.buff += data
+        if isinstance(self.buff, bytearray):
+            try:
+                self.buff += data
+            except BufferError:
+                # A view of our data is still held elsewhere (e.g. by a packet
+                # handler), so the bytearray can't be resized in place.
+                self.buff = self.buff[self.start:] + data
+                self.pos -= self.start
+                self.start = 0
+        else:
+            self.buff += data
 
     def save(self):
         """
         Saves the buffer contents.
         """
 
-        self.buff = self.buff[self.pos:]
-        self.pos = 0
+        if isinstance(self.buff, bytearray):
+            # Compact only once the consumed prefix outweighs the remainder,
+            # so that each byte is moved an amortised constant number of times.
+            # A new bytearray is created as views of the old one may be held.
+            if self.pos * 2 > len(self.buff):
+                self.buff = self.buff[self.pos:]
+                self.pos = 0
+            self.start = self.pos
+        else:
+            self.inflate()
+            self.buff = self.buff[self.pos:]
+            self.pos = 0
 
     def restore(self):
         """
@@ -44,35 +105,90 @@ class Buffer1_7(object):
         called.
         """
 
-        self.pos = 0
+        self.pos = self.start
 
     def discard(self):
         """
         Discards the entire buffer contents.
         """
 
-        self.pos = len(self.buff)
+        if self.inflater is not None:
+            self.pos = self.inflate_length
+        else:
+            self.pos = len(self.buff)
+
+    def inflate(self, end=None):
+        """
+        Ensures that the first *end* bytes of the buffer (or all bytes, if
+        *end* is ``None``) are available, completing decompression of a
+        lazily-decompressed packet if needed. Raises ``BufferUnderrun`` if the
+        buffer is shorter than *end*, or ``ValueError`` if the decompressed
+        packet length differs from the length given in its header.
+
+        You should not need to call this method.
+        """
+
+        if self.inflater is not None and (end is None or end > len(self.buff)):
+            self.buff = self.buff + self.inflater.decompress(
+                self.inflater.unconsumed_tail,
+                self.inflate_length - len(self.buff) + 1)
+            self.inflater = None
+            self.compressed = None
+            if len(self.buff) != self.inflate_length:
+                raise ValueError(f"Packet length does not match header: {len(self.buff):d}")
+
+        if end is not None and end > len(self.buff):
+            raise BufferUnderrun()
 
     def read(self, length=None):
         """
         Read *length* bytes from the beginning of the buffer, or all bytes if
-        *length* is ``None``
+        *length* is ``None``. Buffers created by :meth:`receiver` return a
+        ``memoryview``; all other buffers return ``bytes``.
         """
 
-        if length is None:
-            data = self.buff[self.pos:]
-            self.pos = len(self.buff)
-        else:
-            if self.pos + length > len(self.buff):
-                raise BufferUnderrun()
+        if isinstance(self.buff, bytes):
+            if length is None:
+                if self.inflater is not None:
+                    self.inflate()
+                data = self.buff[self.pos:]
+                self.pos = len(self.buff)
+            else:
+                if self.pos + length > len(self.buff):
+                    self.inflate(self.pos + length)
+
+                data = self.buff[self.pos:self.pos+length]
+                self.pos += length
+
+            return data
 
-            data = self.buff[self.pos:self.pos+length]
-            self.pos += length
+        data = self.read_view(length)
+        if isinstance(self.buff, memoryview):
+            # Materialise slices of shared memory, as callers expect bytes.
+            data = data.tobytes()
+        return data
+
+    def read_view(self, length=None):
+        """
+        Read *length* bytes from the beginning of the buffer, or all bytes if
+        *length* is ``None``, and return them as a ``memoryview`` that shares
+        memory with the buffer.
+        """
 
+        if length is None:
+            if self.inflater is not None:
+                self.inflate()
+            length = len(self.buff) - self.pos
+        elif self.pos + length > len(self.buff):
+            self.inflate(self.pos + length)
+
+        data = memoryview(self.buff)[self.pos:self.pos+length]
+        self.pos += length
         return data
 
     def hexdump(self):
-        data = self.buff[self.pos:]
+        self.inflate()
+        data = bytes(self.buff[self.pos:])
         lines = ['']
         bytes_read = 0
         while len(data) > 0:
@@ -96,6 +212,21 @@ class Buffer1_7(object):
 
     # Basic data types --------------------------------------------------------
 
+    @classmethod
+    def get_struct(cls, fmt):
+        """
+        Returns a compiled ``struct.Struct`` object for the given format, which
+        is interpreted as big-endian. Compiled structs are cached.
+        """
+
+        try:
+            return _structs[fmt]
+        except KeyError:
+            compiled = struct.Struct(">" + fmt)
+            if len(_structs) < _structs_max:
+                _structs[fmt] = compiled
+            return compiled
+
     @classmethod
     def pack(cls, fmt, *fields):
         """
@@ -103,16 +234,18 @@ class Buffer1_7(object):
         ``struct.pack()``.
         """
 
-        return struct.pack(">"+fmt, *fields)
+        return cls.get_struct(fmt).pack(*fields)
 
     def unpack(self, fmt):
         """
         Unpack a struct. The format accepted is the same as for
         ``struct.unpack()``.
         """
-        fmt = ">" + fmt
-        data = self.read(struct.calcsize(fmt))
-        fields = struct.unpack(fmt, data)
+        compiled = self.get_struct(fmt)
+        if self.pos + compiled.size > len(self.buff):
+            self.inflate(self.pos + compiled.size)
+        fields = compiled.unpack_from(self.buff, self.pos)
+        self.pos += compiled.size
         if len(fields) == 1:
             fields = fields[0]
         return fields
@@ -132,8 +265,13 @@ class Buffer1_7(object):
         Unpack an array struct. The format accepted is the same as for
         ``struct.unpack()``.
         """
-        data = self.read(struct.calcsize(">" + fmt) * length)
-        return list(struct.unpack(">" + fmt * length, data))
+        fmt = ">" + fmt * length
+        size = struct.calcsize(fmt)
+        if self.pos + size > len(self.buff):
+            self.inflate(self.pos + size)
+        fields = struct.unpack_from(fmt, self.buff, self.pos)
+        self.pos += size
+        return list(fields)
 
     # Optional ----------------------------------------------------------------
 
@@ -167,6 +305,9 @@ class Buffer1_7(object):
         Packs a varint.
         """
 
+        if 0 <= number < 0x80 and max_bits >= 8:
+            return _varints[number]
+
         number_min = -1 << (max_bits - 1)
         number_max = +1 << (max_bits - 1)
         if not (number_min <= number < number_max):
@@ -175,26 +316,42 @@ class Buffer1_7(object):
         if number < 0:
             number += 1 << 32
 
-        out = b""
-        for i in range(10):
-            b = number & 0x7F
+        if number < 0x4000:
+            return bytes((number & 0x7F | 0x80, number >> 7))
+
+        out = bytearray()
+        while number >= 0x80:
+            out.append(number & 0x7F | 0x80)
             number >>= 7
-            out += cls.pack("B", b | (0x80 if number > 0 else 0))
-            if number == 0:
-                break
-        return out
+        out.append(number)
+        return bytes(out)
 
     def unpack_varint(self, max_bits=32):
         """
         Unpacks a varint.
         """
 
+        buff = self.buff
+        pos = self.pos
+
+        # Fast path for single-byte varints
+        if pos < len(buff) and max_bits >= 8:
+            b = buff[pos]
+            if b < 0x80:
+                self.pos = pos + 1
+                return b
+
         number = 0
-        for i in range(10):
-            b = self.unpack("B")
-            number |= (b & 0x7F) << 7*i
+        for i in range(0, 70, 7):
+            if pos >= len(buff):
+                self.inflate(pos + 1)
+                buff = self.buff
+            b = buff[pos]
+            pos += 1
+            number |= (b & 0x7F) << i
             if not b & 0x80:
                 break
+        self.pos = pos
 
         if number & (1 << 31):
             number -= 1 << 32
@@ -206,39 +363,172 @@ class Buffer1_7(object):
 
         return number
 
+    @classmethod
+    def pack_varint_array(cls, numbers):
+        """
+        Packs a sequence of varints. No length prefix is added.
+        """
+
+        out = bytearray()
+        for number in numbers:
+            if 0 <= number < 0x80:
+                out.append(number)
+            else:
+                out += cls.pack_varint(number)
+        return bytes(out)
+
+    def unpack_varint_array(self, length):
+        """
+        Unpacks *length* varints in a single pass, returning a list.
+        """
+
+        buff = self.buff
+        pos = self.pos
+        end = len(buff)
+        numbers = []
+        append = numbers.append
+        for _ in range(length):
+            if pos >= end:
+                self.inflate(pos + 1)
+                buff = self.buff
+                end = len(buff)
+            b = buff[pos]
+            pos += 1
+            if b < 0x80:
+                append(b)
+                continue
+
+            number = b & 0x7F
+            for i in range(7, 70, 7):
+                if pos >= end:
+                    self.inflate(pos + 1)
+                    buff = self.buff
+                    end = len(buff)
+                b = buff[pos]
+                pos += 1
+                number |= (b & 0x7F) << i
+                if not b & 0x80:
+                    break
+
+            if number & (1 << 31):
+                number -= 1 << 32
+            if not (-1 << 31) <= number < (1 << 31):
+                raise ValueError(f"varint does not fit in range: {-1 << 31:d} <= {number:d} < {1 << 31:d}")
+            append(number)
+
+        self.pos = pos
+        return numbers
+
     # Packet ------------------------------------------------------------------
 
     @classmethod
-    def pack_packet(cls, data, compression_threshold=-1):
+    def pack_packet(cls, data, compression_threshold=-1, compression_level=-1,
+                    compression_strategy=zlib.Z_DEFAULT_STRATEGY):
         """
-        Unpacks a packet frame. This method handles length-prefixing and
-        compression.
+        Packs a packet frame. This method handles length-prefixing and
+        compression. The *compression_level* and *compression_strategy*
+        arguments are passed to ``zlib.compressobj()``.
         """
 
         if compression_threshold >= 0:
             # Compress data and prepend uncompressed data length
             if len(data) >= compression_threshold:
-                data = cls.pack_varint(len(data)) + zlib.compress(data)
+                compressor = zlib.compressobj(
+                    compression_level,
+                    zlib.DEFLATED,
+                    zlib.MAX_WBITS,
+                    zlib.DEF_MEM_LEVEL,
+                    compression_strategy)
+                data = cls.pack_varint(len(data)) + \
+                    compressor.compress(data) + \
+                    compressor.flush()
             else:
                 data = cls.pack_varint(0) + data
 
         # Prepend packet length
         return cls.pack_varint(len(data), max_bits=32) + data
 
-    def unpack_packet(self, cls, compression_threshold=-1):
+    def unpack_packet(self, cls, compression_threshold=-1, max_length=None):
         """
         Unpacks a packet frame. This method handles length-prefixing and
-        compression.
+        compression. Uncompressed packet bodies share memory with this buffer.
+        """
+        body = self.read_view(self.unpack_varint(max_bits=32))
+        return cls(body).unpack_packet_body(compression_threshold, max_length)
+
+    def unpack_packet_frame(self, max_length=None):
+        """
+        Unpacks a length-prefixed packet frame from a buffer that is filled
+        incrementally, returning a ``memoryview`` of the frame body, or
+        ``None`` if the frame is not yet complete. The length of an incomplete
+        frame is remembered, so its prefix is parsed only once however many
+        reads it arrives in. Raises ``ValueError`` if the frame is longer than
+        *max_length* bytes, before any of its body is buffered.
         """
-        body = self.read(self.unpack_varint(max_bits=32))
-        buff = cls(body)
+
+        if self.frame is None:
+            pos = self.pos
+            try:
+                length = self.unpack_varint(max_bits=32)
+            except BufferUnderrun:
+                self.pos = pos
+                return None
+
+            if length < 0 or (max_length is not None and length > max_length):
+                raise ValueError(f"Packet frame length is out of range: {length:d}")
+
+            # The prefix is left in the buffer until the frame is complete.
+            self.frame = (self.pos - pos, length)
+            self.pos = pos
+
+        prefix_length, length = self.frame
+        if len(self) < prefix_length + length:
+            return None
+
+        self.frame = None
+        self.pos += prefix_length
+        return self.read_view(length)
+
+    def unpack_packet_body(self, compression_threshold=-1, max_length=None,
+                           lazy=False):
+        """
+        Unpacks the body of a packet frame, which is the remaining content of
+        this buffer, and returns a new buffer of the same type containing the
+        packet. This method handles compression. Raises ``ValueError`` if the
+        packet is longer than *max_length* bytes once decompressed, or if its
+        decompressed length differs from the length given in its header.
+
+        If *lazy* is true, only the first few bytes of a compressed packet
+        are decompressed, which is enough to read its ID. The remainder is
+        decompressed when it's first read.
+        """
+
         if compression_threshold >= 0:
-            uncompressed_length = buff.unpack_varint()
+            uncompressed_length = self.unpack_varint()
             if uncompressed_length > 0:
-                body = zlib.decompress(buff.read())
-                buff = cls(body)
-
-        return buff
+                if max_length is not None and uncompressed_length > max_length:
+                    raise ValueError(f"Packet length is out of range: {uncompressed_length:d}")
+                compressed = self.read_view()
+                inflater = zlib.decompressobj()
+                if not lazy:
+                    # Inflate at most one byte more than declared, which is
+                    # enough to detect a mismatched length.
+                    data = inflater.decompress(
+                        compressed, uncompressed_length + 1)
+                    if len(data) != uncompressed_length:
+                        raise ValueError(f"Packet length does not match header: {len(data):d}")
+                    return type(self)(data)
+
+                buff = type(self)(inflater.decompress(compressed, lazy_length))
+                if inflater.eof and len(buff.buff) != uncompressed_length:
+                    raise ValueError(f"Packet length does not match header: {len(buff.buff):d}")
+                if not inflater.eof:
+                    buff.inflater = inflater
+                    buff.inflate_length = uncompressed_length
+                    buff.compressed = compressed
+                return buff
+
+        return type(self)(self.read_view())
 
     # String ------------------------------------------------------------------
 
@@ -429,21 +719,21 @@ class Buffer1_7(object):
         """
         Packs entity metadata.
         """
-        out = b""
+        out = cls.writer()
         for ty_key, val in metadata.items():
             ty, key = ty_key
-            out += cls.pack('B', ty << 5 | key)
-            if   ty == 0: out += cls.pack('b', val)
-            elif ty == 1: out += cls.pack('h', val)
-            elif ty == 2: out += cls.pack('i', val)
-            elif ty == 3: out += cls.pack('f', val)
-            elif ty == 4: out += cls.pack_string(val)
-            elif ty == 5: out += cls.pack_slot(**val)
-            elif ty == 6: out += cls.pack('iii', *val)
-            elif ty == 7: out += cls.pack_rotation(*val)
+            out.write_struct('B', ty << 5 | key)
+            if   ty == 0: out.write_struct('b', val)
+            elif ty == 1: out.write_struct('h', val)
+            elif ty == 2: out.write_struct('i', val)
+            elif ty == 3: out.write_struct('f', val)
+            elif ty == 4: out.write_string(val)
+            elif ty == 5: out.write_slot(**val)
+            elif ty == 6: out.write_struct('iii', *val)
+            elif ty == 7: out.write_rotation(*val)
             else: raise ValueError(f"Unknown entity metadata type: {ty:d}")
-        out += cls.pack('B', 127)
-        return out
+        out.write_struct('B', 127)
+        return out.to_bytes()
 
     def unpack_entity_metadata(self):
         """
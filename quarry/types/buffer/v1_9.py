@@ -8,11 +8,11 @@ class Buffer1_9(Buffer1_7):
 
     @classmethod
     def pack_chunk(cls, sections):
-        data = b""
+        data = cls.writer()
         for section in sections:
             if section and not section[0].is_empty():
-                data += cls.pack_chunk_section(*section)
-        return data
+                data.write_chunk_section(*section)
+        return data.to_bytes()
 
     @classmethod
     def pack_chunk_bitmask(cls, sections):
@@ -29,18 +29,18 @@ class Buffer1_9(Buffer1_7):
         ``BlockArray`` and ``LightArray`` from ``quarry.types.chunk``.
         """
 
-        out = cls.pack('B', blocks.storage.value_width)
-        out += cls.pack_chunk_section_palette(blocks.palette)
-        out += cls.pack_chunk_section_array(blocks.to_bytes())
-        out += block_lights.to_bytes()
+        out = cls.writer()
+        out.write_struct('B', blocks.storage.value_width)
+        out.write_chunk_section_palette(blocks.palette)
+        out.write_chunk_section_array(blocks.to_bytes())
+        out.write(block_lights.to_bytes())
         if sky_lights:
-            out += sky_lights.to_bytes()
-        return out
+            out.write(sky_lights.to_bytes())
+        return out.to_bytes()
 
     @classmethod
     def pack_chunk_section_palette(cls, palette):
-        return cls.pack_varint(len(palette)) + b"".join(
-            cls.pack_varint(x) for x in palette)
+        return cls.pack_varint(len(palette)) + cls.pack_varint_array(palette)
 
     @classmethod
     def pack_chunk_section_array(cls, data):
@@ -82,7 +82,7 @@ class Buffer1_9(Buffer1_7):
         return blocks, block_lights, sky_lights
 
     def unpack_chunk_section_palette(self, value_width):
-        return [self.unpack_varint() for _ in range(self.unpack_varint())]
+        return self.unpack_varint_array(self.unpack_varint())
 
     def unpack_chunk_section_array(self, value_width):
         return self.read(self.unpack_varint() * 8)
@@ -96,27 +96,27 @@ class Buffer1_9(Buffer1_7):
         """
 
         pack_position = lambda pos: cls.pack_position(*pos)
-        out = b""
+        out = cls.writer()
         for ty_key, val in metadata.items():
             ty, key = ty_key
-            out += cls.pack('BB', key, ty)
-            if   ty == 0:  out += cls.pack('b', val)
-            elif ty == 1:  out += cls.pack_varint(val)
-            elif ty == 2:  out += cls.pack('f', val)
-            elif ty == 3:  out += cls.pack_string(val)
-            elif ty == 4:  out += cls.pack_chat(val)
-            elif ty == 5:  out += cls.pack_slot(**val)
-            elif ty == 6:  out += cls.pack('?', val)
-            elif ty == 7:  out += cls.pack_rotation(*val)
-            elif ty == 8:  out += cls.pack_position(*val)
-            elif ty == 9:  out += cls.pack_optional(pack_position, val)
-            elif ty == 10: out += cls.pack_direction(val)
-            elif ty == 11: out += cls.pack_optional(cls.pack_uuid, val)
-            elif ty == 12: out += cls.pack_block(val)
-            elif ty == 13: out += cls.pack_nbt(val)
+            out.write_struct('BB', key, ty)
+            if   ty == 0:  out.write_struct('b', val)
+            elif ty == 1:  out.write_varint(val)
+            elif ty == 2:  out.write_struct('f', val)
+            elif ty == 3:  out.write_string(val)
+            elif ty == 4:  out.write_chat(val)
+            elif ty == 5:  out.write_slot(**val)
+            elif ty == 6:  out.write_struct('?', val)
+            elif ty == 7:  out.write_rotation(*val)
+            elif ty == 8:  out.write_position(*val)
+            elif ty == 9:  out.write_optional(pack_position, val)
+            elif ty == 10: out.write_direction(val)
+            elif ty == 11: out.write_optional(cls.pack_uuid, val)
+            elif ty == 12: out.write_block(val)
+            elif ty == 13: out.write_nbt(val)
             else: raise ValueError("Unknown entity metadata type: %d" % ty)
-        out += cls.pack('B', 255)
-        return out
+        out.write_struct('B', 255)
+        return out.to_bytes()
 
     def unpack_entity_metadata(self):
         """
@@ -0,0 +1,128 @@
+class BufferWriter(object):
+    """
+    Accumulates packed data in a ``bytearray``, avoiding the quadratic cost of
+    repeatedly concatenating byte strings.
+
+    Any ``pack_*()`` method of the buffer type is available as a ``write_*()``
+    method that appends its result; for example ``write_slot(**slot)``
+    appends ``buff_type.pack_slot(**slot)``. Common types are written
+    directly.
+
+    Space is reserved at the front of the writer so that a packet ID and
+    frame headers can be written in place by :meth:`pack_packet`. Writers can
+    be passed to :meth:`~quarry.net.protocol.Protocol.send_packet`.
+    """
+
+    #: Bytes reserved at the front of the writer for packet headers.
+    headroom = 16
+
+    def __init__(self, buff_type):
+        self.buff_type = buff_type
+        self.buff = bytearray(self.headroom)
+        self.start = self.headroom
+
+    def __len__(self):
+        return len(self.buff) - self.start
+
+    def __getattr__(self, name):
+        if not name.startswith("write_"):
+            raise AttributeError(name)
+        packer = getattr(self.buff_type, "pack_" + name[6:])
+
+        def write(*args, **kwargs):
+            self.buff += packer(*args, **kwargs)
+        return write
+
+    # Basic data types --------------------------------------------------------
+
+    def write(self, data):
+        """
+        Appends some bytes.
+        """
+
+        self.buff += data
+
+    def write_struct(self, fmt, *fields):
+        """
+        Appends a struct. The format accepted is the same as for
+        ``struct.pack()``.
+        """
+
+        self.buff += self.buff_type.get_struct(fmt).pack(*fields)
+
+    def write_varint(self, number, max_bits=32):
+        """
+        Appends a varint.
+        """
+
+        if 0 <= number < 0x80:
+            self.buff.append(number)
+        else:
+            self.buff += self.buff_type.pack_varint(number, max_bits)
+
+    def write_varint_array(self, numbers):
+        """
+        Appends a sequence of varints. No length prefix is added.
+        """
+
+        self.buff += self.buff_type.pack_varint_array(numbers)
+
+    def write_string(self, text):
+        """
+        Appends a varint-prefixed utf8 string.
+        """
+
+        text = text.encode("utf-8")
+        self.write_varint(len(text), max_bits=16)
+        self.buff += text
+
+    def write_nbt(self, tag=None):
+        """
+        Appends an NBT tag.
+        """
+
+        self.buff += self.buff_type.pack_nbt(tag)
+
+    # Output ------------------------------------------------------------------
+
+    def prepend(self, data):
+        """
+        Inserts some bytes at the front, using reserved space if possible.
+        """
+
+        if len(data) <= self.start:
+            self.start -= len(data)
+            self.buff[self.start:self.start+len(data)] = data
+        else:
+            self.buff[self.start:self.start] = data
+
+    def to_view(self):
+        """
+        Returns a ``memoryview`` of the written data.
+        """
+
+        return memoryview(self.buff)[self.start:]
+
+    def to_bytes(self):
+        """
+        Returns the written data as bytes.
+        """
+
+        return bytes(self.to_view())
+
+    def pack_packet(self, ident, compression_threshold=-1, *args):
+        """
+        Frames the written data as a packet with the given ID, and returns the
+        frame as bytes. The ID and headers are written into reserved space
+        unless the packet is compressed. Further arguments are passed to
+        the buffer type's ``pack_packet()`` method.
+        """
+
+        self.prepend(self.buff_type.pack_varint(ident))
+        if compression_threshold >= 0:
+            if len(self) >= compression_threshold:
+                return self.buff_type.pack_packet(
+                    self.to_view(), compression_threshold, *args)
+            self.prepend(self.buff_type.pack_varint(0))
+        self.prepend(self.buff_type.pack_varint(len(self)))
+        return self.to_bytes()
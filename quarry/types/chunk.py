@@ -1,6 +1,30 @@
 from collections.abc import Sequence, MutableSequence
-from bitstring import BitArray, Bits
+import array
+import collections
 import math
+import sys
+
+
+#: Typecodes of unsigned ``array.array`` types by width in bits.
+_typecodes = {array.array(code).itemsize * 8: code for code in "QLIHB"}
+
+#: Typecodes of signed ``array.array`` types by width in bits.
+_signed_typecodes = {
+    array.array(code).itemsize * 8: code for code in "qlihb"}
+
+#: Whether sectors must be byte-swapped to and from big-endian order.
+_swap = sys.byteorder == "little"
+
+
+def _sector_array(sector_width, initializer=b""):
+    """
+    Returns an ``array.array`` with items of the given width in bits.
+    """
+
+    try:
+        return array.array(_typecodes[sector_width], initializer)
+    except KeyError:
+        raise ValueError("Unsupported sector width: %d" % sector_width)
 
 
 def get_width(length, full_width):
@@ -34,9 +58,13 @@ class PackedArray(Sequence):
     - Light data used 4-bit values and 8-bit sectors
     - Height data uses 9-bit values and 64-bit sectors
     - Block data uses 64-bit sectors
+
+    By default values do not span sectors, as in Minecraft 1.16+. Set
+    *spanning* to read and write the older format, where values may be split
+    across two sectors.
     """
 
-    #: The ``bitstring.BitArray`` object used for storage.
+    #: The ``array.array`` of sectors used for storage.
     storage = None
 
     #: The number of entries in the array
@@ -48,6 +76,8 @@ class PackedArray(Sequence):
     #: The width in bits of values.
     value_width = None
 
+    #: Whether values may span sectors (Minecraft 1.15 and below).
+    spanning = False
 
     def __repr__(self):
         return "<PackedArray length=%d sector_width=%d value_width=%d>" \
@@ -57,19 +87,22 @@ class PackedArray(Sequence):
 
     # Constructors ------------------------------------------------------------
 
-    def __init__(self, storage, length, sector_width, value_width):
+    def __init__(self, storage, length, sector_width, value_width,
+                 spanning=False):
         self.storage = storage
         self.length = length
         self.sector_width = sector_width
         self.value_width = value_width
+        self.spanning = spanning
 
     @classmethod
-    def empty(cls, length, sector_width, value_width):
+    def empty(cls, length, sector_width, value_width, spanning=False):
         """
         Creates an empty array.
         """
 
-        obj = cls(BitArray(), length, sector_width, value_width)
+        obj = cls(_sector_array(sector_width), length, sector_width,
+                  value_width, spanning)
         obj.purge()
         return obj
 
@@ -98,30 +131,32 @@ class PackedArray(Sequence):
         return cls.empty(256, 64, 9)
 
     @classmethod
-    def from_bytes(cls, bytes, length, sector_width, value_width):
+    def from_bytes(cls, bytes, length, sector_width, value_width,
+                   spanning=False):
         """
         Deserialize a packed array from the given bytes.
         """
 
-        storage = BitArray(bytes=bytes)
-        return cls(storage, length, sector_width, value_width)
-
+        storage = _sector_array(sector_width)
+        storage.frombytes(bytes)
+        if _swap and sector_width > 8:
+            storage.byteswap()
+        return cls(storage, length, sector_width, value_width, spanning)
 
     @classmethod
     def from_int_list(cls, lst, value_width):
         """
-        Pack a list of integers into a BitArray
+        Pack a list of signed integers into an array with one value per
+        sector.
         """
 
-        # Create an empty bit array big enough to hold all the data
-        storage = BitArray()
-
-        # Populate the array
-        offset = 0
-        for item in lst:
-            storage.append(BitArray(int=item, length=value_width))
-            offset += value_width
-
+        storage = _sector_array(value_width)
+        try:
+            storage.frombytes(
+                array.array(_signed_typecodes[value_width], lst).tobytes())
+        except OverflowError:
+            mask = (1 << value_width) - 1
+            storage.extend([item & mask for item in lst])
         return cls(storage, len(lst), value_width, value_width)
 
     @classmethod
@@ -133,12 +168,12 @@ class PackedArray(Sequence):
         return cls.from_bytes(bytes, 4096, 8, 4)
 
     @classmethod
-    def from_block_bytes(cls, bytes, value_width):
+    def from_block_bytes(cls, bytes, value_width, spanning=False):
         """
         Deserialize a packed array from the given block data bytes.
         """
 
-        return cls.from_bytes(bytes, 4096, 64, value_width)
+        return cls.from_bytes(bytes, 4096, 64, value_width, spanning)
 
     @classmethod
     def from_height_bytes(cls, bytes):
@@ -155,7 +190,111 @@ class PackedArray(Sequence):
         Serialize this packed array to bytes.
         """
 
-        return self.storage.bytes
+        if _swap and self.sector_width > 8:
+            storage = _sector_array(self.sector_width, self.storage)
+            storage.byteswap()
+            return storage.tobytes()
+        return self.storage.tobytes()
+
+    def to_view(self, signed=False):
+        """
+        Returns a zero-copy ``memoryview`` of the values in this array, which
+        must have one value per sector. If *signed* is set, values are read
+        as two's complement integers. The storage cannot be resized while the
+        view is alive.
+        """
+
+        if self.value_width != self.sector_width:
+            raise ValueError("Values are packed %d to a sector"
+                             % (self.sector_width // self.value_width))
+        view = memoryview(self.storage)[:self.length]
+        if signed:
+            view = view.cast("B").cast(_signed_typecodes[self.sector_width])
+        return view
+
+    def to_list(self):
+        """
+        Returns all values in this packed array as a list of integers. This
+        is much faster than reading values individually.
+        """
+
+        length = self.length
+        sector_width = self.sector_width
+        value_width = self.value_width
+        storage = self.storage
+
+        # One value per sector
+        if value_width == sector_width:
+            return storage[:length].tolist()
+
+        mask = (1 << value_width) - 1
+
+        # Values may be split across two sectors
+        if self.spanning:
+            values = []
+            append = values.append
+            for pos in range(0, length * value_width, value_width):
+                sector, offset = divmod(pos, sector_width)
+                value = storage[sector] >> offset
+                if offset + value_width > sector_width:
+                    value |= storage[sector + 1] << (sector_width - offset)
+                append(value & mask)
+            return values
+
+        # Values are packed from the low-order end of each sector
+        shifts = range(0, sector_width - value_width + 1, value_width)
+        values = [sector >> shift & mask
+                  for sector in storage
+                  for shift in shifts]
+        del values[length:]
+        return values
+
+    def from_list(self, values):
+        """
+        Replaces all values in this packed array with the given integers. This
+        is much faster than setting values individually.
+        """
+
+        if len(values) != self.length:
+            raise ValueError("Expected %d values, got %d"
+                             % (self.length, len(values)))
+
+        sector_width = self.sector_width
+        value_width = self.value_width
+        mask = (1 << value_width) - 1
+        if values and not 0 <= min(values) <= max(values) <= mask:
+            raise ValueError("Values must fit in %d bits" % value_width)
+
+        # One value per sector
+        if value_width == sector_width:
+            self.storage = _sector_array(sector_width, values)
+            return
+
+        self.purge()
+        storage = self.storage
+
+        # Values may be split across two sectors
+        if self.spanning:
+            sector_mask = (1 << sector_width) - 1
+            pos = 0
+            for value in values:
+                sector, offset = divmod(pos, sector_width)
+                storage[sector] |= (value << offset) & sector_mask
+                if offset + value_width > sector_width:
+                    storage[sector + 1] |= value >> (sector_width - offset)
+                pos += value_width
+            return
+
+        # Values are packed from the low-order end of each sector
+        values_per_sector = sector_width // value_width
+        shifts = range(0, sector_width - value_width + 1, value_width)
+        for sector, start in enumerate(
+                range(0, self.length, values_per_sector)):
+            packed = 0
+            for shift, value in zip(
+                    shifts, values[start:start + values_per_sector]):
+                packed |= value << shift
+            storage[sector] = packed
 
     def purge(self):
         """
@@ -164,14 +303,20 @@ class PackedArray(Sequence):
         You should not need to call this method.
         """
 
-        values_per_sector = self.sector_width // self.value_width
-        sector_count = 1 + (self.length - 1) // values_per_sector
-        self.storage.clear()
-        self.storage.append(BitArray(self.sector_width * sector_count))
+        if self.spanning:
+            sector_count = -(-self.length * self.value_width //
+                             self.sector_width)
+        else:
+            values_per_sector = self.sector_width // self.value_width
+            sector_count = 1 + (self.length - 1) // values_per_sector
+        self.storage = _sector_array(
+            self.sector_width, bytes(sector_count * self.sector_width // 8))
 
     def pos(self, idx):
         """
-        Returns the bit position of the value at the given index.
+        Returns the bit position of the value at the given index, counting
+        from the most significant bit of the first sector. Only meaningful
+        when values do not span sectors.
 
         You should not need to call this method.
         """
@@ -186,7 +331,7 @@ class PackedArray(Sequence):
         Returns true if this packed array is entirely zeros.
         """
 
-        return not self.storage.any(True)
+        return not any(self.storage)
 
     # Sequence methods --------------------------------------------------------
 
@@ -194,28 +339,62 @@ class PackedArray(Sequence):
         return self.length
 
     def __iter__(self):
-        for i in range(self.length):
-            yield self.storage[slice(*self.pos(i))].uint
+        return iter(self.to_list())
 
     def __getitem__(self, item):
         if isinstance(item, slice):
-            return [self.storage[slice(*self.pos(idx))].uint
-                    for idx in range(*item.indices(len(self)))]
+            return self.to_list()[item]
+
+        if not 0 <= item < self.length:
+            raise IndexError(item)
+
+        value_width = self.value_width
+        sector_width = self.sector_width
+        if self.spanning:
+            sector, offset = divmod(item * value_width, sector_width)
+            value = self.storage[sector] >> offset
+            if offset + value_width > sector_width:
+                value |= self.storage[sector + 1] << (sector_width - offset)
         else:
-            if not 0 <= item < len(self):
-                raise IndexError(item)
-            return self.storage[slice(*self.pos(item))].uint
+            sector, value = divmod(item, sector_width // value_width)
+            value = self.storage[sector] >> (value * value_width)
+        return value & ((1 << value_width) - 1)
 
     def __setitem__(self, item, value):
         if isinstance(item, slice):
-            for idx, value in zip(range(*item.indices(len(self))), value):
-                self.storage.overwrite(
-                    bs=Bits(uint=value, length=self.value_width),
-                    pos=self.pos(idx)[0])
+            indices = range(*item.indices(self.length))
+            if len(indices) == self.length and indices.step == 1:
+                self.from_list(list(value))
+            else:
+                for idx, value in zip(indices, value):
+                    self[idx] = value
+            return
+
+        if not 0 <= item < self.length:
+            raise IndexError(item)
+
+        value_width = self.value_width
+        sector_width = self.sector_width
+        mask = (1 << value_width) - 1
+        if not 0 <= value <= mask:
+            raise ValueError("Value must fit in %d bits: %r"
+                             % (value_width, value))
+
+        storage = self.storage
+        if self.spanning:
+            sector, offset = divmod(item * value_width, sector_width)
+            sector_mask = (1 << sector_width) - 1
+            storage[sector] = (storage[sector] & ~(mask << offset) |
+                               value << offset) & sector_mask
+            if offset + value_width > sector_width:
+                shift = sector_width - offset
+                storage[sector + 1] = \
+                    storage[sector + 1] & ~(mask >> shift) | value >> shift
         else:
-            self.storage.overwrite(
-                bs=Bits(uint=value, length=self.value_width),
-                pos=self.pos(item)[0])
+            sector, offset = divmod(item, sector_width // value_width)
+            offset *= value_width
+            storage[sector] = \
+                storage[sector] & ~(mask << offset) | value << offset
 
 
 class BlockArray(Sequence):
@@ -240,7 +419,8 @@ class BlockArray(Sequence):
     #: The :class:`PackedArray` object used for storage.
     storage = None
 
-    #: List of encoded block values. Empty when palette is not used.
+    #: List of encoded block values. Empty when palette is not used. This may
+    #: be modified in place.
     palette = None
 
     #: The `Registry` object used to encode/decode blocks
@@ -256,10 +436,15 @@ class BlockArray(Sequence):
     # Constructors ------------------------------------------------------------
 
     def __init__(self, storage, palette, registry, non_air=-1):
+        if not isinstance(palette, _Palette):
+            palette = _Palette(palette)
         self.storage = storage
         self.palette = palette
         self.registry = registry
         self._non_air = non_air
+        self._palette_lookup = {}
+        self._palette_version = None
+        self._air = _AirLookup(registry)
 
     @classmethod
     def empty(cls, registry, non_air=-1):
@@ -334,25 +519,42 @@ class BlockArray(Sequence):
     @property
     def non_air(self):
         if self._non_air == -1:
-            self._non_air = [
-                self.registry.is_air_block(obj) for obj in self].count(False)
+            palette = self.palette
+            air = self._air
+            self._non_air = sum(
+                count for value, count in self.histogram().items()
+                if not air[palette[value] if palette else value])
         return self._non_air
 
+    def histogram(self):
+        """
+        Returns a ``collections.Counter`` mapping each stored value to the
+        number of blocks using it. Stored values are palette indices, or
+        encoded IDs when the palette is unused. Blocks are not decoded.
+        """
+
+        return collections.Counter(self.storage.to_list())
+
     def repack(self, reserve=None):
         """
         Re-packs internal data to use the smallest possible bits-per-block by
-        eliminating unused palette entries. This operation is slow as it walks
-        all blocks to determine the new palette.
+        eliminating unused palette entries. Unused entries are found from a
+        histogram of the stored values, and blocks are remapped in bulk.
         """
 
-        # If no reserve is given, we re-compute the palette by walking blocks
+        palette = self.palette
+
+        # If no reserve is given, we re-compute the palette from a histogram
         if reserve is None:
-            palette = sorted(set(self))
-            palette_len = len(palette)
+            used = self.histogram()
+            if palette:
+                used = {palette[idx] for idx in used}
+            new_palette = sorted(used)
+            palette_len = len(new_palette)
 
         # Otherwise we just ensure we have enough space to store new entries.
-        elif self.palette:
-            palette = self.palette[:]
+        elif palette:
+            new_palette = palette[:]
             palette_len = len(palette) + reserve
 
         # Reserving space in an unpaletted array is a no-op.
@@ -362,24 +564,171 @@ class BlockArray(Sequence):
         # Compute new value width
         value_width = get_width(palette_len, self.registry.max_bits)
 
-        # Exit if there's no change in value width needed
-        if value_width == self.storage.value_width:
+        # Switch to unpaletted operation if necessary
+        if value_width > 8:
+            new_palette = []
+
+        # Exit if there's no change needed
+        if value_width == self.storage.value_width and new_palette == palette:
             return
 
-        # Switch to unpaletted operation if necessary
+        # Remap stored values
+        values = self.storage.to_list()
+        if new_palette:
+            lookup = {value: idx for idx, value in enumerate(new_palette)}
+            if palette:
+                remap = [lookup.get(value) for value in palette]
+                values = [remap[value] for value in values]
+            else:
+                values = [lookup[value] for value in values]
+        elif palette:
+            values = [palette[value] for value in values]
+
+        # Update internals
+        self.storage.value_width = value_width
+        self.storage.purge()
+        palette[:] = new_palette
+        self.storage.from_list(values)
+
+    def get_ids(self):
+        """
+        Returns a list of the encoded IDs of all blocks.
+        """
+
+        ids = self.storage.to_list()
+        if self.palette:
+            palette = self.palette
+            ids = [palette[idx] for idx in ids]
+        return ids
+
+    def set_ids(self, ids):
+        """
+        Sets all blocks from a sequence of 4096 encoded IDs. The palette is
+        rebuilt from scratch.
+        """
+
+        ids = list(ids)
+        if len(ids) != 4096:
+            raise ValueError("Expected 4096 block IDs, got %d" % len(ids))
+
+        counts = collections.Counter(ids)
+        palette = sorted(counts)
+        value_width = get_width(len(palette), self.registry.max_bits)
         if value_width > 8:
             palette = []
 
-        # Save contents
-        values = self[:]
+        self._store(ids, palette, value_width)
+        self._non_air = sum(
+            count for value, count in counts.items()
+            if not self._air[value])
+
+    def set_many(self, indices, values):
+        """
+        Sets the blocks at the given indices to the given values. Each
+        distinct value is encoded once, and the palette and value width are
+        grown at most once. This is much faster than setting blocks
+        individually.
+        """
+
+        indices = list(indices)
+        values = list(values)
+        if len(indices) != len(values):
+            raise ValueError("Expected %d values, got %d"
+                             % (len(indices), len(values)))
+
+        # Encode each distinct object once. The objects list keeps them
+        # alive, so their IDs are not reused during this loop.
+        encoded = {}
+        objects, values = values, []
+        for obj in objects:
+            try:
+                values.append(encoded[id(obj)])
+            except KeyError:
+                encoded[id(obj)] = value = self.registry.encode_block(obj)
+                values.append(value)
+
+        # Grow the palette and value width once for all new values
+        if self.palette:
+            lookup = self._get_palette_lookup()
+            new = [value for value in dict.fromkeys(values)
+                   if value not in lookup]
+            if new:
+                self.repack(reserve=len(new))
+                for value in new:
+                    if self.palette:
+                        self._append_palette(value)
+
+        palette = self.palette
+        if palette:
+            lookup = self._get_palette_lookup()
+            values = [lookup[value] for value in values]
+            is_air = [self._air[value] for value in palette]
+        else:
+            is_air = self._air
+
+        # Update storage, tracking non-air blocks arithmetically
+        storage = self.storage.to_list()
+        if self._non_air == -1:
+            for idx, value in zip(indices, values):
+                storage[idx] = value
+        else:
+            non_air = self._non_air
+            for idx, value in zip(indices, values):
+                non_air += is_air[storage[idx]] - is_air[value]
+                storage[idx] = value
+            self._non_air = non_air
+        self.storage.from_list(storage)
+
+    def fill(self, value):
+        """
+        Sets all blocks to the given value.
+        """
+
+        value = self.registry.encode_block(value)
+        self._store(
+            [value] * 4096, [value], get_width(1, self.registry.max_bits))
+        self._non_air = 0 if self._air[value] else 4096
+
+    def _store(self, ids, palette, value_width):
+        """
+        Replaces the palette, value width and contents of this block array.
+        """
 
-        # Update internals
         self.storage.value_width = value_width
         self.storage.purge()
         self.palette[:] = palette
+        if palette:
+            lookup = self._get_palette_lookup()
+            ids = [lookup[value] for value in ids]
+        self.storage.from_list(ids)
 
-        # Load contents
-        self[:] = values
+    def _get_palette_lookup(self):
+        """
+        Returns a dictionary mapping encoded values to palette indices. The
+        dictionary is rebuilt if the palette has been modified since it was
+        last built.
+        """
+
+        palette = self.palette
+        if palette.version != self._palette_version:
+            lookup = {}
+            for idx, value in enumerate(palette):
+                lookup.setdefault(value, idx)
+            self._palette_lookup = lookup
+            self._palette_version = palette.version
+        return self._palette_lookup
+
+    def _append_palette(self, value):
+        """
+        Appends an encoded value to the palette and returns its index.
+        """
+
+        lookup = self._get_palette_lookup()
+        idx = len(self.palette)
+        self.palette.append(value)
+        self._palette_version = self.palette.version
+        lookup[value] = idx
+        return idx
 
     # Sequence methods --------------------------------------------------------
 
@@ -404,25 +753,25 @@ class BlockArray(Sequence):
 
     def __setitem__(self, item, value):
         if isinstance(item, slice):
-            for idx in range(*item.indices(4096)):
-                self[idx] = value[idx]
+            self.set_many(range(*item.indices(4096)), value)
             return
 
-        if self._non_air != -1:
-            self._non_air += int(self.registry.is_air_block(self[item])) - \
-                             int(self.registry.is_air_block(value))
-
         value = self.registry.encode_block(value)
 
+        if self._non_air != -1:
+            old = self.storage[item]
+            if self.palette:
+                old = self.palette[old]
+            self._non_air += self._air[old] - self._air[value]
+
         if self.palette:
             try:
-                value = self.palette.index(value)
-            except ValueError:
+                value = self._get_palette_lookup()[value]
+            except KeyError:
                 self.repack(reserve=1)
 
                 if self.palette:
-                    self.palette.append(value)
-                    value = len(self.palette) - 1
+                    value = self._append_palette(value)
 
         self.storage[item] = value
 
@@ -435,27 +784,103 @@ class BlockArray(Sequence):
 
     def __contains__(self, value):
         if self.palette:
-            if self.registry.encode_block(value) not in self.palette:
+            if self.registry.encode_block(value) \
+                    not in self._get_palette_lookup():
                 return False
         return super(BlockArray, self).__contains__(value)
 
     def index(self, value, start=0, stop=None):
         if self.palette:
-            if self.registry.encode_block(value) not in self.palette:
+            if self.registry.encode_block(value) \
+                    not in self._get_palette_lookup():
                 raise ValueError
         return super(BlockArray, self).index(value, start, stop)
 
     def count(self, value):
         if self.palette:
-            if self.registry.encode_block(value) not in self.palette:
+            if self.registry.encode_block(value) \
+                    not in self._get_palette_lookup():
                 return 0
         return super(BlockArray, self).count(value)
 
 
+class _Palette(list):
+    """
+    List of encoded block values that counts in-place modifications, so that
+    lookups derived from it can be rebuilt when it changes.
+    """
+
+    #: Incremented whenever the list is modified.
+    version = 0
+
+    def __setitem__(self, idx, value):
+        self.version += 1
+        return super().__setitem__(idx, value)
+
+    def __delitem__(self, idx):
+        self.version += 1
+        return super().__delitem__(idx)
+
+    def __iadd__(self, values):
+        self.version += 1
+        return super().__iadd__(values)
+
+    def __imul__(self, count):
+        self.version += 1
+        return super().__imul__(count)
+
+    def append(self, value):
+        self.version += 1
+        return super().append(value)
+
+    def extend(self, values):
+        self.version += 1
+        return super().extend(values)
+
+    def insert(self, idx, value):
+        self.version += 1
+        return super().insert(idx, value)
+
+    def pop(self, *args):
+        self.version += 1
+        return super().pop(*args)
+
+    def remove(self, value):
+        self.version += 1
+        return super().remove(value)
+
+    def clear(self):
+        self.version += 1
+        return super().clear()
+
+    def sort(self, **kwargs):
+        self.version += 1
+        return super().sort(**kwargs)
+
+    def reverse(self):
+        self.version += 1
+        return super().reverse()
+
+
+class _AirLookup(dict):
+    """
+    Dictionary mapping encoded values to whether they are air, populated on
+    demand.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def __missing__(self, value):
+        is_air = self.registry.is_air_block(self.registry.decode_block(value))
+        self[value] = is_air
+        return is_air
+
+
 class _NBTPaletteProxy(MutableSequence):
     def __init__(self, registry):
         self.registry = registry
-        self.palette = []
+        self.palette = _Palette()
 
     def insert(self, idx, value):
         # FIXME: NBT chunk sections are *always* paletted, and so the format
@@ -1,21 +1,29 @@
+import array
 import collections
+import collections.abc
+import difflib
 import functools
 import gzip
+import hashlib
+import io
+import itertools
 import os
 import re
+import struct
 import sys
 import time
 import zlib
 
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../../brigadier.py"))
 
+from brigadier.exceptions import BuiltInExceptions
 from brigadier.string_reader import StringReader
 
 from mutf8.mutf8 import encode_modified_utf8, decode_modified_utf8
 
 from pathlib import Path
 
-from quarry.types.buffer import Buffer
+from quarry.types.buffer import Buffer, BufferUnderrun
 from quarry.types.text_format import ansify_text, get_format, unformat_text
 from quarry.types.chunk import PackedArray
 
@@ -48,8 +56,10 @@ class _Tag(object):
     postfix = ('', get_format('reset').ansi_code)
 
     @classmethod
-    def from_bytes(cls, bytes, use_mutf8=True):
-        return cls.from_buff(Buffer(bytes), use_mutf8)
+    def from_bytes(cls, bytes, use_mutf8=True, include=None, lazy=False,
+                   compact=False, interner=None):
+        return _decode(
+            bytes, 0, cls, use_mutf8, include, lazy, compact, interner)[0]
 
     @classmethod
     def from_buff(cls, buff, use_mutf8=True):
@@ -59,81 +69,155 @@ class _Tag(object):
         raise NotImplementedError
 
     def deep_copy(self):
-        return type(self).from_bytes(self.to_bytes())
+        """
+        Returns a copy of this tag and its children, which can be modified
+        independently of this tag.
+        """
+
+        return _copy(self)
 
     def to_obj(self):
         return self.value
 
     def __hash__(self):
-        return hash(self.to_bytes())
+        return _hash(self)
 
     def __repr__(self):
         return "%s(%r)" % (type(self).__name__, self.value)
 
     def __eq__(self, other):
-        return self.to_obj() == other.to_obj()
+        if not isinstance(other, _Tag):
+            return NotImplemented
+        return _equal(self, other)
 
     def equals_exact(self, other):
-        return self.to_bytes() == other.to_bytes()
+        return _equal(self, other, exact=True)
 
     def __lt__(self, other):
         return self.to_obj() < other.to_obj()
 
-    def to_mojangson(self, sort=None, highlight=False):
-        prefix = self.prefix[highlight]
-        postfix = self.postfix[highlight]
+    def to_mojangson(self, sort=None, highlight=False, max_depth=None,
+                     max_array_length=None):
+        """
+        Returns the tag in SNBT form. See :meth:`write_mojangson`.
+        """
+
+        return ''.join(_iter_mojangson(
+            self, sort, highlight, None, 0, max_depth, max_array_length))
+
+    def write_mojangson(self, fp, sort=None, highlight=False, indent=None,
+                        max_depth=None, max_array_length=None):
+        """
+        Writes the tag in SNBT form to a file object, without building the
+        whole text in memory.
+
+        If *sort* is a list of keys, compound entries with those keys come
+        first, followed by other entries in sorted order. If *indent* is
+        given, lists and compounds are split over multiple lines. Containers
+        nested deeper than *max_depth* are written as ``...``, and arrays
+        longer than *max_array_length* are truncated.
+        """
 
-        return f'{prefix}{self.value!s}{postfix}'
+        _write_mojangson(fp, _iter_mojangson(
+            self, sort, highlight, indent, 0, max_depth, max_array_length))
 
     def to_json(self):
         return self.value
 
-    def tree(self, sort=None, indent='    ', level=0, highlight=True):
-        result = self.to_mojangson(sort=sort, highlight=highlight)
+    def tree(self, sort=None, indent='    ', level=0, highlight=True,
+             max_depth=None, max_array_length=8):
+        pieces = _iter_mojangson(
+            self, sort, highlight, indent, level, max_depth, max_array_length)
         if level == 0:
-            print(result)
+            _write_mojangson(sys.stdout, itertools.chain(pieces, '\n'))
         else:
-            return result
-
-    @staticmethod
-    def _nbt_path_node_prefix_check(path):
-        """Returns path as a StringReader, raising SyntaxError for universally invalid first characters."""
-        if not isinstance(path, StringReader):
-            path = StringReader(path)
-        if path.can_read() and path.peek() == '.':
-            raise SyntaxError(f"Invalid NBT path element at position {path.get_cursor()}: {'...' if path.get_cursor() > 10 else ''}{path.get_read()[-10:]}<--[HERE]")
-        return path
-
-    @staticmethod
-    def _nbt_path_node_suffix_check(path):
-        """Verifies end of path or node separator, and raises SyntaxError on failure."""
-        if path.can_read():
-            if path.peek() == '.':
-                path.skip()
-            elif path.peek() != '[':
-                raise SyntaxError(f"Invalid NBT path element at position {path.get_cursor()}: {'...' if path.get_cursor() > 10 else ''}{path.get_read()[-10:]}<--[HERE]")
+            return ''.join(pieces)
 
     def is_subset(self, other):
         return self.value == other.value
 
     def diff(self, other, order_matters=True, show_values=False, path=''):
-        raise NotImplementedError
+        """
+        Prints the differences between this tag and another, and returns
+        ``True`` if there are any. See :meth:`changes`.
+        """
+
+        different = False
+        for change in _diff(self, other, order_matters, path=path):
+            _print_change(change, show_values)
+            different = True
+        return different
+
+    def changes(self, other, order_matters=True, align='index', keys=(),
+                path=''):
+        """
+        Returns a list of :class:`NBTChange` records for the differences
+        between this tag and another. Differences in the order of compound
+        keys are ignored unless *order_matters* is true.
+
+        Lists are aligned by *align*: ``'index'`` pairs elements by
+        position, and ``'sequence'`` pairs runs of equal elements like
+        ``difflib``, so that insertions and removals are reported as such.
+        If *keys* are given, lists of compounds are instead matched by the
+        first of these keys whose value identifies every element, such as
+        ``('Slot', 'UUID')``.
+        """
+
+        return list(_diff(self, other, order_matters, align, keys, path))
 
     def has_path(self, path):
-        raise NotImplementedError
+        """
+        Returns ``True`` if the given NBT path matches at least one tag.
+        """
+
+        return NBTPath.compile(path).exists(self)
 
     def at_path(self, path):
-        raise NotImplementedError
+        """
+        Returns the single tag at the given NBT path. See
+        :meth:`NBTPath.get`.
+        """
+
+        return NBTPath.compile(path).get(self)
 
     def count_multipath(self, path):
-        raise NotImplementedError
+        """
+        Returns the number of tags matched by the given NBT path.
+        """
+
+        return NBTPath.compile(path).count(self)
 
     def iter_multipath_pair(self, path):
-        raise NotImplementedError
+        """
+        Yields ``(path, tag)`` pairs for each tag matched by the given NBT
+        path.
+        """
+
+        return NBTPath.compile(path).iter_pairs(self)
 
     def iter_multipath(self, path):
-        for _, tag in self.iter_multipath_pair(path):
-            yield tag
+        """
+        Yields each tag matched by the given NBT path.
+        """
+
+        return NBTPath.compile(path).iter(self)
+
+    def set_at_path(self, path, value):
+        """
+        Sets each tag matched by the given NBT path to *value*, and returns
+        the number of tags set. See :meth:`NBTPath.set`.
+        """
+
+        return NBTPath.compile(path).set(self, value)
+
+    def remove_at_path(self, path):
+        """
+        Removes each tag matched by the given NBT path, and returns the
+        number of tags removed.
+        """
+
+        return NBTPath.compile(path).remove(self)
+
 
 class _DataTag(_Tag):
     __slots__ = ()
@@ -146,47 +230,6 @@ class _DataTag(_Tag):
     def to_bytes(self, use_mutf8=True):
         return Buffer.pack(self.fmt, self.value)
 
-    def diff(self, other, order_matters=True, show_values=False, path=''):
-        if type(self) != type(other):
-            print(f'Diff at path {path!r}: type')
-            if show_values:
-                print(f'  -  self is type: {type( self)}')
-                print(f'  - other is type: {type(other)}')
-            return True
-
-        if self.to_obj() != other.to_obj():
-            print(f'Diff at path {path!r}: value')
-            if show_values:
-                print(f'  -  self is: { self.to_obj()}')
-                print(f'  - other is: {other.to_obj()}')
-            return True
-
-        return False
-
-    def has_path(self, path):
-        path = self._nbt_path_node_prefix_check(path)
-        return not path.can_read()
-
-    def at_path(self, path):
-        path = self._nbt_path_node_prefix_check(path)
-        if not path.can_read():
-            return self
-        else:
-            raise KeyError(f'{type(self)!s} cannot contain other tags, and is the end of path {path!r}')
-
-    def count_multipath(self, path):
-        path = self._nbt_path_node_prefix_check(path)
-        if not path.can_read():
-            return 1
-        else:
-            return 0
-
-    def iter_multipath_pair(self, path):
-        path = self._nbt_path_node_prefix_check(path)
-        if not path.can_read():
-            yield ('', self)
-
-
 class _ArrayTag(_Tag):
     __slots__ = ()
     width = None
@@ -209,36 +252,9 @@ class _ArrayTag(_Tag):
     def to_obj(self):
         return list(self.value)
 
-    def diff(self, other, order_matters=True, show_values=False, path=''):
-        if type(self) != type(other):
-            print(f'Diff at path {path!r}: type')
-            if show_values:
-                print(f'  -  self is type: {type( self)}')
-                print(f'  - other is type: {type(other)}')
-            return True
-
-        if len(self.value) != len(other.value):
-            print(f'Diff at path {path!r}: length')
-            if show_values:
-                print(f'  -  self is length: {len( self)}')
-                print(f'  - other is length: {len(other)}')
-            return True
-
-        different = False
-        for i in range(len(self.value)):
-            subpath = f'{path}[{i}]'
-            if self.value[i] != other.value[i]:
-                print(f'Diff at path {subpath!r}: value')
-                if show_values:
-                    print(f'  -  self is: { self.value[i]}')
-                    print(f'  - other is: {other.value[i]}')
-                different = True
-
-        return different
-
     def is_subset(self, other):
         if (
-            type(other) != type(self) or
+            _tag_kind(other) is not _tag_kind(self) or
             len(other) != len(self)
         ):
             return False
@@ -247,161 +263,21 @@ class _ArrayTag(_Tag):
                 return False
         return True
 
-    def to_mojangson(self, sort=None, highlight=False):
-        prefix = self.prefix[highlight]
-        separator = self.separator[highlight]
-        type_postfix = self.type_postfix[highlight]
-        postfix = self.postfix[highlight]
-
-        inner_mojangson = []
-        for content in self.value:
-            # Converted packed unsigned values to signed values
-            if content >= (1<<(self.width - 1)):
-                content -= (1<<(self.width))
-            inner_mojangson.append(f'{content!s}{type_postfix}')
-        return f'{prefix}{separator.join(inner_mojangson)}{postfix}'
-
     def to_json(self):
-        inner_json = []
-        for content in self.value:
-            # Converted packed unsigned values to signed values
-            if content >= (1<<(self.width - 1)):
-                content -= (1<<(self.width))
-            inner_json.append(content)
-        return inner_json
-
-    def tree(self, sort=None, indent='    ', level=0, highlight=True):
-        prefix = self.prefix[highlight]
-        separator = self.separator[highlight]
-        type_postfix = self.type_postfix[highlight]
-        postfix = self.postfix[highlight]
-
-        inner_mojangson = []
-        for content in self.value:
-            inner_mojangson.append(f'{content!s}{type_postfix}')
-
-        if len(inner_mojangson) <= 8:
-            result = f'{prefix}{separator.join(inner_mojangson)}{postfix}'
-        else:
-            result = f'{prefix}{separator.join(inner_mojangson[:8])}{separator}...({len(inner_mojangson)!s} entries total){postfix}'
-
-        if level == 0:
-            print(result)
-        else:
-            return result
-
-    def has_path(self, path):
-        path = self._nbt_path_node_prefix_check(path)
-        if not path.can_read():
-            return True
-        if path.peek() != '[':
-            return False
-        path.skip()
+        return self.to_signed_list()
 
-        # Index case - list[#]
-        index = path.read_int()
-        if not path.can_read() or path.peek() != ']':
-            return False
-        path.skip()
-        self._nbt_path_node_suffix_check(path)
-        if path.can_read():
-            raise KeyError(f'{type(self)!s} cannot contain other tags, and is the end of path {path!r}')
-        if -len(self.value) > index or index >= len(self.value):
-            return False
-        return self.value[index].has_path(path)
-
-    def at_path(self, path):
-        path = self._nbt_path_node_prefix_check(path)
-        if not path.can_read():
-            return self
-        if path.peek() != '[':
-            raise SyntaxError("Cannot index numeric array without [].")
-        path.skip()
-
-        # Index case - list[#]
-        index = path.read_int()
-        if not path.can_read() or path.peek() != ']':
-            raise SyntaxError("Unterminated NBT path: Missing ']'")
-        path.skip()
-        self._nbt_path_node_suffix_check(path)
-        if path.can_read():
-            raise KeyError(f'{type(self)!s} cannot contain other tags, and is the end of path {path!r}')
-        if -len(self.value) > index or index >= len(self.value):
-            raise IndexError(f'Index {index!s} not in range ({len(self.value)!s} entries)')
-        return self.value[index].at_path(path)
-
-    def count_multipath(self, path):
-        path = self._nbt_path_node_prefix_check(path)
-        if not path.can_read():
-            return 1
-        if path.peek() != '[':
-            # Wrong type here, but could be the right type for a sibling tag
-            return 0
-        path.skip()
-        if not path.can_read():
-            raise SyntaxError("Unterminated NBT path: Missing ']'")
-
-        count = 0
-        if path.peek() == ']':
-            # All children case - list[]
-            path.skip()
-            self._nbt_path_node_suffix_check(path)
-            if path.can_read():
-                # Last node here, but a sibling tag could have children
-                return 0
-            for child in self.value:
-                count += 1
-            return count
-
-        # Index case - list[#]
-        index = path.read_int()
-        if not path.can_read() or path.peek() != ']':
-            raise SyntaxError("Unterminated NBT path: Missing ']'")
-        path.skip()
-        self._nbt_path_node_suffix_check(path)
-        if path.can_read():
-            # Last node here, but a sibling tag could have children
-            return 0
-        if -len(self.value) > index or index >= len(self.value):
-            return 0
-        return 1
-
-    def iter_multipath_pair(self, path):
-        path = self._nbt_path_node_prefix_check(path)
-        if not path.can_read():
-            yield ('', self)
-            return
-        if path.peek() != '[':
-            # Wrong type here, but could be the right type for a sibling tag
-            return
-        path.skip()
-        if not path.can_read():
-            raise SyntaxError("Unterminated NBT path: Missing ']'")
-
-        count = 0
-        if path.peek() == ']':
-            # All children case - list[]
-            path.skip()
-            self._nbt_path_node_suffix_check(path)
-            if path.can_read():
-                raise KeyError(f'{type(self)!s} cannot contain other tags, and is the end of path {path!r}')
-            for index, child in enumerate(self.value):
-                yield (f'[{index}]', child)
-            return
+    def to_signed_list(self):
+        """
+        Returns the values of this array as a list of signed integers.
+        """
 
-        # Index case - list[#]
-        index = path.read_int()
-        if not path.can_read() or path.peek() != ']':
-            raise SyntaxError("Unterminated NBT path: Missing ']'")
-        path.skip()
-        self._nbt_path_node_suffix_check(path)
-        if path.can_read():
-            raise KeyError(f'{type(self)!s} cannot contain other tags, and is the end of path {path!r}')
-        if -len(self.value) > index or index >= len(self.value):
-            return
-        for subpath, tag in self.value[index].iter_multipath_pair(path):
-            yield (nbt_path_join(f'[{index}]', subpath), tag)
+        value = self.value
+        if value.value_width == value.sector_width == self.width:
+            return value.to_view(signed=True).tolist()
 
+        # Storage has been repacked, e.g. by BlockArray.from_nbt()
+        sign = 1 << (self.width - 1)
+        return [item - (item & sign) * 2 for item in value.to_list()]
 
 # NBT tags --------------------------------------------------------------------
 
@@ -463,108 +339,19 @@ class TagString(_Tag):
     @classmethod
     def from_buff(cls, buff, use_mutf8=True):
         string_length = buff.unpack('H')
-        raw_bytes = buff.read(string_length)
-        if use_mutf8:
-            try:
-                value = decode_modified_utf8(raw_bytes)
-            except Exception:
-                try:
-                    raw_bytes.decode(encoding='utf-8')
-                    print(f"Failed to decode {raw_bytes!r} as Java's mutf8; appears to be normal utf8. This affects saving as well, so please update calling code.")
-                except Exception:
-                    print(f"Failed to decode {raw_bytes!r} as Java's mutf8; does not appear to be normal utf8 either?")
-                raise
-        else:
-            try:
-                value = raw_bytes.decode(encoding='utf-8')
-            except Exception:
-                try:
-                    decode_modified_utf8(raw_bytes)
-                    print(f"Failed to decode {raw_bytes!r} as normal utf8; appears to be Java's mutf8. This affects saving as well, so please update calling code.")
-                except Exception:
-                    print(f"Failed to decode {raw_bytes!r} as normal utf8; does not appear to be Java's mutf8 either?")
-                raise
-        return cls(value)
+        return cls(_decode_string(buff.read(string_length), use_mutf8))
 
     def to_bytes(self, use_mutf8=True):
-        if use_mutf8:
-            data = encode_modified_utf8(self.value)
-        else:
-            data = self.value.encode(encoding='utf-8')
-        return Buffer.pack('H', len(data)) + data
-
-    def diff(self, other, order_matters=True, show_values=False, path=''):
-        if type(self) != type(other):
-            print(f'Diff at path {path!r}: type')
-            if show_values:
-                print(f'  -  self is type: {type( self)}')
-                print(f'  - other is type: {type(other)}')
-            return True
-
-        if self.to_obj() != other.to_obj():
-            print(f'Diff at path {path!r}: value')
-            if show_values:
-                print(f'  -  self is: { self.to_obj()}')
-                print(f'  - other is: {other.to_obj()}')
-            return True
-
-        return False
-
-    def has_path(self, path):
-        path = self._nbt_path_node_prefix_check(path)
-        return not path.can_read()
-
-    def at_path(self, path):
-        path = self._nbt_path_node_prefix_check(path)
-        self._nbt_path_node_suffix_check(path)
-        if not path.can_read():
-            return self
-        else:
-            raise KeyError(f'{type(self)!s} cannot contain other tags, and is the end of path {path!r}')
-
-    def count_multipath(self, path):
-        path = self._nbt_path_node_prefix_check(path)
-        self._nbt_path_node_suffix_check(path)
-        if not path.can_read():
-            return 1
-        else:
-            return 0
-
-    def iter_multipath_pair(self, path):
-        path = self._nbt_path_node_prefix_check(path)
-        self._nbt_path_node_suffix_check(path)
-        if not path.can_read():
-            yield ('', self)
+        return _encode_string(self.value, use_mutf8)
 
     @staticmethod
     def escape_value(text):
-        text = text.replace('\\', '\\\\')
-        if TagString.use_single_quotes(text):
-            text = text.replace("'", "\\'")
-        else:
-            text = text.replace('"', '\\"')
-        return text
+        return _quote_string(text)[1]
 
     @staticmethod
     def quote_value(text):
-        q = "'" if TagString.use_single_quotes(text) else '"'
-        return q + TagString.escape_value(text) + q
-
-    def to_mojangson(self, sort=None, highlight=False):
-        prefix = self.prefix[highlight]
-        postfix = self.postfix[highlight]
-
-        text = self.escape_value(self.value)
-        if highlight:
-            text = ansify_text(text, show_section=True)
-        return f'{prefix}{text}{postfix}'
-
-    def tree(self, sort=None, indent='    ', level=0, highlight=True):
-        result = self.to_mojangson(highlight=highlight)
-        if level == 0:
-            print(result)
-        else:
-            return result
+        quote, text = _quote_string(text)
+        return quote + text + quote
 
 
 class TagByteArray(_ArrayTag):
@@ -605,911 +392,2737 @@ class TagList(_Tag):
 
     @classmethod
     def from_buff(cls, buff, use_mutf8=True):
-        inner_kind_id, array_length = buff.unpack('bi')
-        inner_kind = _kinds[inner_kind_id]
-        return cls([inner_kind.from_buff(buff, use_mutf8) for _ in range(array_length)])
+        return _decode_from_buff(buff, cls, use_mutf8)
 
     def to_bytes(self, use_mutf8=True):
-        if len(self.value) > 0:
-            head = self.value[0]
-        else:
-            head = TagByte(0)
-
-        return Buffer.pack('bi', _ids[type(head)], len(self.value)) + \
-               b"".join(tag.to_bytes(use_mutf8) for tag in self.value)
+        return bytes(_encode(self, use_mutf8))
 
     def to_obj(self):
         return [tag.to_obj() for tag in self.value]
 
-    def diff(self, other, order_matters=True, show_values=False, path=''):
-        if type(self) != type(other):
-            print(f'Diff at path {path!r}: type')
-            if show_values:
-                print(f'  -  self is type: {type( self)}')
-                print(f'  - other is type: {type(other)}')
-            return True
-
-        if len(self.value) != len(other.value):
-            print(f'Diff at path {path!r}: length')
-            if show_values:
-                print(f'  -  self is length: {len( self)}')
-                print(f'  - other is length: {len(other)}')
-            return True
-
-        different = False
-        for i in range(len(self.value)):
-            different |= self.value[i].diff(other.value[i], order_matters, show_values, '{}[{}]'.format(path, i))
-        return different
-
     def is_subset(self, other):
-        if type(other) != TagList:
+        if _tag_kind(other) is not TagList:
             return False
         for self_value in self.value:
             if not any(self_value.is_subset(other_value) for other_value in other.value):
                 return False
         return True
 
-    def to_mojangson(self, sort=None, highlight=False):
-        prefix = self.prefix[highlight]
-        separator = self.separator[highlight]
-        postfix = self.postfix[highlight]
+    def to_json(self):
+        return [content.to_json() for content in self.value]
+
+class TagCompound(_Tag):
+    __slots__ = ()
+
+    root = False
+    preserve_order = True
+    prefix = ('{', f'{get_format("white").ansi_code}{{{get_format("gold").ansi_code}')
+    postfix = ('}', f'{get_format("white").ansi_code}}}{get_format("reset").ansi_code}')
+    separator = (',', f'{get_format("white").ansi_code}, {get_format("gold").ansi_code}')
+    key_value_separator = (':', f'{get_format("white").ansi_code}: ')
+    regexUnquotedString = re.compile(r'''[A-Za-z0-9._+-]+''')
+
+    @classmethod
+    def from_buff(cls, buff, use_mutf8=True):
+        return _decode_from_buff(buff, cls, use_mutf8)
+
+    def to_bytes(self, use_mutf8=True):
+        return bytes(_encode(self, use_mutf8))
+
+    def to_obj(self):
+        return dict((name, tag.to_obj()) for name, tag in self.value.items())
+
+    def update(self, other_tag):
+        for name, new_tag in other_tag.value.items():
+            old_tag = self.value.get(name)
+
+            if old_tag and not new_tag:
+                del self.value[name]
+            elif isinstance(old_tag, TagCompound) \
+                    and isinstance(new_tag, TagCompound):
+                self.value[name].update(new_tag)
+            else:
+                self.value[name] = new_tag
+
+    def diff(self, other, order_matters=True, show_values=True, path=''):
+        return super().diff(other, order_matters, show_values, path)
 
-        inner_mojangson = []
-        for content in self.value:
-            inner_mojangson.append(content.to_mojangson(sort, highlight))
-        return f'{prefix}{separator.join(inner_mojangson)}{postfix}'
+    def is_subset(self, other):
+        if _tag_kind(other) is not TagCompound:
+            return False
+        other_value = other.value
+        for key, value in self.value.items():
+            other_child = other_value.get(key, _missing)
+            if other_child is _missing or not value.is_subset(other_child):
+                return False
+        return True
 
     def to_json(self):
-        return [content.to_json() for content in self.value]
+        inner_json = {}
+        for key in self.value.keys():
+            inner_json[key] = self.value[key].to_json()
+        return inner_json
 
-    def tree(self, sort=None, indent='    ', level=0, highlight=True):
-        prefix = f'{self.prefix[highlight]}\n'
-        separator = f'{self.separator[highlight]}\n'
-        postfix = f'{indent*level}{self.postfix[highlight]}'
+    @classmethod
+    def from_mojangson(cls, json):
+        """Convert a Mojangson string into NBT"""
+        return MojangsonParser(json).parse_compound()
 
-        inner_mojangson = []
-        for content in self.value:
-            inner_mojangson.append(indent*(level+1) + content.tree(sort, indent, level+1, highlight=highlight))
+class MojangsonParser(object):
+    """Convert MojangSON into Quarry's NBT format.
 
-        if len(inner_mojangson) == 0:
-            result = f'{prefix}{postfix}'
-        else:
-            result = f'{prefix}{separator.join(inner_mojangson)}\n{postfix}'
+    Example: {display:{Name:"{\"text\":\"Excaliber\"}"}}
+    """
 
-        if level == 0:
-            print(result)
+    def __init__(self, json):
+        if isinstance(json, StringReader):
+            self.reader = json
         else:
-            return result
+            self.reader = StringReader(json)
 
-    def has_path(self, path):
-        path = self._nbt_path_node_prefix_check(path)
-        if not path.can_read():
-            return True
-        if path.peek() != '[':
-            # Wrong type here, but could be the right type for a sibling tag
-            return False
-        path.skip()
-        if not path.can_read():
-            raise SyntaxError("Unterminated NBT path: Missing ']'")
+    def parse_literal(self, literal_str):
+        match = _snbt_token.match(literal_str)
+        kind = match.lastgroup
+        if kind in ('int_suffix', 'float_suffix', 'word') and \
+                match.start(_snbt_groups.get(kind, kind)) == 0 and \
+                match.end() == len(literal_str):
+            return _snbt_literal(match)
+        return TagString(literal_str)
 
-        count = 0
-        if path.peek() == ']':
-            # All children case - list[]
-            path.skip()
-            self._nbt_path_node_suffix_check(path)
-            cursor = path.get_cursor()
-            for child in self.value:
-                path.set_cursor(cursor)
-                if child.has_path(path):
-                    return True
-            return False
+    def parse_any_tag(self):
+        return _parse_mojangson(self.reader)
 
-        # Index case - list[#]
-        index = path.read_int()
-        if not path.can_read() or path.peek() != ']':
-            raise SyntaxError("Unterminated NBT path: Missing ']'")
-        path.skip()
-        self._nbt_path_node_suffix_check(path)
-        if -len(self.value) > index or index >= len(self.value):
-            return False
-        return self.value[index].has_path(path)
+    def parse_compound(self):
+        return _parse_mojangson(self.reader, compound=True)
 
-    def at_path(self, path):
-        path = self._nbt_path_node_prefix_check(path)
-        if not path.can_read():
-            return self
-        if path.peek() != '[':
-            # Wrong type here, but could be the right type for a sibling tag
-            raise SyntaxError(f"Unexpected character in NBT path of TagList: {path.peek()!r}")
-        path.skip()
-        if not path.can_read():
-            raise SyntaxError("Unterminated NBT path: Missing ']'")
-
-        # Index case - list[#]
-        index = path.read_int()
-        if not path.can_read() or path.peek() != ']':
-            raise SyntaxError("Unterminated NBT path: Missing ']'")
-        path.skip()
-        self._nbt_path_node_suffix_check(path)
-        if -len(self.value) > index or index >= len(self.value):
-            return False
-        return self.value[index].at_path(path)
+    def raise_error(self, msg):
+        _snbt_error(self.reader, self.reader.cursor, msg)
 
-    def count_multipath(self, path):
-        path = self._nbt_path_node_prefix_check(path)
-        if not path.can_read():
-            return 1
-        if path.peek() != '[':
-            # Wrong type here, but could be the right type for a sibling tag
-            return 0
-        path.skip()
-        if not path.can_read():
-            raise SyntaxError("Unterminated NBT path: Missing ']'")
+class TagRoot(TagCompound):
+    __slots__ = ()
+    root = True
 
-        count = 0
-        if path.peek() == ']':
-            # All children case - list[]
-            path.skip()
-            self._nbt_path_node_suffix_check(path)
-            cursor = path.get_cursor()
-            for child in self.value:
-                path.set_cursor(cursor)
-                count += child.count_multipath(path)
-            return count
-
-        if path.peek() == '{':
-            # List of matching compounds case - list[{}]
-            child_must_match = TagCompound.from_mojangson(path) # advances cursor; raises SyntaxError
-            if not path.can_read() or path.peek() != ']':
-                raise SyntaxError("Unterminated NBT path: Missing ']'")
-            self._nbt_path_node_suffix_check(path)
-            cursor = path.get_cursor()
-            for child in self.value:
-                path.set_cursor(cursor)
-                if not child_must_match.is_subset(child):
-                    continue
-                count += child.count_multipath(path)
-            return count
-
-        # Index case - list[#]
-        index = path.read_int()
-        if not path.can_read() or path.peek() != ']':
-            raise SyntaxError("Unterminated NBT path: Missing ']'")
-        path.skip()
-        self._nbt_path_node_suffix_check(path)
-        if -len(self.value) > index or index >= len(self.value):
-            return 0
-        return self.value[index].count_multipath(path)
+    @classmethod
+    def from_body(cls, body):
+        return cls({"": body})
 
-    def iter_multipath_pair(self, path):
-        path = self._nbt_path_node_prefix_check(path)
-        if not path.can_read():
-            yield ('', self)
-            return
-        if path.peek() != '[':
-            # Wrong type here, but could be the right type for a sibling tag
-            return
-        path.skip()
-        if not path.can_read():
-            raise SyntaxError("Unterminated NBT path: Missing ']'")
+    @property
+    def body(self):
+        return self.value[""]
+
+
+# Register tags ---------------------------------------------------------------
+
+_kinds[0] = type(None)
+_kinds[1] = TagByte
+_kinds[2] = TagShort
+_kinds[3] = TagInt
+_kinds[4] = TagLong
+_kinds[5] = TagFloat
+_kinds[6] = TagDouble
+_kinds[7] = TagByteArray
+_kinds[8] = TagString
+_kinds[9] = TagList
+_kinds[10] = TagCompound
+_kinds[11] = TagIntArray
+_kinds[12] = TagLongArray
+_ids.update({v: k for k, v in _kinds.items()})
+
+
+# Mojangson output ------------------------------------------------------------
+
+def _quote_string(text):
+    """
+    Returns the quote character and escaped contents of an SNBT string.
+    Single quotes are used if the first quote in the text is a double quote.
+    """
+
+    match = TagString.regexQuote.search(text)
+    quote = "'" if match is not None and match[0] == '"' else '"'
+    if '\\' in text:
+        text = text.replace('\\', '\\\\')
+    if match is not None:
+        text = text.replace(quote, '\\' + quote)
+    return quote, text
+
+
+def _mojangson_key(key):
+    if TagCompound.regexUnquotedString.fullmatch(key):
+        return key
+    quote, text = _quote_string(key)
+    return quote + text + quote
+
+
+def _mojangson_keys(tag, sort):
+    keys = tag.value.keys()
+    if isinstance(sort, list):
+        ordered = [key for key in sort if key in keys]
+        ordered.extend(key for key in sorted(keys) if key not in sort)
+        return ordered
+    return keys
+
+
+def _mojangson_leaf(tag, highlight, max_array_length):
+    """
+    Returns the SNBT text of a tag that isn't a list or compound.
+    """
+
+    if isinstance(tag, TagString):
+        quote, text = _quote_string(tag.value)
+        if not highlight:
+            return quote + text + quote
+        return (f'{_format_white}{quote}{_format_green}'
+                f'{ansify_text(text, show_section=True)}'
+                f'{_format_white}{quote}{_format_reset}')
+
+    if isinstance(tag, _ArrayTag):
+        separator = tag.separator[highlight]
+        type_postfix = tag.type_postfix[highlight]
+        values = tag.to_signed_list()
+        length = len(values)
+        if max_array_length is not None and length > max_array_length:
+            del values[max_array_length:]
+        text = (type_postfix + separator).join(map(str, values))
+        if values:
+            text += type_postfix
+        if len(values) < length:
+            text += f'{separator}...({length} entries total)'
+        return f'{tag.prefix[highlight]}{text}{tag.postfix[highlight]}'
+
+    return f'{tag.prefix[highlight]}{tag.value!s}{tag.postfix[highlight]}'
+
+
+def _iter_mojangson(tag, sort=None, highlight=False, indent=None, level=0,
+                    max_depth=None, max_array_length=None):
+    """
+    Yields pieces of the SNBT text of a tag. If *indent* is given, lists and
+    compounds are split over multiple lines, starting at the given *level*
+    of indentation. Containers nested deeper than *max_depth* are shown as
+    ``...``, and arrays longer than *max_array_length* are truncated.
+    """
+
+    highlight = 1 if highlight else 0
+    newline = '' if indent is None else '\n'
+    stack = []
+    node = tag
+    while True:
+        if not isinstance(node, (TagCompound, TagList)):
+            yield _mojangson_leaf(node, highlight, max_array_length)
+        elif max_depth is not None and len(stack) >= max_depth:
+            yield f'{node.prefix[highlight]}...{node.postfix[highlight]}'
+        else:
+            compound = isinstance(node, TagCompound)
+            children = iter(_mojangson_keys(node, sort) if compound
+                            else node.value)
+            yield node.prefix[highlight] + newline
+            stack.append([node, compound, children, True, level + len(stack)])
+
+        # Find the next tag to emit, closing finished containers
+        while stack:
+            frame = stack[-1]
+            parent, compound, children, first, depth = frame
+            child = next(children, _missing)
+            if child is _missing:
+                stack.pop()
+                if indent is None:
+                    yield parent.postfix[highlight]
+                elif first:
+                    yield f'{indent * depth}{parent.postfix[highlight]}'
+                else:
+                    yield f'\n{indent * depth}{parent.postfix[highlight]}'
+                continue
+
+            if first:
+                frame[3] = False
+            else:
+                yield parent.separator[highlight] + newline
+            if indent is not None:
+                yield indent * (depth + 1)
+            if compound:
+                yield (_mojangson_key(child) +
+                       parent.key_value_separator[highlight])
+                child = parent.value[child]
+            node = child
+            break
+        else:
+            return
+
+
+def _write_mojangson(fp, pieces, buffer_size=65536):
+    """
+    Writes pieces of text to a file object in batches of roughly
+    *buffer_size* characters.
+    """
+
+    batch = []
+    size = 0
+    for piece in pieces:
+        batch.append(piece)
+        size += len(piece)
+        if size >= buffer_size:
+            fp.write(''.join(batch))
+            batch.clear()
+            size = 0
+    if batch:
+        fp.write(''.join(batch))
+
+
+_format_white = get_format("white").ansi_code
+_format_green = get_format("green").ansi_code
+_format_reset = get_format("reset").ansi_code
+
+
+# Mojangson -------------------------------------------------------------------
+
+_snbt_token = re.compile(r'''
+    [ \t\n\r\x0b\x0c]*
+    (?:
+        (?P<int>[-+]?(?:0|[1-9][0-9]*))(?P<int_suffix>[bslBSL]?)
+        (?![\w.+-])
+    |
+        (?P<float>[-+]?(?:[0-9]+[.]?|[0-9]*[.][0-9]+)(?:[eE][-+]?[0-9]+)?)
+        (?P<float_suffix>[fdFD]?)
+        (?![\w.+-])
+    |
+        (?P<word>[\w.+-]+)
+    |
+        (?P<quote>["'])
+    |
+        (?P<char>.)
+    |
+        (?P<end>\Z)
+    )''', re.VERBOSE | re.DOTALL | re.ASCII)
+
+_snbt_groups = {'int_suffix': 'int', 'float_suffix': 'float'}
+_snbt_space = re.compile(r'[ \t\n\r\x0b\x0c]*')
+_snbt_word = re.compile(r'[\w.+-]*', re.ASCII)
+_snbt_quoted = {
+    '"': re.compile(r'"((?:[^"\\]|\\["\\])*)"', re.DOTALL),
+    "'": re.compile(r"'((?:[^'\\]|\\['\\])*)'", re.DOTALL)}
+_snbt_escape = re.compile(r'\\(.)', re.DOTALL)
+
+_snbt_int_kinds = {
+    '': TagInt,
+    'b': TagByte, 'B': TagByte,
+    's': TagShort, 'S': TagShort,
+    'l': TagLong, 'L': TagLong}
+_snbt_float_kinds = {
+    '': TagDouble,
+    'f': TagFloat, 'F': TagFloat,
+    'd': TagDouble, 'D': TagDouble}
+_snbt_eof = {
+    '{': "Failed to parse TagCompound element",
+    '[': "Unexpected end of array",
+    'B': "Unexpected end of numeric array elements",
+    'I': "Unexpected end of numeric array elements",
+    'L': "Unexpected end of numeric array elements"}
+_snbt_array_kinds = {
+    'B': (TagByteArray, TagByte),
+    'I': (TagIntArray, TagInt),
+    'L': (TagLongArray, TagLong)}
+
+
+def _snbt_literal(match):
+    """
+    Returns a tag for a matched unquoted token.
+    """
+
+    kind = match.lastgroup
+    if kind == 'int_suffix':
+        return _snbt_int_kinds[match.group(kind)](int(match.group('int')))
+    if kind == 'float_suffix':
+        suffix = match.group(kind)
+        text = match.group('float')
+        if suffix or '.' in text:
+            return _snbt_float_kinds[suffix](float(text))
+        return TagString(text)
+    text = match.group('word')
+    lower = text.lower()
+    if lower == 'true':
+        return TagByte(1)
+    if lower == 'false':
+        return TagByte(0)
+    return TagString(text)
+
+
+def _snbt_string(reader, pos):
+    """
+    Reads a quoted string, returning the string and the position after it.
+    """
+
+    text = reader.string
+    match = _snbt_quoted[text[pos]].match(text, pos)
+    if match is None:
+        # Let the reader raise the appropriate error
+        reader.cursor = pos
+        reader.read_quoted_string()
+    value = match.group(1)
+    if '\\' in value:
+        value = _snbt_escape.sub(r'\1', value)
+    return value, match.end()
+
+
+def _snbt_error(reader, pos, message):
+    reader.cursor = pos
+    raise SyntaxError(f"{message} at ->{reader.string[pos:]}")
+
+
+def _snbt_expect(reader, pos, char):
+    reader.cursor = pos
+    raise BuiltInExceptions.reader_expected_symbol().create_with_context(
+        reader, char)
+
+
+def _snbt_close(frame):
+    kind, values = frame[0], frame[1]
+    if kind == '{':
+        return TagCompound(values)
+    if kind == '[':
+        return TagList(values)
+    array_type = _snbt_array_kinds[kind][0]
+    return array_type(PackedArray.from_int_list(values, array_type.width))
+
+
+def _parse_mojangson(reader, compound=False):
+    """
+    Parses a Mojangson (SNBT) value from the current position of a
+    ``StringReader``, and advances the reader past it. If *compound* is true,
+    the value must be a compound. On failure, the reader is left at the
+    position of the error.
+
+    Containers are parsed with an explicit stack of frames. Each frame holds
+    the container kind (``{``, ``[`` or an array type character), a
+    dictionary or list of values, the type of elements, and the current
+    compound key or the position of the current element.
+    """
+
+    text = reader.string
+    length = len(text)
+    token = _snbt_token.match
+    space = _snbt_space.match
+    pos = reader.cursor
+    stack = []
+
+    while True:
+        # Parse a value starting at or after pos
+        match = token(text, pos)
+        kind = match.lastgroup
+        start = match.start(_snbt_groups.get(kind, kind))
+        if compound and not stack and text[start:start + 1] != '{':
+            _snbt_expect(reader, start, '{')
+
+        if kind == 'char' and match.group(kind) in '{[':
+            if match.group(kind) == '{':
+                stack.append(['{', collections.OrderedDict(), None, None])
+                pos = space(text, start + 1).end()
+            elif (start + 3 <= length and text[start + 1] not in '"\'' and
+                    text[start + 2] == ';'):
+                array_kind = text[start + 1]
+                pos = space(text, start + 3).end()
+                if pos >= length:
+                    _snbt_error(reader, pos, "Unexpected end of numeric array")
+                if array_kind not in _snbt_array_kinds:
+                    _snbt_error(reader, start + 1, "Unexpected type character "
+                                f"{array_kind!r} in numeric array")
+                stack.append(
+                    [array_kind, [], _snbt_array_kinds[array_kind][1], None])
+            else:
+                pos = space(text, start + 1).end()
+                if pos >= length:
+                    _snbt_error(reader, pos,
+                                "Failed to parse non-numeric array")
+                stack.append(['[', [], None, None])
+            tag = None
+
+        elif kind == 'quote':
+            value, pos = _snbt_string(reader, start)
+            tag = TagString(value)
+        elif kind == 'char':
+            _snbt_error(reader, start,
+                        "Failed to parse literal or string value")
+        elif kind == 'end':
+            _snbt_error(reader, start, "Failed while parsing value")
+        else:
+            tag = _snbt_literal(match)
+            pos = match.end()
+
+        while True:
+            if tag is not None:
+                # Add a finished value to its container
+                if not stack:
+                    reader.cursor = pos
+                    return tag
+                frame = stack[-1]
+                if frame[0] == '{':
+                    frame[1][frame[3]] = tag
+                elif frame[2] is not None and type(tag) != frame[2]:
+                    _snbt_error(reader, frame[3], "Mixed types in list! "
+                                f"{frame[2]!s} != {type(tag)!s}")
+                elif frame[0] == '[':
+                    frame[1].append(tag)
+                    frame[2] = type(tag)
+                else:
+                    frame[1].append(tag.value)
+
+                # Find the next element or the end of the container
+                pos = space(text, pos).end()
+                if pos < length and text[pos] == ',':
+                    pos = space(text, pos + 1).end()
+                    if pos >= length:
+                        _snbt_error(reader, pos, _snbt_eof[frame[0]])
+                else:
+                    closer = '}' if frame[0] == '{' else ']'
+                    if pos >= length or text[pos] != closer:
+                        _snbt_expect(reader, pos, closer)
+
+            # Close the container, or parse the next element
+            frame = stack[-1]
+            closer = '}' if frame[0] == '{' else ']'
+            if pos >= length:
+                _snbt_expect(reader, pos, closer)
+            if text[pos] == closer:
+                stack.pop()
+                tag = _snbt_close(frame)
+                pos += 1
+                continue
+
+            if frame[0] == '{':
+                # Parse a compound key
+                start = pos
+                if text[pos] in '"\'':
+                    key, pos = _snbt_string(reader, pos)
+                else:
+                    pos = _snbt_word.match(text, pos).end()
+                    key = text[start:pos]
+                if not key:
+                    _snbt_error(reader, start,
+                                "Failed to parse TagCompound key")
+                pos = space(text, pos).end()
+                if pos >= length or text[pos] != ':':
+                    _snbt_expect(reader, pos, ':')
+                frame[3] = key
+                pos += 1
+            else:
+                frame[3] = pos
+            break
+
+
+# Paths -----------------------------------------------------------------------
+
+_path_key = 0
+_path_filter = 1
+_path_all = 2
+_path_index = 3
+_path_match = 4
+
+
+class NBTPath(object):
+    """
+    A compiled NBT path such as ``Items[{Slot:0b}].tag.display.Name``.
+
+    Paths are parsed once into a tuple of steps; any ``{...}`` filters are
+    parsed into :class:`TagCompound` objects at the same time. Use
+    :meth:`compile` rather than the constructor, as it caches compiled
+    paths by their string. The path methods of tags, such as
+    :meth:`_Tag.at_path`, delegate to this class.
+
+    Elements of array tags are given as ``int`` objects.
+    """
+
+    __slots__ = ('path', 'steps', 'multiple')
+
+    def __init__(self, path):
+        #: The path string.
+        self.path = path
+
+        #: Tuple of ``(op, argument, text)`` steps.
+        self.steps = tuple(self._parse(path))
+
+        #: Whether the path contains ``[]`` or ``[{...}]`` steps.
+        self.multiple = any(op in (_path_all, _path_match)
+                            for op, _, _ in self.steps)
+
+    def __repr__(self):
+        return "NBTPath(%r)" % self.path
+
+    @classmethod
+    def compile(cls, path):
+        """
+        Returns a compiled path. The argument may be a string, a
+        ``StringReader`` (whose remaining text is used) or a compiled path.
+        """
+
+        if isinstance(path, NBTPath):
+            return path
+        if isinstance(path, StringReader):
+            path = path.get_remaining()
+        return _compile_path(path)
+
+    @staticmethod
+    def _error(reader, message="Invalid NBT path element"):
+        cursor = reader.get_cursor()
+        context = reader.get_string()[:cursor][-10:]
+        return SyntaxError(f"{message} at position {cursor}: "
+                           f"{'...' if cursor > 10 else ''}{context}<--[HERE]")
+
+    @classmethod
+    def _parse(cls, path):
+        reader = StringReader(path)
+        while reader.can_read():
+            char = reader.peek()
+            if char == '{':
+                # Filter on the current tag - {...}
+                yield (_path_filter, TagCompound.from_mojangson(reader), '')
+
+            elif char == '[':
+                reader.skip()
+                if not reader.can_read():
+                    raise SyntaxError("Unterminated NBT path: Missing ']'")
+                if reader.peek() == ']':
+                    # All children - list[]
+                    step = (_path_all, None, None)
+                elif reader.peek() == '{':
+                    # Matching compounds - list[{...}]
+                    step = (_path_match,
+                            TagCompound.from_mojangson(reader), None)
+                else:
+                    # Index - list[#]
+                    step = (_path_index, reader.read_int(), None)
+                if not reader.can_read() or reader.peek() != ']':
+                    raise SyntaxError("Unterminated NBT path: Missing ']'")
+                reader.skip()
+                yield step
+
+            elif char in ' .]}\\':
+                raise cls._error(reader)
+
+            else:
+                start = reader.get_cursor()
+                if char == '"':
+                    # Quoted tag name (allows unusual characters)
+                    name, reader.cursor = _snbt_string(reader, start)
+                else:
+                    # Unquoted tag name
+                    while reader.can_read() and reader.peek() not in ' .[]{}"':
+                        reader.skip()
+                    name = path[start:reader.get_cursor()]
+                yield (_path_key, name, path[start:reader.get_cursor()])
+                if reader.can_read() and reader.peek() not in '.[{':
+                    raise cls._error(reader, "Expected [, { or .")
+
+            # Check for the end of the path or a node separator
+            if reader.can_read():
+                if reader.peek() == '.':
+                    reader.skip()
+                elif reader.peek() not in '[{' or char == '{' and reader.peek() == '{':
+                    raise cls._error(reader)
+
+    # Evaluation --------------------------------------------------------------
+
+    def iter_pairs(self, tag):
+        """
+        Yields ``(path, tag)`` pairs for every tag matched by this path, in
+        document order.
+        """
+
+        return _iter_path(self.steps, tag)
+
+    def iter(self, tag):
+        """
+        Yields every tag matched by this path, in document order.
+        """
+
+        for _, node in self.iter_pairs(tag):
+            yield node
+
+    def count(self, tag):
+        """
+        Returns the number of tags matched by this path.
+        """
+
+        return sum(1 for _ in self.iter_pairs(tag))
+
+    def exists(self, tag):
+        """
+        Returns ``True`` if this path matches at least one tag.
+        """
+
+        for _ in self.iter_pairs(tag):
+            return True
+        return False
+
+    def get(self, tag):
+        """
+        Returns the single tag selected by this path. Raises ``KeyError`` if
+        a compound key is missing, a filter doesn't match, or a tag is of the
+        wrong type, and ``IndexError`` if an index is out of range. Paths
+        containing ``[]`` or ``[{...}]`` raise ``KeyError`` if they match
+        nothing and ``ValueError`` if they match more than one tag.
+        """
+
+        if self.multiple:
+            matches = list(itertools.islice(self.iter(tag), 2))
+            if not matches:
+                raise KeyError(f"NBT path {self.path!r} matches nothing")
+            if len(matches) > 1:
+                raise ValueError(f"NBT path {self.path!r} matches more than "
+                                 f"one tag")
+            return matches[0]
+
+        node = tag
+        for op, arg, text in self.steps:
+            if op == _path_filter:
+                if not arg.is_subset(node):
+                    raise KeyError(f"{_describe(node)} does not match "
+                                   f"{arg.to_mojangson()}")
+            elif op == _path_key:
+                if not isinstance(node, TagCompound):
+                    raise KeyError(f"{_describe(node)} cannot contain "
+                                   f"key {arg!r}")
+                if arg not in node.value:
+                    raise KeyError(f"{arg!r} not in {list(node.value)!r}")
+                node = node.value[arg]
+            elif op == _path_index:
+                if not isinstance(node, (TagList, _ArrayTag)):
+                    raise KeyError(f"{_describe(node)} cannot be indexed")
+                if not -len(node.value) <= arg < len(node.value):
+                    raise IndexError(f"Index {arg} not in range "
+                                     f"({len(node.value)} entries)")
+                node = node.value[arg % len(node.value)]
+        return node
+
+    def _targets(self, tag):
+        """
+        Yields ``(parent, index or key)`` pairs for every tag matched by this
+        path, in document order. Compound keys that are missing are yielded
+        if the path has no trailing filters.
+        """
+
+        steps = self.steps
+        last = len(steps)
+        while last and steps[last - 1][0] == _path_filter:
+            last -= 1
+        if last == 0:
+            raise ValueError("NBT path %r selects the root tag" % self.path)
+        filters = [arg for _, arg, _ in steps[last:]]
+        step = steps[last - 1]
+
+        for _, parent in _iter_path(steps[:last - 1], tag):
+            if (step[0] == _path_key and not filters and
+                    isinstance(parent, TagCompound)):
+                yield parent, step[1]
+                continue
+            for key, child, _ in _select(parent, step, ''):
+                if all(f.is_subset(child) for f in filters):
+                    yield parent, key
+
+    def set(self, tag, value):
+        """
+        Replaces every tag matched by this path with *value*, and returns the
+        number of replacements made. Missing compound keys at the end of the
+        path are created. The first match receives *value* itself; further
+        matches receive copies of it.
+        """
+
+        targets = list(self._targets(tag))
+        for count, (parent, key) in enumerate(targets):
+            if isinstance(parent, _ArrayTag):
+                item = value.value if isinstance(value, _Tag) else value
+                parent.value[key] = item & ((1 << parent.width) - 1)
+            else:
+                parent.value[key] = value if count == 0 else value.deep_copy()
+        return len(targets)
+
+    def remove(self, tag):
+        """
+        Removes every tag matched by this path, and returns the number of
+        tags removed.
+        """
+
+        removed = {}
+        for parent, key in self._targets(tag):
+            if isinstance(parent, TagCompound) and key not in parent.value:
+                continue
+            removed.setdefault(id(parent), (parent, []))[1].append(key)
+
+        count = 0
+        for parent, keys in removed.values():
+            count += len(keys)
+            if isinstance(parent, _ArrayTag):
+                keys = set(keys)
+                parent.value = PackedArray.from_int_list(
+                    [item for index, item in enumerate(parent.value)
+                     if index not in keys],
+                    parent.width)
+            elif isinstance(parent, TagList):
+                for index in sorted(set(keys), reverse=True):
+                    del parent.value[index]
+            else:
+                for key in keys:
+                    del parent.value[key]
+        return count
+
+
+class NBTQuery(object):
+    """
+    A set of NBT paths that are evaluated together in a single traversal of a
+    tree. Paths are merged into a prefix trie, so steps shared between paths
+    are only evaluated once.
+
+    *paths* may be a mapping of query IDs to paths, or a sequence of paths
+    whose positions are used as query IDs. Paths may be strings or
+    :class:`NBTPath` objects.
+    """
+
+    def __init__(self, paths):
+        if not isinstance(paths, collections.abc.Mapping):
+            paths = dict(enumerate(paths))
+
+        #: Dictionary of query IDs and compiled paths.
+        self.paths = {query_id: NBTPath.compile(path)
+                      for query_id, path in paths.items()}
+
+        #: Prefix trie of steps. Each node is a ``(query_ids, children)``
+        #: tuple, where *children* maps steps to nodes.
+        self.trie = ([], {})
+
+        #: List of paths suitable for the *include* argument of
+        #: :meth:`_Tag.from_bytes`, or ``None`` if every tag must be decoded.
+        self.include = []
+
+        for query_id, path in self.paths.items():
+            node = self.trie
+            for step in path.steps:
+                node = node[1].setdefault(step, ([], {}))
+            node[0].append(query_id)
+            self._add_include(path)
+
+    def __repr__(self):
+        return "NBTQuery(%r)" % {query_id: path.path
+                                 for query_id, path in self.paths.items()}
+
+    def _add_include(self, path):
+        if self.include is None:
+            return
+        parts = []
+        for op, arg, text in path.steps:
+            if op == _path_filter:
+                break
+            if op == _path_key:
+                if not arg or _include_special.search(arg):
+                    self.include = None
+                    return
+                parts.append(arg)
+            else:
+                parts.append('[]')
+                if op == _path_match:
+                    break
+        if not parts:
+            self.include = None
+            return
+        self.include.append('.'.join(parts).replace('.[]', '[]'))
+
+    def iter(self, tag):
+        """
+        Yields a ``(query_id, path, tag)`` tuple for every tag matched by any
+        path, walking the tree once. The results for each query are given in
+        document order.
+        """
+
+        stack = [(tag, self.trie, '')]
+        while stack:
+            node, (query_ids, children), path = stack.pop()
+            for query_id in query_ids:
+                yield query_id, path, node
+
+            pending = []
+            for step, child_trie in children.items():
+                op, arg, text = step
+                if op == _path_filter:
+                    if arg.is_subset(node):
+                        pending.append((node, child_trie, path))
+                elif op == _path_key:
+                    if isinstance(node, TagCompound) and arg in node.value:
+                        pending.append((
+                            node.value[arg], child_trie,
+                            f'{path}.{text}' if path else text))
+                else:
+                    for _, child, child_path in _select(node, step, path):
+                        pending.append((child, child_trie, child_path))
+            pending.reverse()
+            stack.extend(pending)
+
+    def iter_root(self, root):
+        """
+        Like :meth:`iter`, but paths are relative to the body of the given
+        ``TagRoot``, as with the *include* argument of
+        :meth:`_Tag.from_bytes`.
+        """
+
+        for body in root.value.values():
+            return self.iter(body)
+        return iter(())
+
+
+_include_special = re.compile(r'[.\[\]]')
+
+
+def _select(node, step, path):
+    """
+    Yields ``(index or key, child, path)`` tuples for the children of
+    *node* selected by a non-filter *step*.
+    """
+
+    op, arg, text = step
+    if op == _path_key:
+        if isinstance(node, TagCompound) and arg in node.value:
+            yield arg, node.value[arg], f'{path}.{text}' if path else text
+    elif op == _path_index:
+        if isinstance(node, (TagList, _ArrayTag)):
+            value = node.value
+            if -len(value) <= arg < len(value):
+                yield arg % len(value), value[arg], f'{path}[{arg}]'
+    elif op == _path_all:
+        if isinstance(node, (TagList, _ArrayTag)):
+            for index, child in enumerate(node.value):
+                yield index, child, f'{path}[{index}]'
+    elif op == _path_match:
+        if isinstance(node, TagList):
+            for index, child in enumerate(node.value):
+                if arg.is_subset(child):
+                    yield index, child, f'{path}[{index}]'
+
+
+def _iter_path(steps, tag):
+    """
+    Yields ``(path, tag)`` pairs for every tag matched by the given path
+    steps, in document order.
+    """
+
+    last = len(steps)
+    stack = [(tag, 0, '')]
+    while stack:
+        node, i, path = stack.pop()
+        while i < last and steps[i][0] == _path_filter:
+            if not steps[i][1].is_subset(node):
+                break
+            i += 1
+        else:
+            if i == last:
+                yield path, node
+                continue
+            step = steps[i]
+            if step[0] == _path_key:
+                # Fast path for the common case
+                if isinstance(node, TagCompound) and step[1] in node.value:
+                    stack.append((
+                        node.value[step[1]], i + 1,
+                        f'{path}.{step[2]}' if path else step[2]))
+            else:
+                children = [(child, i + 1, child_path) for _, child, child_path
+                        in _select(node, step, path)]
+                children.reverse()
+                stack.extend(children)
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_path(path):
+    return NBTPath(path)
+
+
+def _describe(node):
+    if isinstance(node, _Tag):
+        return node.to_mojangson()
+    return repr(node)
+
+
+# Decoding --------------------------------------------------------------------
+
+_struct_H = Buffer.get_struct('H')
+_struct_i = Buffer.get_struct('i')
+_struct_bi = Buffer.get_struct('bi')
+
+_scalar_kinds = {
+    kind_id: (_kinds[kind_id], Buffer.get_struct(_kinds[kind_id].fmt))
+    for kind_id in range(1, 7)}
+
+_array_kinds = {
+    kind_id: (_kinds[kind_id], _kinds[kind_id].width)
+    for kind_id in (7, 11, 12)}
+
+_scalar_sizes = {
+    kind_id: unpacker.size
+    for kind_id, (kind, unpacker) in _scalar_kinds.items()}
+
+
+#: Decoded strings by their serialized bytes, so that repeated keys and
+#: values such as ``"minecraft:stone"`` share one ``str`` object.
+_decoded_strings = {}
+
+#: The maximum number of strings cached; the cache is emptied when full.
+_decoded_strings_max = 4096
+
+#: The maximum length in bytes of strings cached.
+_decoded_string_length_max = 64
+
+
+def _decode_string(raw, use_mutf8=True):
+    """
+    Decodes a string from its serialized bytes, excluding the length prefix.
+    Strings without null or supplementary characters are encoded identically
+    in UTF-8 and mutf8, so they are decoded with the builtin codec and cached.
+    """
+
+    text = _decoded_strings.get(raw)
+    if text is not None:
+        return text
+    if b'\0' not in raw and (raw.isascii() or max(raw) < 0xF0):
+        try:
+            text = raw.decode('utf-8')
+        except UnicodeDecodeError:
+            pass  # mutf8 surrogate pairs, or invalid data
+        else:
+            if len(raw) <= _decoded_string_length_max:
+                if len(_decoded_strings) >= _decoded_strings_max:
+                    _decoded_strings.clear()
+                _decoded_strings[raw] = text
+            return text
+    if use_mutf8:
+        try:
+            return decode_modified_utf8(raw)
+        except Exception:
+            try:
+                raw.decode(encoding='utf-8')
+                print(f"Failed to decode {raw!r} as Java's mutf8; appears to be normal utf8. This affects saving as well, so please update calling code.")
+            except Exception:
+                print(f"Failed to decode {raw!r} as Java's mutf8; does not appear to be normal utf8 either?")
+            raise
+    else:
+        try:
+            return raw.decode(encoding='utf-8')
+        except Exception:
+            try:
+                decode_modified_utf8(raw)
+                print(f"Failed to decode {raw!r} as normal utf8; appears to be Java's mutf8. This affects saving as well, so please update calling code.")
+            except Exception:
+                print(f"Failed to decode {raw!r} as normal utf8; does not appear to be Java's mutf8 either?")
+            raise
+
+
+def _decode(data, pos, cls, use_mutf8=True, include=None, lazy=False,
+            compact=False, interner=None):
+    """
+    Decodes a tag of the given type from *data* (any bytes-like object),
+    starting at offset *pos*. Returns a ``(tag, pos)`` tuple, where *pos* is
+    the offset of the first byte after the tag.
+
+    Tags are decoded in a single pass with an explicit stack, rather than by
+    recursing through ``from_buff()``. See :meth:`_Tag.from_bytes` for the
+    *include*, *lazy*, *compact* and *interner* arguments.
+    """
+
+    if lazy and not isinstance(data, bytes):
+        data = bytes(data)
+    elif not isinstance(data, bytes):
+        data = memoryview(data).cast('B')
+    if isinstance(include, str):
+        include = (include,)
+    node = None if include is None else _compile_include(tuple(include))
+    try:
+        # Root tags contain a single named tag and no end byte.
+        if getattr(cls, 'root', False):
+            value = collections.OrderedDict() \
+                if cls.preserve_order and not compact else {}
+            kind_id = data[pos]
+            pos += 1
+            if kind_id != 0:
+                length, = _struct_H.unpack_from(data, pos)
+                name = _decode_string(
+                    bytes(data[pos + 2:pos + 2 + length]), use_mutf8)
+                value[name], pos = _decode_value(
+                    data, pos + 2 + length, kind_id, use_mutf8, node, lazy,
+                    compact, interner)
+            return cls(value), pos
+
+        kind_id = next(_ids[kind] for kind in cls.__mro__ if kind in _ids)
+        tag, pos = _decode_value(
+            data, pos, kind_id, use_mutf8, node, lazy, compact, interner)
+        if _tag_kind(tag) is not cls:
+            tag = cls(tag.value)
+        return tag, pos
+    except (IndexError, struct.error):
+        raise BufferUnderrun()
+
+
+def _decode_value(data, pos, kind_id, use_mutf8, node=None, lazy=False,
+                  compact=False, interner=None, span=None):
+    """
+    Decodes an unnamed tag of the given kind. Returns a ``(tag, pos)`` tuple.
+
+    If *node* is given, only the compound entries it selects are decoded
+    (see :func:`_compile_include`). If *lazy* is true, nested compounds that
+    are decoded in full are not decoded until first accessed. If *compact*
+    is true, number tags are read-only and shared for small integers,
+    compound keys are interned and lists of numbers are stored as arrays
+    (see :class:`_CompactList`). If
+    *interner* is given, compounds decoded in full are shared through it
+    (see :class:`NBTInterner`). If *span* is given, tags that aren't shared
+    mark it as modified when they change (see :class:`_Span`).
+
+    You should not need to call this function.
+    """
+
+    size = len(data)
+    scalar_kinds = _scalar_kinds
+    array_kinds = _array_kinds
+    unpack_H = _struct_H.unpack_from
+    unpack_i = _struct_i.unpack_from
+    unpack_bi = _struct_bi.unpack_from
+    decoded_strings = _decoded_strings
+    compact_kinds = _compact_kinds if compact else {}
+    compound_type = collections.OrderedDict \
+        if TagCompound.preserve_order and not compact else dict
+
+    # Each frame is a list of [tag type, value, list kind, remaining, name,
+    # node, key, span]. For compounds, the node selects which entries are
+    # decoded; for lists, it applies to every element. The key, if any, is
+    # the interner key of a compound. The span, if any, is marked as
+    # modified by the frame's entries. The bottom frame is a pseudo-list
+    # holding the single result.
+    result = []
+    stack = [[None, result, kind_id, 1, None, node, None, span]]
+    frame = stack[-1]
+
+    while True:
+        value = frame[1]
+
+        # Find the kind (and name, for compounds) of the next entry
+        if frame[2] is None:
+            kind_id = data[pos]
+            pos += 1
+            if kind_id == 0:
+                tag = TagCompound(value)
+            else:
+                length, = unpack_H(data, pos)
+                pos += 2 + length
+                if pos > size:
+                    raise BufferUnderrun()
+                name = bytes(data[pos - length:pos])
+                name = decoded_strings.get(name) or \
+                    _decode_string(name, use_mutf8)
+                if compact:
+                    name = sys.intern(name)
+
+                # Skip unselected entries without decoding them
+                node = frame[5]
+                if node is not None:
+                    if name not in node:
+                        pos = _skip_value(data, pos, kind_id)
+                        continue
+                    node = node[name]
+        elif frame[3] > 0:
+            frame[3] -= 1
+            kind_id = frame[2]
+            name = None
+            node = frame[5]
+        else:
+            kind_id = 0
+            if frame[0] is None:
+                return result[0], pos
+            if frame[7] is None:
+                tag = TagList(value)
+            else:
+                tag = _tracked_kinds[TagList](
+                    _TrackedList(value, frame[7]), frame[7])
+
+        # Finish the current container and add it to its parent
+        if kind_id == 0:
+            name = frame[4]
+            if frame[6] is not None:
+                _freeze(tag)
+                interner.tags[frame[6]] = tag
+            stack.pop()
+            frame = stack[-1]
+            if frame[2] is None:
+                frame[1][name] = tag
+            else:
+                frame[1].append(tag)
+            continue
+
+        # Decode the entry
+        span = frame[7]
+        if kind_id in scalar_kinds:
+            kind, unpacker = scalar_kinds[kind_id]
+            if compact:
+                tag = _shared_scalar(kind, unpacker.unpack_from(data, pos)[0])
+            elif span is None:
+                tag = kind(unpacker.unpack_from(data, pos)[0])
+            else:
+                tag = _tracked_kinds[kind](
+                    unpacker.unpack_from(data, pos)[0], span)
+            pos += unpacker.size
+        elif kind_id == 8:
+            length, = unpack_H(data, pos)
+            pos += 2 + length
+            if pos > size:
+                raise BufferUnderrun()
+            string = bytes(data[pos - length:pos])
+            string = decoded_strings.get(string) or \
+                _decode_string(string, use_mutf8)
+            if span is None:
+                tag = TagString(string)
+            else:
+                tag = _tracked_kinds[TagString](string, span)
+        elif kind_id in array_kinds:
+            kind, width = array_kinds[kind_id]
+            length, = unpack_i(data, pos)
+            start = pos + 4
+            pos = start + length * (width // 8)
+            if pos > size:
+                raise BufferUnderrun()
+            if span is None:
+                tag = kind(PackedArray.from_bytes(
+                    data[start:pos], length, width, width))
+            else:
+                values = _TrackedArray.from_bytes(
+                    data[start:pos], length, width, width)
+                values.span = span
+                tag = _tracked_kinds[kind](values, span)
+        elif kind_id == 10:
+            key = tag = None
+            if interner is not None and node is None:
+                key, tag, end = interner._lookup(data, pos, use_mutf8)
+            if tag is not None:
+                pos = end
+            elif lazy and node is None and len(stack) > 1 and key is None:
+                end = _skip_value(data, pos, kind_id)
+                if span is None:
+                    tag = TagCompound(None)
+                else:
+                    tag = _tracked_kinds[TagCompound](None, span)
+                _set_value(tag, _LazyCompound(
+                    tag, data, pos, end, use_mutf8, compact, interner, span))
+                pos = end
+            else:
+                # Interned compounds are shared, and not tracked
+                frame = [TagCompound, compound_type(), None, 0, name, node,
+                         key, span if key is None else None]
+                stack.append(frame)
+                continue
+        elif kind_id == 9:
+            inner_kind_id, length = unpack_bi(data, pos)
+            pos += 5
+            if length > 0 and not 0 < inner_kind_id < len(_kinds):
+                raise ValueError("Unknown NBT tag type: %d" % inner_kind_id)
+            if length > 0 and inner_kind_id in compact_kinds:
+                kind, typecode, width = compact_kinds[inner_kind_id]
+                start = pos
+                pos += length * width
+                if pos > size:
+                    raise BufferUnderrun()
+                values = array.array(typecode)
+                values.frombytes(data[start:pos])
+                if _swap and width > 1:
+                    values.byteswap()
+                if span is None:
+                    tag = TagList(None)
+                else:
+                    tag = _tracked_kinds[TagList](None, span)
+                _set_value(tag, _CompactList(tag, kind, values))
+            else:
+                if node is not None:
+                    node = node.get('[]', node)
+                frame = [TagList, [], inner_kind_id, length, name, node,
+                         None, span]
+                stack.append(frame)
+                continue
+        else:
+            raise ValueError("Unknown NBT tag type: %d" % kind_id)
+
+        if name is None:
+            value.append(tag)
+        else:
+            value[name] = tag
+
+
+def _skip_value(data, pos, kind_id):
+    """
+    Returns the offset of the first byte after an unnamed tag of the given
+    kind, without decoding it.
+
+    You should not need to call this function.
+    """
+
+    size = len(data)
+    unpack_H = _struct_H.unpack_from
+    unpack_i = _struct_i.unpack_from
+    unpack_bi = _struct_bi.unpack_from
+
+    # Each frame is a [list kind, remaining] pair, where the list kind is
+    # None for compounds.
+    stack = [[kind_id, 1]]
+    while stack:
+        frame = stack[-1]
+        if frame[0] is None:
+            kind_id = data[pos]
+            pos += 1
+            if kind_id == 0:
+                stack.pop()
+                continue
+            pos += 2 + unpack_H(data, pos)[0]
+        elif frame[1] > 0:
+            kind_id = frame[0]
+            if kind_id in _scalar_sizes:
+                pos += _scalar_sizes[kind_id] * frame[1]
+                frame[1] = 0
+                continue
+            frame[1] -= 1
+        else:
+            stack.pop()
+            continue
+
+        if kind_id in _scalar_sizes:
+            pos += _scalar_sizes[kind_id]
+        elif kind_id == 8:
+            pos += 2 + unpack_H(data, pos)[0]
+        elif kind_id in _array_kinds:
+            pos += 4 + unpack_i(data, pos)[0] * (_array_kinds[kind_id][1] // 8)
+        elif kind_id == 10:
+            stack.append([None, 0])
+        elif kind_id == 9:
+            inner_kind_id, length = unpack_bi(data, pos)
+            pos += 5
+            if length > 0 and not 0 < inner_kind_id < len(_kinds):
+                raise ValueError("Unknown NBT tag type: %d" % inner_kind_id)
+            stack.append([inner_kind_id, max(length, 0)])
+        else:
+            raise ValueError("Unknown NBT tag type: %d" % kind_id)
+
+    if pos > size:
+        raise BufferUnderrun()
+    return pos
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_include(include):
+    """
+    Compiles a tuple of paths such as ``"sections[].block_states"`` into a
+    tree of dictionaries mapping compound keys (or ``"[]"`` for list
+    elements) to child nodes. A node of ``None`` selects a tag in full.
+
+    You should not need to call this function.
+    """
+
+    tree = {}
+    for path in include:
+        parts = _include_part.findall(path)
+        if not parts:
+            return None
+        node = tree
+        for part in parts[:-1]:
+            child = node.setdefault(part, {})
+            if child is None:
+                break
+            node = child
+        else:
+            node[parts[-1]] = None
+    return tree
+
+
+_include_part = re.compile(r'\[\]|[^.\[\]]+')
+
+
+class _LazyCompound(collections.abc.MutableMapping):
+    """
+    Mapping of compound entries that are decoded from their serialized form
+    on first access. Once decoded, the owning tag's value is replaced with
+    an ordinary dictionary.
+    """
+
+    __slots__ = ('owner', 'data', 'start', 'end', 'use_mutf8', 'compact',
+                 'interner', 'parent', 'decoded')
+
+    def __init__(self, owner, data, start, end, use_mutf8, compact=False,
+                 interner=None, parent=None):
+        self.owner = owner
+        self.data = data
+        self.start = start
+        self.end = end
+        self.use_mutf8 = use_mutf8
+        self.compact = compact
+        self.interner = interner
+        self.parent = parent
+        self.decoded = None
+
+    def __repr__(self):
+        if self.decoded is None:
+            return "<lazy compound: %d bytes>" % (self.end - self.start)
+        return repr(self.decoded)
+
+    def decode(self):
+        """
+        Decodes and returns the entries, replacing the owning tag's value.
+        """
+
+        if self.decoded is None:
+            span = _Span(
+                self.data, self.start, self.end, self.use_mutf8, self.parent)
+            tag, _ = _decode_value(
+                self.data, self.start, 10, self.use_mutf8, lazy=True,
+                compact=self.compact, interner=self.interner, span=span)
+            decoded = _SpannedDict(tag.value)
+            decoded.span = span
+            _set_value(self.owner, decoded)
+            self.decoded = decoded
+            self.owner = self.data = self.interner = self.parent = None
+        return self.decoded
+
+    def raw(self, use_mutf8=True):
+        """
+        Returns the serialized entries if they have not been decoded, or
+        ``None`` otherwise.
+        """
+
+        if self.decoded is None and use_mutf8 == self.use_mutf8:
+            return self.data[self.start:self.end]
+
+    def __getitem__(self, key):
+        return self.decode()[key]
+
+    def __setitem__(self, key, value):
+        self.decode()[key] = value
+
+    def __delitem__(self, key):
+        del self.decode()[key]
+
+    def __iter__(self):
+        return iter(self.decode())
+
+    def __len__(self):
+        return len(self.decode())
+
+
+class _Span(object):
+    """
+    The serialized form of a lazily decoded compound, and whether the
+    compound has been modified since it was decoded. Tags within the
+    compound mark its span as modified when they change, and modifications
+    are propagated to the span of the enclosing compound, if any.
+    """
+
+    __slots__ = ('data', 'start', 'end', 'use_mutf8', 'parent', 'dirty')
+
+    def __init__(self, data, start, end, use_mutf8, parent=None):
+        self.data = data
+        self.start = start
+        self.end = end
+        self.use_mutf8 = use_mutf8
+        self.parent = parent
+        self.dirty = False
+
+    def __repr__(self):
+        return "<span: %d bytes%s>" % (
+            self.end - self.start, ", modified" if self.dirty else "")
+
+    def mark_dirty(self):
+        """
+        Marks this span and the spans enclosing it as modified.
+        """
+
+        span = self
+        while span is not None and not span.dirty:
+            span.dirty = True
+            span = span.parent
+
+    def raw(self, use_mutf8=True):
+        """
+        Returns the serialized entries if the compound hasn't been modified,
+        or ``None`` otherwise.
+        """
+
+        if not self.dirty and use_mutf8 == self.use_mutf8:
+            return memoryview(self.data)[self.start:self.end]
+
+
+class _SpannedDict(dict):
+    """
+    Entries of a lazy compound that has been decoded. The *span* attribute
+    holds a :class:`_Span`, which is marked as modified when entries are
+    changed, so that the compound can be written back without re-encoding
+    if it hasn't been modified.
+    """
+
+    __slots__ = ('span',)
+
+    def __setitem__(self, key, value):
+        self.span.mark_dirty()
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.span.mark_dirty()
+        dict.__delitem__(self, key)
+
+    def __ior__(self, other):
+        self.span.mark_dirty()
+        return dict.__ior__(self, other)
+
+    def clear(self):
+        self.span.mark_dirty()
+        dict.clear(self)
+
+    def pop(self, *args):
+        self.span.mark_dirty()
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self.span.mark_dirty()
+        return dict.popitem(self)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.span.mark_dirty()
+        return dict.setdefault(self, key, default)
+
+    def update(self, *args, **kwargs):
+        self.span.mark_dirty()
+        dict.update(self, *args, **kwargs)
+
+
+class _TrackedList(list):
+    """
+    Elements of a list within a lazily decoded compound, which mark the
+    compound's span as modified when changed.
+    """
+
+    __slots__ = ('span',)
+
+    def __init__(self, values, span):
+        list.__init__(self, values)
+        self.span = span
+
+    def __setitem__(self, index, value):
+        self.span.mark_dirty()
+        list.__setitem__(self, index, value)
+
+    def __delitem__(self, index):
+        self.span.mark_dirty()
+        list.__delitem__(self, index)
+
+    def __iadd__(self, other):
+        self.span.mark_dirty()
+        return list.__iadd__(self, other)
+
+    def __imul__(self, count):
+        self.span.mark_dirty()
+        return list.__imul__(self, count)
+
+    def append(self, value):
+        self.span.mark_dirty()
+        list.append(self, value)
+
+    def extend(self, values):
+        self.span.mark_dirty()
+        list.extend(self, values)
+
+    def insert(self, index, value):
+        self.span.mark_dirty()
+        list.insert(self, index, value)
+
+    def pop(self, *args):
+        self.span.mark_dirty()
+        return list.pop(self, *args)
+
+    def remove(self, value):
+        self.span.mark_dirty()
+        list.remove(self, value)
+
+    def clear(self):
+        self.span.mark_dirty()
+        list.clear(self)
+
+    def reverse(self):
+        self.span.mark_dirty()
+        list.reverse(self)
+
+    def sort(self, *args, **kwargs):
+        self.span.mark_dirty()
+        list.sort(self, *args, **kwargs)
+
+
+class _TrackedArray(PackedArray):
+    """
+    Values of an array tag within a lazily decoded compound, which mark the
+    compound's span as modified when changed.
+    """
+
+    span = None
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name == 'storage' and self.span is not None:
+            self.span.mark_dirty()
+
+    def __setitem__(self, item, value):
+        self.span.mark_dirty()
+        PackedArray.__setitem__(self, item, value)
+
+    def from_list(self, values):
+        self.span.mark_dirty()
+        PackedArray.from_list(self, values)
+
+
+class _TrackedTag(object):
+    """
+    Mixin for tags within a lazily decoded compound, which mark the
+    compound's span as modified when their value is reassigned.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, value, span):
+        _set_value(self, value)
+        object.__setattr__(self, 'span', span)
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        self.span.mark_dirty()
+
+
+class _CompactList(collections.abc.MutableSequence):
+    """
+    Sequence of number tags stored as an ``array.array`` of their values.
+    Read-only tags are created on access, sharing instances for small
+    integers. Once modified, the owning tag's value is replaced with an
+    ordinary list.
+    """
+
+    __slots__ = ('owner', 'kind', 'values', 'decoded')
+
+    def __init__(self, owner, kind, values):
+        self.owner = owner
+        self.kind = kind
+        self.values = values
+        self.decoded = None
+
+    def __repr__(self):
+        if self.decoded is None:
+            return "<compact list: %d %s values>" % (
+                len(self.values), self.kind.__name__)
+        return repr(self.decoded)
+
+    def decode(self):
+        """
+        Returns the tags as a list, replacing the owning tag's value.
+        """
+
+        if self.decoded is None:
+            kind = self.kind
+            decoded = [_shared_scalar(kind, value) for value in self.values]
+            self.owner.value = decoded
+            self.decoded = decoded
+            self.owner = self.values = None
+        return self.decoded
+
+    def to_bytes(self):
+        """
+        Returns the big-endian values if the tags have not been decoded, or
+        ``None`` otherwise.
+        """
+
+        if self.decoded is None:
+            if _swap and self.values.itemsize > 1:
+                values = array.array(self.values.typecode, self.values)
+                values.byteswap()
+                return values.tobytes()
+            return self.values.tobytes()
+
+    def __getitem__(self, index):
+        if self.decoded is not None:
+            return self.decoded[index]
+        if isinstance(index, slice):
+            return [_shared_scalar(self.kind, value)
+                    for value in self.values[index]]
+        return _shared_scalar(self.kind, self.values[index])
+
+    def __iter__(self):
+        if self.decoded is not None:
+            return iter(self.decoded)
+        kind = self.kind
+        return (_shared_scalar(kind, value) for value in self.values)
+
+    def __len__(self):
+        if self.decoded is not None:
+            return len(self.decoded)
+        return len(self.values)
+
+    def __setitem__(self, index, value):
+        self.decode()[index] = value
+
+    def __delitem__(self, index):
+        del self.decode()[index]
+
+    def insert(self, index, value):
+        self.decode().insert(index, value)
+
+
+class _FrozenTag(object):
+    """
+    Mixin for read-only tags, which may be shared between trees. Their value
+    can't be reassigned; replace the tag in its parent instead. Read-only
+    tags are copied as ordinary tags by :meth:`_Tag.deep_copy`.
+    """
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(
+            "%s is read-only and may be shared; replace it rather than "
+            "modifying it" % type(self).__name__)
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError("Entries of shared tags are read-only; use deep_copy() "
+                    "to get a tag that can be modified")
+
+
+class _FrozenDict(dict):
+    """
+    Entries of a read-only compound.
+    """
+
+    __slots__ = ()
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = \
+        setdefault = update = _read_only
+
+
+class _FrozenList(list):
+    """
+    Elements of a read-only list.
+    """
+
+    __slots__ = ()
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = append = extend = \
+        insert = pop = remove = clear = reverse = sort = _read_only
+
+
+class _FrozenArray(PackedArray):
+    """
+    Values of a read-only array tag.
+    """
+
+    __setattr__ = __setitem__ = from_list = purge = _read_only
+
+
+def _freeze(tag):
+    """
+    Makes a tree read-only in place, so that it can be shared. Tags that are
+    already read-only are not walked.
+    """
+
+    stack = [tag]
+    while stack:
+        tag = stack.pop()
+        frozen = _frozen_kinds.get(type(tag))
+        if frozen is None:
+            continue
+        value = tag.value
+        if isinstance(tag, TagCompound):
+            if type(value) is not _LazyCompound:
+                _set_value(tag, _FrozenDict(value))
+                stack.extend(value.values())
+        elif isinstance(tag, TagList):
+            if type(value) is not _CompactList or value.decoded is not None:
+                _set_value(tag, _FrozenList(value))
+                stack.extend(value)
+        elif isinstance(tag, _ArrayTag):
+            value.__class__ = _FrozenArray
+        tag.__class__ = frozen
+
+
+def _frozen_tag(kind, value):
+    """
+    Returns a read-only tag of the given kind and value.
+    """
+
+    frozen = _frozen_kinds[kind]
+    tag = frozen.__new__(frozen)
+    _set_value(tag, value)
+    return tag
+
+
+def _shared_scalar(kind, value):
+    """
+    Returns a read-only number tag of the given kind and value. Tags for
+    small integers are shared.
+    """
+
+    shared = _shared_scalars.get(kind)
+    if shared is None:
+        return _frozen_tag(kind, value)
+    tag = shared.get(value)
+    if tag is None:
+        tag = _frozen_tag(kind, value)
+        if -128 <= value < 1024:
+            shared[value] = tag
+    return tag
+
+
+def _tag_kind(tag):
+    """
+    Returns the type of a tag, treating read-only tags as their ordinary
+    type.
+    """
+
+    kind = type(tag)
+    return _base_kinds.get(kind, kind)
+
+
+#: Sets the value of a tag, bypassing the check in read-only tags.
+_set_value = _Tag.value.__set__
+
+#: Read-only variants of tag types, variants for tags within lazily
+#: decoded compounds, and the reverse mapping.
+_frozen_kinds = {}
+_tracked_kinds = {}
+_base_kinds = {}
+for _kind in _kinds.values():
+    if _kind is not type(None):
+        _frozen_kinds[_kind] = type(
+            _kind.__name__, (_FrozenTag, _kind), {'__slots__': ()})
+        _tracked_kinds[_kind] = type(
+            _kind.__name__, (_TrackedTag, _kind), {'__slots__': ('span',)})
+        for _variant in (_frozen_kinds[_kind], _tracked_kinds[_kind]):
+            _base_kinds[_variant] = _kind
+            _ids[_variant] = _ids[_kind]
+del _kind, _variant
+
+
+#: Whether numbers must be byte-swapped to and from big-endian order.
+_swap = sys.byteorder == 'little'
+
+#: Shared integer tags by kind and value, filled as they are decoded.
+_shared_scalars = {TagByte: {}, TagShort: {}, TagInt: {}, TagLong: {}}
+
+#: List element kinds stored by :class:`_CompactList`, with their
+#: ``array.array`` typecodes and widths in bytes.
+_compact_kinds = {
+    kind_id: (kind, kind.fmt, unpacker.size)
+    for kind_id, (kind, unpacker) in _scalar_kinds.items()
+    if array.array(kind.fmt).itemsize == unpacker.size}
+
+
+def _decode_from_buff(buff, cls, use_mutf8=True):
+    """
+    Decodes a tag from the current position of a buffer.
+    """
+
+    buff.inflate()
+    tag, buff.pos = _decode(buff.buff, buff.pos, cls, use_mutf8)
+    return tag
 
-        count = 0
-        if path.peek() == ']':
-            # All children case - list[]
-            path.skip()
-            self._nbt_path_node_suffix_check(path)
-            cursor = path.get_cursor()
-            for index, child in enumerate(self.value):
-                path.set_cursor(cursor)
-                for subpath, tag in child.iter_multipath_pair(path):
-                    yield (nbt_path_join(f'[{index}]', subpath), tag)
-            return
 
-        if path.peek() == '{':
-            # List of matching compounds case - list[{}]
-            child_must_match = TagCompound.from_mojangson(path) # advances cursor; raises SyntaxError
-            if not path.can_read() or path.peek() != ']':
-                raise SyntaxError("Unterminated NBT path: Missing ']'")
-            self._nbt_path_node_suffix_check(path)
-            cursor = path.get_cursor()
-            for index, child in enumerate(self.value):
-                path.set_cursor(cursor)
-                if not child_must_match.is_subset(child):
-                    continue
-                for subpath, tag in child.iter_multipath_pair(path):
-                    yield (nbt_path_join(f'[{index}]', subpath), tag)
-            return
+# Encoding --------------------------------------------------------------------
 
-        # Index case - list[#]
-        index = path.read_int()
-        if not path.can_read() or path.peek() != ']':
-            raise SyntaxError("Unterminated NBT path: Missing ']'")
-        path.skip()
-        self._nbt_path_node_suffix_check(path)
-        if -len(self.value) > index or index >= len(self.value):
-            return
-        for subpath, tag in self.value[index].iter_multipath_pair(path):
-            yield (nbt_path_join(f'[{index}]', subpath), tag)
+#: Maximum number of compound keys kept in the encoded key cache.
+_encoded_keys_max = 4096
 
+#: Encoded (length-prefixed) forms of ASCII compound keys.
+_encoded_keys = {}
 
-class TagCompound(_Tag):
-    __slots__ = ()
+#: Compound keys that are cached up front.
+_common_keys = (
+    'Name', 'Properties', 'id', 'Count', 'Slot', 'tag', 'Damage', 'display',
+    'Lore', 'Enchantments', 'lvl', 'Items', 'x', 'y', 'z', 'Y', 'Pos',
+    'Motion', 'Rotation', 'UUID', 'palette', 'data', 'block_states',
+    'biomes', 'BlockLight', 'SkyLight', 'sections', 'block_entities')
 
-    root = False
-    preserve_order = True
-    prefix = ('{', f'{get_format("white").ansi_code}{{{get_format("gold").ansi_code}')
-    postfix = ('}', f'{get_format("white").ansi_code}}}{get_format("reset").ansi_code}')
-    separator = (',', f'{get_format("white").ansi_code}, {get_format("gold").ansi_code}')
-    key_value_separator = (':', f'{get_format("white").ansi_code}: ')
-    regexUnquotedString = re.compile(r'''[A-Za-z0-9._+-]+''')
 
-    @classmethod
-    def from_buff(cls, buff, use_mutf8=True):
-        if cls.preserve_order:
-            value = collections.OrderedDict()
+def _encode_string(text, use_mutf8=True):
+    """
+    Encodes a string with its length prefix.
+    """
+
+    if text.isascii() and '\0' not in text:
+        data = text.encode('ascii')
+    elif not use_mutf8:
+        data = text.encode(encoding='utf-8')
+    elif '\0' in text:
+        data = encode_modified_utf8(text)
+    else:
+        # Only null and supplementary characters differ from UTF-8
+        try:
+            data = text.encode('utf-8')
+        except UnicodeEncodeError:
+            data = encode_modified_utf8(text)
         else:
-            value = {}
+            if max(data) >= 0xF0:
+                data = encode_modified_utf8(text)
+    return _struct_H.pack(len(data)) + data
 
-        while True:
-            kind_id = buff.unpack('b')
-            if kind_id == 0:
-                return cls(value)
-            kind = _kinds[kind_id]
-            name = TagString.from_buff(buff, use_mutf8).value
-            tag = kind.from_buff(buff, use_mutf8)
-            value[name] = tag
-            if cls.root:
-                return cls(value)
 
-    def to_bytes(self, use_mutf8=True):
-        string = b""
-        for name, tag in self.value.items():
-            string += Buffer.pack('b', _ids[type(tag)])
-            string += TagString(name).to_bytes(use_mutf8)
-            string += tag.to_bytes(use_mutf8)
+def _encode_key(name, use_mutf8=True):
+    """
+    Encodes a compound key with its length prefix. ASCII keys without null
+    characters are cached, as they are encoded identically with and without
+    mutf8.
+    """
 
-        if len(self.value) == 0 or not self.root:
-            string += Buffer.pack('b', 0)
+    try:
+        return _encoded_keys[name]
+    except KeyError:
+        data = _encode_string(name, use_mutf8)
+        if name.isascii() and '\0' not in name and \
+                len(_encoded_keys) < _encoded_keys_max:
+            _encoded_keys[name] = data
+        return data
 
-        return string
 
-    def to_obj(self):
-        return dict((name, tag.to_obj()) for name, tag in self.value.items())
+for _name in _common_keys:
+    _encode_key(_name)
+del _name
 
-    def update(self, other_tag):
-        for name, new_tag in other_tag.value.items():
-            old_tag = self.value.get(name)
 
-            if old_tag and not new_tag:
-                del self.value[name]
-            elif isinstance(old_tag, TagCompound) \
-                    and isinstance(new_tag, TagCompound):
-                self.value[name].update(new_tag)
+def _encode(tag, use_mutf8=True):
+    """
+    Encodes a tag into a ``bytearray``.
+
+    Tags are encoded in a single pass with an explicit stack, appending to
+    one buffer rather than concatenating the bytes of each child.
+    """
+
+    out = bytearray()
+    ids = _ids
+    scalar_kinds = _scalar_kinds
+    pack_bi = _struct_bi.pack
+    pack_i = _struct_i.pack
+
+    # Each frame is an iterator over child tags, or over (name, tag) pairs
+    # for compounds. The bottom frame holds the single tag being encoded.
+    root = tag if getattr(tag, 'root', False) else None
+    if root is not None:
+        stack = [(iter(tag.value.items()), True)]
+    else:
+        stack = [(iter((tag,)), False)]
+
+    while stack:
+        entries, compound = stack[-1]
+        for tag in entries:
+            if compound:
+                name, tag = tag
+                kind_id = ids[type(tag)]
+                out.append(kind_id)
+                out += _encoded_keys.get(name) or _encode_key(name, use_mutf8)
             else:
-                self.value[name] = new_tag
+                kind_id = ids[type(tag)]
+
+            if kind_id in scalar_kinds:
+                out += scalar_kinds[kind_id][1].pack(tag.value)
+            elif kind_id == 8:
+                out += _encode_string(tag.value, use_mutf8)
+            elif kind_id == 10:
+                value = tag.value
+                if type(value) is _LazyCompound:
+                    data = value.raw(use_mutf8)
+                    if data is not None:
+                        out += data
+                        continue
+                elif type(value) is _SpannedDict:
+                    data = value.span.raw(use_mutf8)
+                    if data is not None:
+                        out += data
+                        continue
+                stack.append((iter(value.items()), True))
+                break
+            elif kind_id == 9:
+                value = tag.value
+                if type(value) is _CompactList and value.decoded is None:
+                    out += pack_bi(ids[value.kind], len(value))
+                    out += value.to_bytes()
+                    continue
+                head_id = ids[type(value[0])] if len(value) else 1
+                out += pack_bi(head_id, len(value))
+                stack.append((iter(value), False))
+                break
+            else:
+                data = tag.value.to_bytes()
+                out += pack_i(len(data) // (tag.width // 8))
+                out += data
+        else:
+            stack.pop()
+            if compound:
+                out.append(0)
 
-    def diff(self, other, order_matters=True, show_values=True, path=''):
-        if type(self) != type(other):
-            print(f'Diff at path {path!r}: type')
-            if show_values:
-                print(f'  -  self is type: {type( self)}')
-                print(f'  - other is type: {type(other)}')
-            return True
+    # Root tags have no end byte unless they are empty
+    if root is not None and root.value:
+        del out[-1]
 
-        own_keys = self.value.keys()
-        other_keys = other.value.keys()
-        # Order insensitive
-        if own_keys != other_keys:
-            print(f'Diff at path {path!r}: keys')
-            if show_values:
-                print(f'  - both have keys: {list(own_keys & other_keys)}')
-                print(f'  -  self has keys: {list(own_keys - other_keys)}')
-                print(f'  - other has keys: {list(other_keys - own_keys)}')
-            return True
+    return out
 
-        different = False
-        # Order sensitive
-        if order_matters and list(own_keys) != list(other_keys):
-            print(f'Diff at path {path!r}: key order')
-            if show_values:
-                print(f'  -  self key order: {own_keys}')
-                print(f'  - other key order: {other_keys}')
-            different = True
 
-        # Order insensitive
-        conditional_dot = '' if len(path) == 0 else '.'
-        for key in self.value.keys():
-            subpath = f'{path}{conditional_dot}{key}'
-            if type(self.value[key]) != type(other.value[key]):
-                print(f'Diff at path {subpath!r}: type')
-                if show_values:
-                    print(f'  -  self is type: {type( self.value[key])}')
-                    print(f'  - other is type: {type(other.value[key])}')
-                different = True
-
-            different |= self.value[key].diff(other.value[key], order_matters, show_values, subpath)
-        return different
+# Comparison and copying ------------------------------------------------------
 
-    def is_subset(self, other):
-        if type(other) != TagCompound:
-            return False
-        for aKey in self.value.keys():
-            if (
-                aKey not in other.value.keys() or
-                not self.value[aKey].is_subset(other.value[aKey])
-            ):
-                return False
-        return True
+_missing = object()
+_hash_kinds = {}
 
-    def to_mojangson(self, sort=None, highlight=False):
-        prefix = self.prefix[highlight]
-        key_value_separator = self.key_value_separator[highlight]
-        separator = self.separator[highlight]
-        postfix = self.postfix[highlight]
-
-        if isinstance(sort, list):
-            keys = []
-            for key in sort:
-                if key in self.value.keys():
-                    keys.append(key)
-            for key in sorted(self.value.keys()):
-                if key not in sort:
-                    keys.append(key)
-        else:
-            keys = self.value.keys()
 
-        inner_mojangson = []
-        for key in keys:
-            content = self.value[key]
-            if self.regexUnquotedString.fullmatch(key):
-                key_str = key
+def _hash(tag):
+    """
+    Returns a hash of a tag that is consistent with ``_Tag.__eq__()``.
+    Compound hashes are independent of key order, and a list of integers
+    hashes the same as an equal array.
+    """
+
+    if isinstance(tag, _ArrayTag):
+        return hash(tuple(tag.value.to_list()))
+    if not isinstance(tag, (TagCompound, TagList)):
+        return hash(tag.value)
+
+    # Each frame holds an iterator of children, a list of their hashes,
+    # whether the tag is a compound, and the tag's key in its parent.
+    compound = isinstance(tag, TagCompound)
+    children = iter(tag.value.items() if compound else tag.value)
+    hashes = []
+    stack = [(children, hashes, compound, None)]
+    while True:
+        for child in children:
+            if compound:
+                key, child = child
+            else:
+                key = None
+            kind = _hash_kinds.get(type(child))
+            if kind is None:
+                kind = 2 if isinstance(child, (TagCompound, TagList)) else \
+                    1 if isinstance(child, _ArrayTag) else 0
+            if kind == 0:
+                child_hash = hash(child.value)
+            elif kind == 1:
+                child_hash = hash(tuple(child.value.to_list()))
+            elif type(child.value) is _CompactList and \
+                    child.value.decoded is None:
+                child_hash = hash(tuple(map(hash, child.value.values)))
+            else:
+                compound = isinstance(child, TagCompound)
+                children = iter(
+                    child.value.items() if compound else child.value)
+                hashes = []
+                stack.append((children, hashes, compound, key))
+                break
+            hashes.append((key, child_hash) if compound else child_hash)
+        else:
+            _, _, _, key = stack.pop()
+            if compound:
+                result = hash(frozenset(hashes))
             else:
-                key_str = TagString.quote_value(key)
-            inner_mojangson.append(f'{key_str}{key_value_separator}{content.to_mojangson(sort, highlight)}')
-        return f'{prefix}{separator.join(inner_mojangson)}{postfix}'
+                result = hash(tuple(hashes))
+            if not stack:
+                return result
+            children, hashes, compound, _ = stack[-1]
+            hashes.append((key, result) if compound else result)
 
-    def to_json(self):
-        inner_json = {}
-        for key in self.value.keys():
-            inner_json[key] = self.value[key].to_json()
-        return inner_json
 
-    def tree(self, sort=None, indent='    ', level=0, highlight=True):
-        prefix = f'{self.prefix[highlight]}\n'
-        key_value_separator = self.key_value_separator[highlight]
-        separator = f'{self.separator[highlight]}\n'
-        postfix = f'{indent*level}{self.postfix[highlight]}'
-
-        if isinstance(sort, list):
-            keys = []
-            for key in sort:
-                if key in self.value.keys():
-                    keys.append(key)
-            for key in sorted(self.value.keys()):
-                if key not in sort:
-                    keys.append(key)
-        else:
-            keys = self.value.keys()
+def _leaf_equal(tag, other, exact):
+    if exact:
+        if _tag_kind(tag) is not _tag_kind(other):
+            return False
+        if isinstance(tag, _ArrayTag):
+            return tag.value.to_list() == other.value.to_list()
+        if isinstance(tag, (TagFloat, TagDouble)):
+            return tag.to_bytes() == other.to_bytes()
+        return tag.value == other.value
+    if type(tag) is type(other) and not isinstance(tag, _ArrayTag):
+        return tag.value == other.value
+    return tag.to_obj() == other.to_obj()
 
-        inner_mojangson = []
-        for key in keys:
-            content = self.value[key]
-            if self.regexUnquotedString.fullmatch(key):
-                key_str = key
-            else:
-                key_str = TagString.quote_value(key)
-            inner_mojangson.append(f'{indent*(level+1)}{key_str}{key_value_separator}{content.tree(sort, indent, level+1, highlight=highlight)}')
 
-        if len(inner_mojangson) == 0:
-            result = f'{prefix}{postfix}'
-        else:
-            result = f'{prefix}{separator.join(inner_mojangson)}\n{postfix}'
+def _equal(tag, other, exact=False):
+    """
+    Compares two trees, stopping at the first difference. If *exact* is
+    false, tags are compared like the results of ``to_obj()``; otherwise
+    tag types and compound key order must also match, and floating point
+    values are compared by their representation.
+    """
 
-        if level == 0:
-            print(result)
-        else:
-            return result
+    if not isinstance(tag, (TagCompound, TagList)):
+        return _leaf_equal(tag, other, exact)
 
-    def has_path(self, path):
-        path = self._nbt_path_node_prefix_check(path)
-        if not path.can_read():
-            return True
+    stack = [(tag, other)]
+    while stack:
+        tag, other = stack.pop()
+        if exact and _tag_kind(tag) is not _tag_kind(other):
+            return False
 
-        target = self
-        if path.peek() != '{':
-            # Assume tag name
-            child_tag_name = None
-            if path.peek() == '[':
-                # Wrong type, but could be correct for a sibling tag.
+        if isinstance(tag, TagCompound):
+            if not isinstance(other, TagCompound):
                 return False
-            if path.peek() in ' .]}\\':
-                raise SyntaxError("Unexpected character - expected { or valid tag name")
-
-            if path.peek() == '"':
-                # Quoted tag name (allows unusual characters; can't quote with ')
-                path.skip()
-                child_tag_name = path.read_string_until('"')
-            else:
-                # Assume unquoted tag name (different rules than normal unquoted string!)
-                start = path.get_cursor()
-                while path.can_read() and path.peek() not in ' .[]{}"':
-                    path.skip()
-                if path.can_read() and path.peek() not in '.{[':
-                    raise SyntaxError(f'Unexpected character {path.peek()!r} at char {path.get_cursor()} - expected [, {{, or .')
-                end = path.get_cursor()
-                if start == end:
-                    raise SyntaxError(f"Invalid unquoted tag name; can't start with {path.peek()}")
-                child_tag_name = path.get_string()[start:end]
-
-            if child_tag_name not in self.value:
+            value, other_value = tag.value, other.value
+            if (isinstance(value, _LazyCompound) and
+                    isinstance(other_value, _LazyCompound)):
+                raw = value.raw(value.use_mutf8)
+                if (raw is not None and
+                        raw == other_value.raw(value.use_mutf8)):
+                    continue
+            if len(value) != len(other_value):
                 return False
-            target = self.value[child_tag_name]
-
-            # Check if this is the end of the path node
-            if not path.can_read():
-                return True
-            if path.peek() in '.[':
-                target._nbt_path_node_suffix_check(path)
-                return target.has_path(path)
-
-        # Assume qualifying {} is required.
-        target_must_match = TagCompound.from_mojangson(path) # advances cursor; raises SyntaxError
-        target._nbt_path_node_suffix_check(path)
-        if target_must_match.is_subset(target):
-            # Target node matches requirements
-            return target.has_path(path)
-        else:
-            # Target node does not match requirements
-            return False
+            if exact:
+                pairs = zip(value.items(), other_value.items())
+                for (key, child), (other_key, other_child) in pairs:
+                    if key != other_key:
+                        return False
+                    if child is other_child:
+                        continue
+                    if _hash_kinds.get(type(child)) == 2:
+                        stack.append((child, other_child))
+                    elif not _leaf_equal(child, other_child, True):
+                        return False
+                continue
+            pairs = ((child, other_value.get(key, _missing))
+                     for key, child in value.items())
+
+        elif isinstance(tag, TagList) and isinstance(other, TagList):
+            value, other_value = tag.value, other.value
+            if len(value) != len(other_value):
+                return False
+            if (type(value) is _CompactList and value.decoded is None and
+                    type(other_value) is _CompactList and
+                    other_value.decoded is None and
+                    value.kind is other_value.kind):
+                if exact:
+                    if value.values.tobytes() != other_value.values.tobytes():
+                        return False
+                elif value.values != other_value.values:
+                    return False
+                continue
+            pairs = zip(value, other_value)
 
-    def at_path(self, path):
-        path = self._nbt_path_node_prefix_check(path)
-        if not path.can_read():
-            return self
-
-        target = self
-        if path.peek() != '{':
-            # Assume tag name
-            child_tag_name = None
-            if path.peek() == '[':
-                # Wrong type, but could be correct for a sibling tag.
-                raise LookupError("Cannot index into compound tag as list/array tag.")
-            if path.peek() in ' .]}\\':
-                raise SyntaxError("Unexpected character - expected { or valid tag name")
-
-            if path.peek() == '"':
-                # Quoted tag name (allows unusual characters; can't quote with ')
-                path.skip()
-                child_tag_name = path.read_string_until('"')
-            else:
-                # Assume unquoted tag name (different rules than normal unquoted string!)
-                start = path.get_cursor()
-                while path.can_read() and path.peek() not in ' .[]{}"':
-                    path.skip()
-                if path.can_read() and path.peek() not in '.[{':
-                    raise SyntaxError(f'Unexpected character {path.peek()!r} at char {path.get_cursor()} - expected [, {{, or .')
-                end = path.get_cursor()
-                if start == end:
-                    raise SyntaxError(f"Invalid unquoted tag name; can't start with {path.peek()}")
-                child_tag_name = path.get_string()[start:end]
-
-            if child_tag_name not in self.value:
-                raise KeyError(f"{child_tag_name!r} not in {self.value.keys()!r}")
-            target = self.value[child_tag_name]
-
-            # Check if this is the end of the path node
-            if not path.can_read():
-                return target
-            if path.peek() in '.[':
-                target._nbt_path_node_suffix_check(path)
-                return target.at_path(path)
-
-        # Assume qualifying {} is required.
-        target_must_match = TagCompound.from_mojangson(path) # advances cursor; raises SyntaxError
-        target._nbt_path_node_suffix_check(path)
-        if target_must_match.is_subset(target):
-            # Target node matches requirements
-            return target.at_path(path)
         else:
-            # Target node does not match requirements
-            raise KeyError(f"{target.to_mojangson(highlight=True)} does not match {target_must_match.to_mojangson(highlight=True)}")
+            if not _leaf_equal(tag, other, exact):
+                return False
+            continue
 
-    def count_multipath(self, path):
-        path = self._nbt_path_node_prefix_check(path)
-        if not path.can_read():
-            return 1
-
-        target = self
-        if path.peek() != '{':
-            # Assume tag name
-            child_tag_name = None
-            if path.peek() == '[':
-                # Wrong type, but could be correct for a sibling tag.
-                return 0
-            if path.peek() in ' .]}\\':
-                raise SyntaxError("Unexpected character - expected { or valid tag name")
-
-            if path.peek() == '"':
-                # Quoted tag name (allows unusual characters; can't quote with ')
-                path.skip()
-                child_tag_name = path.read_string_until('"')
-            else:
-                # Assume unquoted tag name (different rules than normal unquoted string!)
-                start = path.get_cursor()
-                while path.can_read() and path.peek() not in ' .[]{}"':
-                    path.skip()
-                if path.can_read() and path.peek() not in '.[{':
-                    raise SyntaxError(f'Unexpected character {path.peek()!r} at char {path.get_cursor()} - expected [, {{, or .')
-                end = path.get_cursor()
-                if start == end:
-                    raise SyntaxError(f"Invalid unquoted tag name; can't start with {path.peek()}")
-                child_tag_name = path.get_string()[start:end]
-
-            if child_tag_name not in self.value:
-                return 0
-            target = self.value[child_tag_name]
-
-            # Check if this is the end of the path node
-            if not path.can_read():
-                return 1
-            if path.peek() in '.[':
-                target._nbt_path_node_suffix_check(path)
-                return target.count_multipath(path)
-
-        # Assume qualifying {} is required.
-        target_must_match = TagCompound.from_mojangson(path) # advances cursor; raises SyntaxError
-        target._nbt_path_node_suffix_check(path)
-        if target_must_match.is_subset(target):
-            # Target node matches requirements
-            return target.count_multipath(path)
-        else:
-            # Target node does not match requirements
-            return 0
+        for child, other_child in pairs:
+            if child is other_child:
+                continue
+            if other_child is _missing:
+                return False
+            if _hash_kinds.get(type(child)) == 2:
+                stack.append((child, other_child))
+            elif not _leaf_equal(child, other_child, exact):
+                return False
 
-    def iter_multipath_pair(self, path):
-        path = self._nbt_path_node_prefix_check(path)
-        if not path.can_read():
-            yield ('', self)
-            return
+    return True
+
+
+def _copy_array(value):
+    return PackedArray(value.storage[:], value.length, value.sector_width,
+                       value.value_width, value.spanning)
+
+
+def _copy(tag):
+    """
+    Copies a tree without serializing it.
+    """
 
-        child_tag_name_raw = ''
-        target = self
-        if path.peek() != '{':
-            # Assume tag name
-            child_tag_name = None
-            if path.peek() == '[':
-                # Wrong type, but could be correct for a sibling tag.
-                return
-            if path.peek() in ' .]}\\':
-                raise SyntaxError("Unexpected character - expected { or valid tag name")
-
-            if path.peek() == '"':
-                # Quoted tag name (allows unusual characters; can't quote with ')
-                start = path.get_cursor()
-                path.skip()
-                child_tag_name = path.read_string_until('"')
-                end = path.get_cursor()
-                child_tag_name_raw = path.get_string()[start:end]
+    if isinstance(tag, _ArrayTag):
+        return _tag_kind(tag)(_copy_array(tag.value))
+    if not isinstance(tag, (TagCompound, TagList)):
+        return _tag_kind(tag)(tag.value)
+
+    result = _tag_kind(tag)(None)
+    stack = [(tag, result)]
+    while stack:
+        tag, copy = stack.pop()
+        value = tag.value
+        if isinstance(value, _LazyCompound):
+            raw = value.raw(value.use_mutf8)
+            if raw is not None:
+                copy.value = _LazyCompound(
+                    copy, raw, 0, len(raw), value.use_mutf8, value.compact)
+                continue
+            value = value.decoded
+        elif isinstance(value, _CompactList):
+            if value.decoded is None:
+                kind = value.kind
+                copy.value = [kind(item) for item in value.values]
+                continue
+            value = value.decoded
+
+        if isinstance(tag, TagCompound):
+            if type(value) in (dict, collections.OrderedDict):
+                copy.value = type(value)()
             else:
-                # Assume unquoted tag name (different rules than normal unquoted string!)
-                start = path.get_cursor()
-                while path.can_read() and path.peek() not in ' .[]{}"':
-                    path.skip()
-                if path.can_read() and path.peek() not in '.[{':
-                    raise SyntaxError(f'Unexpected character {path.peek()!r} at char {path.get_cursor()} - expected [, {{, or .')
-                end = path.get_cursor()
-                if start == end:
-                    raise SyntaxError(f"Invalid unquoted tag name; can't start with {path.peek()}")
-                child_tag_name = path.get_string()[start:end]
-                child_tag_name_raw = child_tag_name
-
-            if child_tag_name not in self.value:
-                return
-            target = self.value[child_tag_name]
-
-            # Check if this is the end of the path node
-            if not path.can_read():
-                yield (child_tag_name_raw, target)
-                return
-            if path.peek() in '.[':
-                target._nbt_path_node_suffix_check(path)
-                for subpath, tag in target.iter_multipath_pair(path):
-                    yield (nbt_path_join(child_tag_name_raw, subpath), tag)
-                return
-
-        # Assume qualifying {} is required.
-        target_must_match = TagCompound.from_mojangson(path) # advances cursor; raises SyntaxError
-        target._nbt_path_node_suffix_check(path)
-        if target_must_match.is_subset(target):
-            # Target node matches requirements
-            for subpath, tag in target.iter_multipath_pair(path):
-                yield (nbt_path_join(child_tag_name_raw, subpath), tag)
-            return
+                copy.value = collections.OrderedDict() \
+                    if TagCompound.preserve_order else {}
+            items = value.items()
         else:
-            # Target node does not match requirements
-            return
+            copy.value = [None] * len(value)
+            items = enumerate(value)
+
+        copy_value = copy.value
+        for key, child in items:
+            if isinstance(child, (TagCompound, TagList)):
+                child_copy = _tag_kind(child)(None)
+                stack.append((child, child_copy))
+            elif isinstance(child, _ArrayTag):
+                child_copy = _tag_kind(child)(_copy_array(child.value))
+            else:
+                child_copy = _tag_kind(child)(child.value)
+            copy_value[key] = child_copy
 
-    @classmethod
-    def from_mojangson(cls, json):
-        """Convert a Mojangson string into NBT"""
-        return MojangsonParser(json).parse_compound()
+    return result
 
-class MojangsonParser(object):
-    """Convert MojangSON into Quarry's NBT format.
 
-    Example: {display:{Name:"{\"text\":\"Excaliber\"}"}}
+class NBTChange(collections.namedtuple('NBTChange', 'path kind old new')):
+    """
+    A difference between two trees, as returned by :meth:`_Tag.changes`.
+
+    The *path* is an NBT path to the changed tag, relative to the trees
+    being compared. The *kind* is one of:
+
+    - ``'type'``: the tags have different types.
+    - ``'value'``: scalar or string tags differ, or array elements differ.
+      For array elements, *old* and *new* are signed integers.
+    - ``'length'``: arrays differ in length.
+    - ``'removed'``: a compound entry or list element exists only in the
+      old tree. *new* is ``None``.
+    - ``'added'``: a compound entry or list element exists only in the new
+      tree. *old* is ``None``.
+    - ``'order'``: compounds have the same keys in a different order. *old*
+      and *new* are lists of keys.
+
+    Otherwise *old* and *new* are the tags from each tree.
     """
 
-    regexDoubleNoSuffix = re.compile(r'''^[-+]?([0-9]+[.]|[0-9]*[.][0-9]+)(e[-+]?[0-9]+)?$''', re.IGNORECASE)
-    regexDouble         = re.compile(r'''^[-+]?([0-9]+[.]?|[0-9]*[.][0-9]+)(e[-+]?[0-9]+)?d$''', re.IGNORECASE)
-    regexFloat          = re.compile(r'''^[-+]?([0-9]+[.]?|[0-9]*[.][0-9]+)(e[-+]?[0-9]+)?f$''', re.IGNORECASE)
-    regexByte           = re.compile(r'''^[-+]?(0|[1-9][0-9]*)b$''', re.IGNORECASE)
-    regexLong           = re.compile(r'''^[-+]?(0|[1-9][0-9]*)l$''', re.IGNORECASE)
-    regexShort          = re.compile(r'''^[-+]?(0|[1-9][0-9]*)s$''', re.IGNORECASE)
-    regexInt            = re.compile(r'''^[-+]?(0|[1-9][0-9]*)$''', re.IGNORECASE)
+    __slots__ = ()
 
-    def __init__(self, json):
-        if isinstance(json, StringReader):
-            self.reader = json
-        else:
-            self.reader = StringReader(json)
 
-        #########################################################
-        # Set to True for verbose parsing - useful to find errors
-        self.debug = False
+def _child_path(path, key):
+    key = _mojangson_key(key)
+    return f'{path}.{key}' if path else key
 
-    def parse_key_string(self):
-        if self.debug:
-            print("parse_key_string")
 
-        self.reader.skip_whitespace()
-        if not self.reader.can_read():
-            self.raise_error("Failed to parse TagCompound key")
-        else:
-            return self.reader.read_string()
+def _diff_idents(children, key):
+    """
+    Returns a dictionary of list elements by their value for the given
+    compound key, or ``None`` if any element lacks a unique value.
+    """
 
-    def parse_literal(self, literal_str):
-        if self.debug:
-            print("parse_literal")
+    idents = {}
+    for child in children:
+        if not isinstance(child, TagCompound):
+            return None
+        ident = child.value.get(key)
+        if ident is None or ident in idents:
+            return None
+        idents[ident] = child
+    return idents
 
-        if self.regexFloat.match(literal_str):
-            return TagFloat(float(literal_str[:-1]))
 
-        if self.regexByte.match(literal_str):
-            return TagByte(int(literal_str[:-1]))
+def _diff_align(path, value, other_value, align, keys):
+    """
+    Pairs up the elements of two lists. Returns a list of ``(path, tag,
+    other_tag)`` tuples for paired elements, and a list of changes for
+    unpaired elements.
+    """
 
-        if self.regexLong.match(literal_str):
-            return TagLong(int(literal_str[:-1]))
+    pairs = []
+    changes = []
+
+    # Match compounds by the first key that identifies every element
+    for key in keys:
+        idents = _diff_idents(value, key)
+        other_idents = _diff_idents(other_value, key)
+        if idents is None or other_idents is None:
+            continue
+        key_text = _mojangson_key(key)
+        for ident, child in idents.items():
+            subpath = f'{path}[{{{key_text}:{ident.to_mojangson()}}}]'
+            other_child = other_idents.get(ident)
+            if other_child is None:
+                changes.append(NBTChange(subpath, 'removed', child, None))
+            else:
+                pairs.append((subpath, child, other_child))
+        for ident, other_child in other_idents.items():
+            if ident not in idents:
+                subpath = f'{path}[{{{key_text}:{ident.to_mojangson()}}}]'
+                changes.append(NBTChange(subpath, 'added', None, other_child))
+        return pairs, changes
+
+    if align == 'index':
+        opcodes = [('replace', 0, len(value), 0, len(other_value))]
+    elif align == 'sequence':
+        matcher = difflib.SequenceMatcher(
+            None, [_hash(child) for child in value],
+            [_hash(child) for child in other_value], autojunk=False)
+        opcodes = matcher.get_opcodes()
+    else:
+        raise ValueError("Unknown list alignment: %r" % (align,))
+
+    # Pair up elements by position within each block
+    for _, start, end, other_start, other_end in opcodes:
+        common = min(end - start, other_end - other_start)
+        for idx in range(common):
+            pairs.append((f'{path}[{start + idx}]', value[start + idx],
+                          other_value[other_start + idx]))
+        for idx in range(start + common, end):
+            changes.append(
+                NBTChange(f'{path}[{idx}]', 'removed', value[idx], None))
+        for idx in range(other_start + common, other_end):
+            changes.append(NBTChange(
+                f'{path}[{idx}]', 'added', None, other_value[idx]))
+    return pairs, changes
+
+
+def _diff(tag, other, order_matters=True, align='index', keys=(), path=''):
+    """
+    Yields :class:`NBTChange` records for the differences between two
+    trees. Identical subtrees are skipped without being walked where
+    possible: shared tags, lazy compounds with the same undecoded bytes, and
+    arrays or compact lists with the same contents.
+    """
 
-        if self.regexShort.match(literal_str):
-            return TagShort(int(literal_str[:-1]))
+    stack = [(path, tag, other)]
+    while stack:
+        path, tag, other = stack.pop()
+        if tag is other:
+            continue
+        if _tag_kind(tag) is not _tag_kind(other):
+            yield NBTChange(path, 'type', tag, other)
+            continue
+
+        if isinstance(tag, TagCompound):
+            value, other_value = tag.value, other.value
+            if (isinstance(value, _LazyCompound) and
+                    isinstance(other_value, _LazyCompound)):
+                raw = value.raw(value.use_mutf8)
+                if (raw is not None and
+                        raw == other_value.raw(value.use_mutf8)):
+                    continue
+            pairs = []
+            for key, child in value.items():
+                other_child = other_value.get(key, _missing)
+                if other_child is _missing:
+                    yield NBTChange(
+                        _child_path(path, key), 'removed', child, None)
+                else:
+                    pairs.append((_child_path(path, key), child, other_child))
+            for key, other_child in other_value.items():
+                if key not in value:
+                    yield NBTChange(
+                        _child_path(path, key), 'added', None, other_child)
+            if order_matters:
+                order = [key for key in value if key in other_value]
+                other_order = [key for key in other_value if key in value]
+                if order != other_order:
+                    yield NBTChange(
+                        path, 'order', list(value), list(other_value))
+
+        elif isinstance(tag, TagList):
+            value, other_value = tag.value, other.value
+            if (type(value) is _CompactList and value.decoded is None and
+                    type(other_value) is _CompactList and
+                    other_value.decoded is None and
+                    value.values.tobytes() == other_value.values.tobytes()):
+                continue
+            pairs, changes = _diff_align(
+                path, value, other_value, align, keys)
+            yield from changes
+
+        elif isinstance(tag, _ArrayTag):
+            value, other_value = tag.value, other.value
+            if len(value) != len(other_value):
+                yield NBTChange(path, 'length', tag, other)
+            elif value.storage != other_value.storage or \
+                    value.value_width != other_value.value_width:
+                pairs = zip(tag.to_signed_list(), other.to_signed_list())
+                for idx, (item, other_item) in enumerate(pairs):
+                    if item != other_item:
+                        yield NBTChange(
+                            f'{path}[{idx}]', 'value', item, other_item)
+            continue
 
-        if self.regexInt.match(literal_str):
-            return TagInt(int(literal_str))
+        else:
+            if not _leaf_equal(tag, other, True):
+                yield NBTChange(path, 'value', tag, other)
+            continue
+
+        stack.extend(reversed(pairs))
+
+
+def _print_change(change, show_values):
+    path, kind, old, new = change
+    label = 'key order' if kind == 'order' else kind
+    print(f'Diff at path {path!r}: {label}')
+    if not show_values:
+        return
+    if kind == 'type':
+        print(f'  -  self is type: {type(old)}')
+        print(f'  - other is type: {type(new)}')
+    elif kind == 'length':
+        print(f'  -  self is length: {len(old)}')
+        print(f'  - other is length: {len(new)}')
+    elif kind == 'order':
+        print(f'  -  self key order: {old}')
+        print(f'  - other key order: {new}')
+    else:
+        if kind != 'added':
+            print(f'  -  self is: {_change_obj(old)}')
+        if kind != 'removed':
+            print(f'  - other is: {_change_obj(new)}')
 
-        if self.regexDouble.match(literal_str):
-            return TagDouble(float(literal_str[:-1]))
 
-        if self.regexDoubleNoSuffix.match(literal_str):
-            return TagDouble(float(literal_str))
+def _change_obj(value):
+    return value.to_obj() if isinstance(value, _Tag) else value
 
-        if "true" == literal_str.lower():
-            return TagByte(1)
 
-        if "false" == literal_str.lower():
-            return TagByte(0)
+for _kind in _kinds.values():
+    if _kind is not type(None):
+        _hash_kinds[_kind] = 2 if issubclass(_kind, (TagCompound, TagList)) \
+            else 1 if issubclass(_kind, _ArrayTag) else 0
+_hash_kinds[TagRoot] = 2
+for _kind, _base_kind in _base_kinds.items():
+    _hash_kinds[_kind] = _hash_kinds[_base_kind]
+del _kind, _base_kind
 
-        return TagString(literal_str)
 
-    def parse_literal_or_string(self):
-        if self.debug:
-            print("parse_literal_or_string")
+# Interning -------------------------------------------------------------------
 
-        self.reader.skip_whitespace()
-        orig_pos = self.reader.get_cursor()
+class NBTInterner(object):
+    """
+    Store of shared compound tags, keyed by a hash of their serialized form.
+
+    When an interner is passed to :meth:`_Tag.from_bytes` (or to a file or
+    region method that accepts one), each compound that is decoded in full
+    and is no larger than *max_size* bytes is looked up by its content.
+    Compounds seen before are skipped rather than decoded, and the earlier
+    tag is used in their place, so that repeated data such as custom items
+    is held in memory once and compares equal by identity. Compounds with
+    the same entries in a different order are stored separately. Stored
+    tags are kept until :meth:`clear` is called. In lazily decoded trees,
+    only compounds too large to intern are decoded lazily.
+
+    Shared tags are read-only: assigning to the value of a shared tag raises
+    ``AttributeError``, and modifying the entries of a shared compound, list
+    or array raises ``TypeError``. Use :meth:`_Tag.deep_copy` to get a tag
+    that can be modified.
+    """
 
-        if StringReader.is_quoted_string_start(self.reader.peek()):
-            return TagString(self.reader.read_quoted_string())
-        else:
-            val = self.reader.read_unquoted_string()
+    def __init__(self, max_size=4096):
+        #: The maximum serialized size in bytes of compounds to intern.
+        self.max_size = max_size
 
-            if not val:
-                self.reader.set_cursor(orig_pos)
-                self.raise_error("Failed to parse literal or string value")
-            else:
-                return self.parse_literal(val)
+        #: Shared tags by the hash of their serialized form.
+        self.tags = {}
 
-    def parse_any_tag(self):
-        if self.debug:
-            print("parse_any_tag")
+        #: The number of compounds looked up.
+        self.total = 0
 
-        self.reader.skip_whitespace()
-        if not self.reader.can_read():
-            self.raise_error("Failed while parsing value")
-        else:
-            nextChar = self.reader.peek()
-            if nextChar == '{':
-                return self.parse_compound()
-            elif nextChar == '[':
-                return self.parse_array()
-            else:
-                return self.parse_literal_or_string()
+        #: The serialized size in bytes of the compounds that were shared
+        #: rather than decoded.
+        self.bytes_saved = 0
 
-    def parse_array(self):
-        if self.debug:
-            print("parse_array")
+    def __repr__(self):
+        return "<NBTInterner: %d unique of %d, %d bytes saved>" % (
+            self.unique, self.total, self.bytes_saved)
 
-        if self.reader.can_read(3) and (not StringReader.is_quoted_string_start(self.reader.peek(1))) and self.reader.peek(2) == ';':
-            return self.parse_typed_numeric_array()
-        else:
-            return self.parse_non_numeric_array()
+    def __len__(self):
+        return len(self.tags)
 
-    def parse_non_numeric_array(self):
-        if self.debug:
-            print("parse_non_numeric_array")
+    @property
+    def unique(self):
+        """
+        The number of distinct compounds stored.
+        """
 
-        self.advance_and_fail_if_next_is_not('[')
-        self.reader.skip_whitespace()
-        if not self.reader.can_read():
-            self.raise_error("Failed to parse non-numeric array")
-        else:
-            nbt_list = []
-            item_type = None
-
-            while self.reader.peek() != ']':
-                orig_pos = self.reader.get_cursor()
-                new_value = self.parse_any_tag()
-                new_type = type(new_value)
-
-                if not item_type:
-                    item_type = new_type
-                elif item_type != new_type:
-                    self.reader.set_cursor(orig_pos)
-                    self.raise_error(f"Mixed types in list! {item_type!s} != {new_type!s}")
-
-                nbt_list.append(new_value)
-                if not self.seek_to_next_comma_delim_element():
-                    break
+        return len(self.tags)
 
-                if not self.reader.can_read():
-                    self.raise_error("Unexpected end of array")
-
-            self.advance_and_fail_if_next_is_not(']')
-            return TagList(nbt_list)
-
-    def parse_typed_numeric_array(self):
-        if self.debug:
-            print("parse_typed_numeric_array")
-
-        self.advance_and_fail_if_next_is_not('[')
-        orig_pos = self.reader.get_cursor()
-        first_char = self.reader.read()
-
-        # Read ;
-        self.reader.read()
-        self.reader.skip_whitespace()
-        if not self.reader.can_read():
-            self.raise_error("Unexpected end of numeric array")
-        elif first_char == 'B':
-            return TagByteArray(PackedArray.from_int_list(self.parse_numeric_array_as_type(TagByte), 8))
-        elif first_char == 'L':
-            return TagLongArray(PackedArray.from_int_list(self.parse_numeric_array_as_type(TagLong), 64))
-        elif first_char == 'I':
-            return TagIntArray(PackedArray.from_int_list(self.parse_numeric_array_as_type(TagInt), 32))
-        else:
-            self.reader.set_cursor(orig_pos)
-            self.raise_error(f"Unexpected type character {first_char!r} in numeric array")
+    def clear(self):
+        """
+        Removes all stored tags and resets the statistics.
+        """
 
-    def parse_numeric_array_as_type(self, item_type):
-        if self.debug:
-            print("parse_numeric_array_as_type")
+        self.tags.clear()
+        self.total = self.bytes_saved = 0
 
-        array = []
+    def intern(self, tag, use_mutf8=True):
+        """
+        Returns a copy of a tag in which compounds are shared through this
+        interner; a compound tag is itself returned shared. The tag is
+        encoded and decoded again, so compounds are keyed by their canonical
+        serialized form.
+        """
 
-        while True:
-            if self.reader.peek() != ']':
-                orig_pos = self.reader.get_cursor()
-                new_value = self.parse_any_tag()
-                new_type = type(new_value)
+        return _decode(_encode(tag, use_mutf8), 0, _tag_kind(tag), use_mutf8,
+                       interner=self)[0]
+
+    def _lookup(self, data, start, use_mutf8):
+        """
+        Looks up the compound at offset *start* in *data*. Returns a
+        ``(key, tag, end)`` tuple, where *tag* is None if the compound hasn't
+        been seen before, and *key* and *end* are None if the compound is
+        too large to intern.
+        """
 
-                if new_type != item_type:
-                    self.reader.set_cursor(orig_pos)
-                    self.raise_error(f"Mixed types in list! {item_type!s} != {new_type!s}")
+        # Stop skipping once the compound is known to be too large
+        view = memoryview(data)[:start + self.max_size]
+        try:
+            end = _skip_value(view, start, 10)
+        except (IndexError, struct.error, BufferUnderrun):
+            return None, None, None
+        key = hashlib.blake2b(
+            view[start:end], digest_size=16,
+            person=b'mutf8' if use_mutf8 else b'utf8').digest()
+        self.total += 1
+        tag = self.tags.get(key)
+        if tag is not None:
+            self.bytes_saved += end - start
+        return key, tag, end
+
+
+# Events ----------------------------------------------------------------------
+
+class _StreamReader(object):
+    """
+    Reads from a file object in blocks, keeping only unread data in memory.
+    """
 
-                # Important! Numeric arrays just contain numbers! (i.e. not an array of TagInt)
-                array.append(new_value.value)
+    __slots__ = ('fp', 'buff', 'pos', 'block_size')
 
-                if self.seek_to_next_comma_delim_element():
-                    if not self.reader.can_read():
-                        self.raise_error("Unexpected end of numeric array elements")
-                    continue
+    def __init__(self, fp, block_size=65536):
+        self.fp = fp
+        self.buff = bytearray()
+        self.pos = 0
+        self.block_size = block_size
 
-            self.advance_and_fail_if_next_is_not(']')
-            return array
+    def fill(self, size):
+        """
+        Ensures that at least *size* unread bytes are buffered, and returns
+        the offset of the first.
+        """
 
-    def parse_compound(self):
-        if self.debug:
-            print("parse_compound")
+        buff = self.buff
+        if self.pos + size > len(buff):
+            del buff[:self.pos]
+            self.pos = 0
+            while len(buff) < size:
+                data = self.fp.read(max(self.block_size, size - len(buff)))
+                if not data:
+                    raise BufferUnderrun()
+                buff += data
+        return self.pos
 
-        self.advance_and_fail_if_next_is_not('{')
-        compound = collections.OrderedDict()
+    def unpack(self, unpacker):
+        pos = self.fill(unpacker.size)
+        self.pos = pos + unpacker.size
+        return unpacker.unpack_from(self.buff, pos)
 
-        self.reader.skip_whitespace()
+    def read(self, size):
+        pos = self.fill(size)
+        self.pos = pos + size
+        return bytes(self.buff[pos:pos + size])
 
-        while self.reader.can_read() and self.reader.peek() != '}':
-            orig_pos = self.reader.get_cursor()
-            key = self.parse_key_string()
 
-            if not key:
-                self.reader.set_cursor(orig_pos)
-                self.raise_error("Failed to parse TagCompound key")
+_struct_B = Buffer.get_struct('B')
 
-            self.advance_and_fail_if_next_is_not(':')
 
-            if self.debug:
-                print(f"Parsing value of {key!r} - value: {self.reader.string[self.reader.cursor:]!r}")
+def iter_events(fp, use_mutf8=True):
+    """
+    Reads a root tag from a file object (or bytes-like object) and yields an
+    ``(event, name, kind, value)`` tuple for each tag, without building a
+    tree. Data is read incrementally, so memory use does not grow with the
+    size of the input. Events are:
+
+    - ``('start_compound', name, TagCompound, None)``
+    - ``('start_list', name, kind, length)``, where *kind* is the type of
+      the list's elements, or ``None`` if it has none.
+    - ``('scalar', name, kind, value)`` for all other tags, where *value*
+      is the value of a tag of type *kind*.
+    - ``('end', None, None, None)`` after the contents of each compound or
+      list.
+
+    The *name* of list elements is ``None``, and the first event is for the
+    body of the root tag.
+    """
 
-            compound[key] = self.parse_any_tag()
-            if not self.seek_to_next_comma_delim_element():
+    if isinstance(fp, (bytes, bytearray, memoryview)):
+        fp = io.BytesIO(fp)
+    reader = _StreamReader(fp)
+    unpack = reader.unpack
+
+    kind_id, = unpack(_struct_B)
+    if kind_id == 0:
+        return
+    name = _decode_string(reader.read(*unpack(_struct_H)), use_mutf8)
+
+    # Each frame is a [list kind, remaining] pair, where the list kind is
+    # None for compounds.
+    stack = []
+    while True:
+        if kind_id in _scalar_kinds:
+            kind, unpacker = _scalar_kinds[kind_id]
+            yield 'scalar', name, kind, unpack(unpacker)[0]
+        elif kind_id == 8:
+            string = reader.read(*unpack(_struct_H))
+            yield 'scalar', name, TagString, _decode_string(string, use_mutf8)
+        elif kind_id in _array_kinds:
+            kind, width = _array_kinds[kind_id]
+            length, = unpack(_struct_i)
+            data = reader.read(length * (width // 8))
+            yield 'scalar', name, kind, PackedArray.from_bytes(
+                data, length, width, width)
+        elif kind_id == 10:
+            yield 'start_compound', name, TagCompound, None
+            stack.append([None, 0])
+        elif kind_id == 9:
+            inner_kind_id, length = unpack(_struct_bi)
+            if length > 0 and not 0 < inner_kind_id < len(_kinds):
+                raise ValueError("Unknown NBT tag type: %d" % inner_kind_id)
+            length = max(length, 0)
+            yield 'start_list', name, _kinds[inner_kind_id] if length \
+                else None, length
+            stack.append([inner_kind_id, length])
+        else:
+            raise ValueError("Unknown NBT tag type: %d" % kind_id)
+
+        # Find the next tag, ending finished compounds and lists
+        while stack:
+            frame = stack[-1]
+            if frame[0] is None:
+                kind_id, = unpack(_struct_B)
+                if kind_id != 0:
+                    name = _decode_string(
+                        reader.read(*unpack(_struct_H)), use_mutf8)
+                    break
+            elif frame[1] > 0:
+                frame[1] -= 1
+                kind_id = frame[0]
+                name = None
                 break
+            stack.pop()
+            yield 'end', None, None, None
+        else:
+            return
 
-            if not self.reader.can_read():
-                self.raise_error("Failed to parse TagCompound element")
-
-        self.advance_and_fail_if_next_is_not('}')
-        return TagCompound(compound)
 
-    def seek_to_next_comma_delim_element(self):
-        if self.debug:
-            print("seek_to_next_comma_delim_element")
+class NBTHandler(object):
+    """
+    Receives events from :func:`read_events`. Override the methods for the
+    events you need; by default they do nothing.
+    """
 
-        self.reader.skip_whitespace()
-        if self.reader.can_read() and self.reader.peek() == ',':
-            self.reader.skip()
-            self.reader.skip_whitespace()
-            return True
-        else:
-            return False
+    def start_compound(self, name):
+        pass
 
-    def advance_and_fail_if_next_is_not(self, char):
-        if self.debug:
-            print(f"advance_and_fail_if_next_is_not: {char!r}")
+    def start_list(self, name, kind, length):
+        pass
 
-        self.reader.skip_whitespace()
-        self.reader.expect(char)
+    def scalar(self, name, kind, value):
+        pass
 
-    def raise_error(self, msg):
-        raise SyntaxError(f"msg at ->{self.reader.string[self.reader.cursor:]}")
+    def end(self):
+        pass
 
-class TagRoot(TagCompound):
-    __slots__ = ()
-    root = True
 
-    @classmethod
-    def from_body(cls, body):
-        return cls({"": body})
+def read_events(fp, handler, use_mutf8=True):
+    """
+    Reads a root tag from a file object (or bytes-like object), calling the
+    methods of an :class:`NBTHandler` for each event. See
+    :func:`iter_events`. Returns the handler.
+    """
 
-    @property
-    def body(self):
-        return self.value[""]
+    start_compound = handler.start_compound
+    start_list = handler.start_list
+    scalar = handler.scalar
+    end = handler.end
+    for event, name, kind, value in iter_events(fp, use_mutf8):
+        if event == 'scalar':
+            scalar(name, kind, value)
+        elif event == 'end':
+            end()
+        elif event == 'start_compound':
+            start_compound(name)
+        else:
+            start_list(name, kind, value)
+    return handler
 
 
-# Register tags ---------------------------------------------------------------
+def iter_subtrees(fp, include, use_mutf8=True):
+    """
+    Reads a root tag from a file object (or bytes-like object), and yields
+    ``(path, tag)`` pairs for the tags on the given paths. Only these tags
+    are built; everything else is read as events and discarded.
+
+    Paths use the syntax of the *include* argument of
+    :meth:`_Tag.from_bytes`, for example ``"sections[].block_states"``.
+    The yielded paths are NBT paths with list indices, such as
+    ``"sections[3].block_states"``.
+    """
 
-_kinds[0] = type(None)
-_kinds[1] = TagByte
-_kinds[2] = TagShort
-_kinds[3] = TagInt
-_kinds[4] = TagLong
-_kinds[5] = TagFloat
-_kinds[6] = TagDouble
-_kinds[7] = TagByteArray
-_kinds[8] = TagString
-_kinds[9] = TagList
-_kinds[10] = TagCompound
-_kinds[11] = TagIntArray
-_kinds[12] = TagLongArray
-_ids.update({v: k for k, v in _kinds.items()})
+    if isinstance(include, str):
+        include = (include,)
+    node = _compile_include(tuple(include))
+    compound_type = collections.OrderedDict \
+        if TagCompound.preserve_order else dict
+
+    # Each frame is a [node, path, list index] triple for an open compound
+    # or list, where the list index is None for compounds. Containers that
+    # are not selected have a node of _missing.
+    frames = []
+    building = []
+    for event, name, kind, value in iter_events(fp, use_mutf8):
+        # Build selected tags
+        if building:
+            if event == 'end':
+                tag = building.pop()
+                if not building:
+                    yield path, tag
+                continue
+            if event == 'scalar':
+                tag = kind(value)
+            elif event == 'start_compound':
+                tag = TagCompound(compound_type())
+            else:
+                tag = TagList([])
+            parent = building[-1].value
+            if name is None:
+                parent.append(tag)
+            else:
+                parent[name] = tag
+            if event != 'scalar':
+                building.append(tag)
+            continue
+
+        if event == 'end':
+            frames.pop()
+            continue
+
+        # Find the node and path of the tag
+        if not frames:
+            child_node, path = node, ''
+        else:
+            frame = frames[-1]
+            parent_node = frame[0]
+            if frame[2] is None:
+                child_node = _missing if parent_node is _missing \
+                    else parent_node.get(name, _missing)
+                path = _child_path(frame[1], name)
+            else:
+                child_node = parent_node
+                path = f'{frame[1]}[{frame[2]}]'
+                frame[2] += 1
+
+        if child_node is None:
+            if event == 'scalar':
+                yield path, kind(value)
+            elif event == 'start_compound':
+                building.append(TagCompound(compound_type()))
+            else:
+                building.append(TagList([]))
+        elif event == 'start_compound':
+            frames.append([child_node, path, None])
+        elif event == 'start_list':
+            if child_node is not _missing:
+                child_node = child_node.get('[]', child_node)
+            frames.append([child_node, path, 0])
 
 
 # Files -----------------------------------------------------------------------
@@ -1521,13 +3134,49 @@ class NBTFile(object):
         self.root_tag = root_tag
 
     @classmethod
-    def load(cls, path, use_mutf8=True):
+    def load(cls, path, use_mutf8=True, include=None, lazy=False,
+             compact=False, interner=None):
         with gzip.open(path, 'rb') as fd:
-            return cls(TagRoot.from_bytes(fd.read(), use_mutf8))
+            return cls(TagRoot.from_bytes(
+                fd.read(), use_mutf8, include, lazy, compact, interner))
 
     def save(self, path, use_mutf8=True):
         with gzip.open(path, 'wb') as fd:
-            fd.write(self.root_tag.to_bytes(use_mutf8))
+            fd.write(_encode(self.root_tag, use_mutf8))
+
+    @classmethod
+    def query(cls, path, paths, use_mutf8=True):
+        """
+        Loads an NBT file, decoding only the tags needed by the given paths,
+        and yields ``(query_id, path, tag)`` tuples for the tags they match.
+        Paths are relative to the body of the root tag. See
+        :class:`NBTQuery`.
+        """
+
+        query = paths if isinstance(paths, NBTQuery) else NBTQuery(paths)
+        nbt_file = cls.load(path, use_mutf8, include=query.include)
+        return query.iter_root(nbt_file.root_tag)
+
+    @staticmethod
+    def iter_events(path, use_mutf8=True):
+        """
+        Yields events for the contents of an NBT file, decompressing and
+        reading it incrementally. See :func:`iter_events`.
+        """
+
+        with gzip.open(path, 'rb') as fd:
+            yield from iter_events(fd, use_mutf8)
+
+    @staticmethod
+    def iter_subtrees(path, include, use_mutf8=True):
+        """
+        Yields ``(path, tag)`` pairs for the tags on the given paths in an
+        NBT file, without building the rest of the tree. See
+        :func:`iter_subtrees`.
+        """
+
+        with gzip.open(path, 'rb') as fd:
+            yield from iter_subtrees(fd, include, use_mutf8)
 
 
 class RegionFile(object):
@@ -1595,7 +3244,7 @@ class RegionFile(object):
             chunk_x = chunk_dict["xPos"].value & 0x1f
             chunk_z = chunk_dict["zPos"].value & 0x1f
 
-        chunk_contents = zlib.compress(chunk.to_bytes())
+        chunk_contents = zlib.compress(_encode(chunk))
         chunk = Buffer.pack('IB', len(chunk_contents), 2) + chunk_contents
         chunk_length = 1 + (len(chunk) - 1) // 4096
 
@@ -1674,11 +3323,28 @@ class RegionFile(object):
         return result
 
 
-    def load_chunk(self, chunk_x, chunk_z):
+    def load_chunk(self, chunk_x, chunk_z, include=None, lazy=False,
+                   compact=False, interner=None):
         """
         Loads the chunk at the given co-ordinates from the region file.
         The co-ordinates should range from 0 to 31. Returns a ``TagRoot``.
         If no chunk is found, returns None.
+
+        The *include*, *lazy*, *compact* and *interner* arguments are passed
+        to ``TagRoot.from_bytes()``.
+        """
+
+        chunk = self.load_chunk_data(chunk_x, chunk_z)
+        if chunk is None:
+            return None
+        return TagRoot.from_bytes(chunk, include=include, lazy=lazy,
+                                  compact=compact, interner=interner)
+
+    def load_chunk_data(self, chunk_x, chunk_z):
+        """
+        Loads the decompressed NBT data of the chunk at the given
+        co-ordinates, without decoding it. The co-ordinates should range
+        from 0 to 31. If no chunk is found, returns None.
         """
 
         buff = Buffer()
@@ -1706,10 +3372,7 @@ class RegionFile(object):
                 if chunk_path is None:
                     return None
                 with open(chunk_path, 'rb') as fp:
-                    chunk = fp.read()
-                    chunk = zlib.decompress(chunk)
-                    chunk = TagRoot.from_bytes(chunk)
-                    return chunk
+                    return zlib.decompress(fp.read())
 
             chunk = buff.read(compressed_size)
             try:
@@ -1717,12 +3380,95 @@ class RegionFile(object):
             except Exception as ex:
                 print(f"Failed to decompress chunk={chunk_x},{chunk_z} in region={self.path} size={compressed_size} format={compression_format} ex=", ex, file=sys.stderr)
                 raise ex
-            chunk = TagRoot.from_bytes(chunk)
             return chunk
         else:
             # No chunk at that location
             return None
 
+    def query_chunks(self, paths, interner=None):
+        """
+        Yields ``(chunk_x, chunk_z, query_id, path, tag)`` tuples for the tags
+        matched by the given paths in every chunk in the region file. Each
+        chunk is decoded only as far as the paths require, and walked once.
+        Paths are relative to the body of each chunk. See :class:`NBTQuery`.
+
+        If an :class:`NBTInterner` is given, compounds decoded in full are
+        shared through it.
+        """
+
+        query = paths if isinstance(paths, NBTQuery) else NBTQuery(paths)
+        for chunk_x, chunk_z in self.list_chunks():
+            chunk = self.load_chunk(chunk_x, chunk_z, include=query.include,
+                                    interner=interner)
+            if chunk is None:
+                continue
+            for query_id, path, tag in query.iter_root(chunk):
+                yield chunk_x, chunk_z, query_id, path, tag
+
+    def diff_chunks(self, other, order_matters=True, align='index', keys=()):
+        """
+        Yields ``(chunk_x, chunk_z, changes)`` tuples for each chunk that
+        differs from the chunk in another region file, where *changes* is a
+        list of :class:`NBTChange` records relative to the body of the chunk.
+        See :meth:`_Tag.changes` for the remaining arguments.
+
+        Chunks with identical data are skipped without being decoded, and
+        other chunks are decoded lazily, so that identical compounds within
+        them are compared by their bytes. A chunk that exists in only one
+        file is reported as a single ``'removed'`` or ``'added'`` change.
+        """
+
+        chunks = set(self.list_chunks()) | set(other.list_chunks())
+        for chunk_x, chunk_z in sorted(chunks, key=lambda pos: pos[::-1]):
+            data = self.load_chunk_data(chunk_x, chunk_z)
+            other_data = other.load_chunk_data(chunk_x, chunk_z)
+            if data == other_data:
+                continue
+            if data is None:
+                chunk = TagRoot.from_bytes(other_data, lazy=True)
+                changes = [NBTChange('', 'added', None, chunk.body)]
+            elif other_data is None:
+                chunk = TagRoot.from_bytes(data, lazy=True)
+                changes = [NBTChange('', 'removed', chunk.body, None)]
+            else:
+                chunk = TagRoot.from_bytes(data, lazy=True)
+                other_chunk = TagRoot.from_bytes(other_data, lazy=True)
+                changes = chunk.body.changes(
+                    other_chunk.body, order_matters, align, keys)
+            if changes:
+                yield chunk_x, chunk_z, changes
+
+    def iter_chunk_events(self, chunk_x, chunk_z):
+        """
+        Yields events for the contents of the chunk at the given
+        co-ordinates, without building a tree. See :func:`iter_events`.
+        The co-ordinates should range from 0 to 31. If no chunk is found,
+        nothing is yielded.
+        """
+
+        data = self.load_chunk_data(chunk_x, chunk_z)
+        if data is not None:
+            yield from iter_events(data)
+
+    def iter_subtrees(self, include, interner=None):
+        """
+        Yields ``(chunk_x, chunk_z, path, tag)`` tuples for the tags on the
+        given paths in every chunk in the region file, without building the
+        rest of each chunk. See :func:`iter_subtrees`.
+
+        If an :class:`NBTInterner` is given, the yielded tags are interned
+        with :meth:`NBTInterner.intern`.
+        """
+
+        for chunk_x, chunk_z in self.list_chunks():
+            data = self.load_chunk_data(chunk_x, chunk_z)
+            if data is None:
+                continue
+            for path, tag in iter_subtrees(data, include):
+                if interner is not None:
+                    tag = interner.intern(tag)
+                yield chunk_x, chunk_z, path, tag
+
     def delete_chunk(self, chunk_x, chunk_z):
         """
         Deletes the chunk at the given co-ordinates from the region file.
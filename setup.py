@@ -10,7 +10,6 @@ setup(
     description='Minecraft protocol library',
     long_description=open('README.rst').read(),
     install_requires=[
-        'bitstring >= 3.1.0',
         'cached_property >= 1.2.0',
         'twisted >= 22.0.0',
         'cryptography >= 0.9',
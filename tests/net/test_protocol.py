@@ -0,0 +1,179 @@
+import concurrent.futures
+
+import pytest
+
+from quarry.net import protocol
+from quarry.net.protocol import Factory, Protocol
+from quarry.net.ticker import Ticker
+
+
+class FakeAddress(object):
+    host = "127.0.0.1"
+
+
+class FakeTransport(object):
+    connected = True
+
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        assert self.connected
+        self.written.append(data)
+
+    def loseConnection(self):
+        self.connected = False
+
+
+class FakeTicker(Ticker):
+    def start(self):
+        pass
+
+
+class FakeReactor(object):
+    def callFromThread(self, func, *args):
+        func(*args)
+
+
+class ManualExecutor(concurrent.futures.Executor):
+    """
+    Runs submitted calls only when asked, in any order.
+    """
+
+    def __init__(self):
+        self.pending = []
+
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        self.pending.append((future, fn, args))
+        return future
+
+    def run(self, idx):
+        future, fn, args = self.pending.pop(idx)
+        future.set_result(fn(*args))
+
+    def fail(self, idx):
+        future, fn, args = self.pending.pop(idx)
+        future.set_exception(RuntimeError("compression failed"))
+
+
+class FakeProtocol(Protocol):
+    send_direction = "upstream"
+    recv_direction = "upstream"
+    protocol_mode = "status"
+
+
+class FakeFactory(Factory):
+    protocol = FakeProtocol
+    ticker_type = FakeTicker
+    compression_thread_threshold = 1000
+
+
+@pytest.fixture
+def proto(monkeypatch):
+    monkeypatch.setattr(protocol, "reactor", FakeReactor())
+    factory = FakeFactory()
+    factory.compression_executor = ManualExecutor()
+    proto = factory.buildProtocol(FakeAddress())
+    proto.logger.disabled = True
+    proto.transport = FakeTransport()
+    proto.compression_threshold = 256
+    return proto
+
+
+def payload(idx, large):
+    return bytes((idx,)) * (2000 if large else 10)
+
+
+def received(proto):
+    """
+    Unpacks the payloads of packets written to the transport.
+    """
+
+    buff = proto.buff_type(b"".join(proto.transport.written))
+    payloads = []
+    while len(buff):
+        body = buff.unpack_packet_frame()
+        packet = proto.buff_type(body).unpack_packet_body(
+            proto.compression_threshold)
+        assert proto.get_packet_name(packet.unpack_varint()) == "status_ping"
+        payloads.append(packet.read())
+    return payloads
+
+
+def test_send_order(proto):
+    executor = proto.factory.compression_executor
+    sizes = [True, False, True, True, False]
+    for idx, large in enumerate(sizes):
+        proto.send_packet("status_ping", payload(idx, large))
+    assert len(executor.pending) == 3
+    assert proto.transport.written == []
+
+    # Later packets are held back until earlier ones are compressed
+    executor.run(2)
+    executor.run(1)
+    assert proto.transport.written == []
+    executor.run(0)
+    assert received(proto) == [
+        payload(idx, large) for idx, large in enumerate(sizes)]
+    assert not proto.send_queue
+
+
+def test_close_waits_for_queue(proto):
+    executor = proto.factory.compression_executor
+    proto.send_packet("status_ping", payload(0, True))
+    proto.send_packet("status_ping", payload(1, False))
+    proto.close()
+    assert proto.transport.connected
+
+    # Packets sent after closing are dropped
+    proto.send_packet("status_ping", payload(2, False))
+    executor.run(0)
+    assert not proto.transport.connected
+    assert received(proto) == [payload(0, True), payload(1, False)]
+
+
+def test_compression_failure(proto):
+    executor = proto.factory.compression_executor
+    proto.send_packet("status_ping", payload(0, False))
+    proto.send_packet("status_ping", payload(1, True))
+    proto.send_packet("status_ping", payload(2, True))
+    proto.send_packet("status_ping", payload(3, False))
+    executor.fail(0)
+    assert proto.closed
+    assert not proto.transport.connected
+    assert not proto.send_queue
+    assert received(proto) == [payload(0, False)]
+
+    # Packets still being compressed are discarded
+    executor.run(0)
+    assert received(proto) == [payload(0, False)]
+
+
+def test_forward_packet(proto):
+    executor = proto.factory.compression_executor
+    proto.lazy_decompression = True
+    ident = proto.buff_type.pack_varint(proto.get_packet_ident("status_ping"))
+
+    def receive(data):
+        packet = proto.buff_type.pack_packet(ident + data, 256)
+        body = proto.buff_type(packet).unpack_packet_frame()
+        buff = proto.buff_type(body).unpack_packet_body(256, lazy=True)
+        buff.unpack_varint()
+        return buff
+
+    # Forwarded packets are queued behind packets being compressed
+    proto.send_packet("status_ping", payload(0, True))
+    lazy = receive(payload(1, True))
+    proto.forward_packet("status_ping", lazy)
+    assert lazy.inflater is not None
+    partial = receive(payload(2, True))
+    partial.read(1)
+    proto.forward_packet("status_ping", partial)
+    assert len(executor.pending) == 2
+    assert proto.transport.written == []
+
+    executor.run(1)
+    executor.run(0)
+    assert received(proto) == [
+        payload(0, True), payload(1, True), payload(2, True)[1:]]
@@ -0,0 +1,128 @@
+"""
+Generated NBT data shared by the NBT tests and benchmarks.
+"""
+
+import random
+
+from quarry.types.chunk import PackedArray
+from quarry.types.nbt import TagByte, TagByteArray, TagCompound, TagDouble, \
+    TagFloat, TagInt, TagList, TagLong, TagLongArray, TagRoot, TagShort, \
+    TagString
+
+
+def make_chunk(seed=0):
+    """
+    Returns a 1.18-style chunk tag with pseudo-random contents.
+    """
+
+    rnd = random.Random(seed)
+
+    def long_array(length):
+        data = bytes(rnd.getrandbits(8) for _ in range(length * 8))
+        return TagLongArray(PackedArray.from_bytes(data, length, 64, 64))
+
+    def byte_array(length):
+        data = bytes(rnd.getrandbits(8) for _ in range(length))
+        return TagByteArray(PackedArray.from_bytes(data, length, 8, 8))
+
+    sections = []
+    for y in range(-4, 20):
+        palette = [TagCompound({'Name': TagString('minecraft:air')})]
+        for _ in range(rnd.randint(1, 20)):
+            palette.append(TagCompound({
+                'Name': TagString('minecraft:block_%d' % rnd.randint(0, 500)),
+                'Properties': TagCompound({
+                    'facing': TagString(rnd.choice(['north', 'south'])),
+                    'waterlogged': TagString('false')})}))
+        sections.append(TagCompound({
+            'Y': TagByte(y),
+            'block_states': TagCompound({
+                'palette': TagList(palette),
+                'data': long_array(256 + 64 * (len(palette) > 16))}),
+            'biomes': TagCompound({
+                'palette': TagList([TagString('minecraft:plains')])}),
+            'BlockLight': byte_array(2048),
+            'SkyLight': byte_array(2048)}))
+
+    block_entities = []
+    for _ in range(20):
+        block_entities.append(TagCompound({
+            'id': TagString('minecraft:chest'),
+            'x': TagInt(rnd.randint(0, 15)),
+            'y': TagInt(rnd.randint(-64, 319)),
+            'z': TagInt(rnd.randint(0, 15)),
+            'keepPacked': TagByte(0),
+            'CustomName': TagString('{"text":"Ch\u00e9st \U0001f4e6"}'),
+            'Items': TagList([TagCompound({
+                'Slot': TagByte(slot),
+                'id': TagString('minecraft:stone'),
+                'Count': TagByte(64)}) for slot in range(27)])}))
+
+    return TagRoot.from_body(TagCompound({
+        'DataVersion': TagInt(2975),
+        'xPos': TagInt(3),
+        'yPos': TagInt(-4),
+        'zPos': TagInt(-7),
+        'Status': TagString('full'),
+        'LastUpdate': TagLong(123456789),
+        'InhabitedTime': TagLong(1000),
+        'sections': TagList(sections),
+        'block_entities': TagList(block_entities),
+        'Heightmaps': TagCompound({
+            'MOTION_BLOCKING': long_array(37),
+            'WORLD_SURFACE': long_array(37)}),
+        'PostProcessing': TagList([
+            TagList([TagShort(idx) for idx in range(5)]) for _ in range(24)]),
+        'fluid_ticks': TagList([]),
+        'structures': TagCompound({
+            'References': TagCompound({}),
+            'starts': TagCompound({})}),
+        'CarvingMasks': TagCompound({'AIR': long_array(1024)}),
+        'Lights': TagList([TagList([TagShort(-1), TagShort(7)])]),
+        'TicksPerSecond': TagDouble(20.0),
+        'Scale': TagFloat(0.5)}))
+
+
+def make_snbt_corpus(seed=0):
+    """
+    Returns a list of SNBT strings: large item definitions, typed arrays and
+    deeply nested compounds and lists.
+    """
+
+    rnd = random.Random(seed)
+    corpus = []
+
+    for idx in range(20):
+        lore = ",".join(
+            "'{\"text\":\"Line %d of lore, with \\'quotes\\'\"}'" % line
+            for line in range(20))
+        pages = ",".join(
+            '"{\\"text\\":\\"Page %d\\"}"' % page for page in range(30))
+        enchantments = ",".join(
+            '{id:"minecraft:enchantment_%d",lvl:%ds}' % (
+                rnd.randint(0, 40), rnd.randint(1, 5)) for _ in range(8))
+        modifiers = ",".join(
+            '{AttributeName:"generic.attack_damage",Name:modifier_%d,'
+            'Amount:%r,Operation:%d,UUID:[I;%s],Slot:mainhand}' % (
+                mod, rnd.uniform(-10, 10), rnd.randint(0, 2),
+                ",".join(str(rnd.randint(-2**31, 2**31 - 1))
+                         for _ in range(4)))
+            for mod in range(5))
+        corpus.append(
+            '{id:"minecraft:written_book",Count:1b,Slot:%db,tag:{'
+            'display:{Name:\'{"text":"Item %d"}\',Lore:[%s],color:%d},'
+            'pages:[%s],resolved:1b,generation:0,Damage:%d,Unbreakable:true,'
+            'Enchantments:[%s],AttributeModifiers:[%s],'
+            'CustomModelData:%dL,Weight:%.3ff,Price:%.2fd}}' % (
+                idx, idx, lore, rnd.randint(0, 0xffffff), pages,
+                rnd.randint(0, 1000), enchantments, modifiers,
+                rnd.randint(0, 2**40), rnd.random(), rnd.random() * 100))
+
+    corpus.append('{bytes:[B;%s],ints:[I;%s],longs:[L;%s]}' % (
+        ",".join("%db" % rnd.randint(-128, 127) for _ in range(4096)),
+        ",".join("%d" % rnd.randint(-2**31, 2**31 - 1) for _ in range(4096)),
+        ",".join("%dl" % rnd.randint(-2**63, 2**63 - 1) for _ in range(4096))))
+
+    corpus.append("{a:" * 500 + "{depth:500}" + "}" * 500)
+    corpus.append("{list:" + "[" * 500 + "1b" + "]" * 500 + "}")
+    return corpus
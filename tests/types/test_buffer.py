@@ -1,8 +1,9 @@
 from collections import OrderedDict
+import zlib
 
 import pytest
 
-from quarry.types.buffer import Buffer, BufferUnderrun
+from quarry.types.buffer import Buffer, BufferUnderrun, BufferWriter
 from quarry.types.chat import Message
 from quarry.types.nbt import *
 from quarry.types.uuid import UUID
@@ -129,12 +130,125 @@ def test_read():
     with pytest.raises(BufferUnderrun):
         buffer.read(1)
 
+def test_receiver():
+    buffer = Buffer.receiver()
+    buffer.add(b"\x04spam\x04eg")
+    buffer.save()
+    packet = buffer.unpack_packet(Buffer)
+    assert packet.read(2) == b"sp"
+    assert isinstance(packet.read(), bytes)
+    buffer.save()
+    with pytest.raises(BufferUnderrun):
+        buffer.unpack_packet(Buffer)
+    buffer.restore()
+    buffer.add(b"gs")
+    buffer.save()
+    packet = buffer.unpack_packet(Buffer)
+    assert packet.read() == b"eggs"
+    assert len(buffer) == 0
+
+def test_receiver_shares_memory():
+    buffer = Buffer.receiver()
+    buffer.add(b"\x04spam")
+    buffer.save()
+    view = buffer.read_view(1)
+    buffer.restore()
+    packet = buffer.unpack_packet(Buffer)
+    assert isinstance(packet.buff, memoryview)
+    assert packet.buff.obj is buffer.buff
+
+    # Views are still held, so further data must not disturb them.
+    buffer.add(b"\x04eggs")
+    assert bytes(view) == b"\x04"
+    assert packet.read() == b"spam"
+    assert buffer.unpack_packet(Buffer).read() == b"eggs"
+
+def test_unpack_packet_frame():
+    buffer = Buffer.receiver()
+    buffer.add(b"\xAC")
+    assert buffer.unpack_packet_frame() is None
+    buffer.add(b"\x02" + b"x" * 299)
+    assert buffer.unpack_packet_frame() is None
+    assert buffer.frame == (2, 300)
+    assert len(buffer) == 301
+    buffer.add(b"x\x01y")
+    assert buffer.unpack_packet_frame() == b"x" * 300
+    assert buffer.unpack_packet_frame() == b"y"
+    assert buffer.unpack_packet_frame() is None
+
+    buffer.add(b"\xAC\x02")
+    with pytest.raises(ValueError):
+        buffer.unpack_packet_frame(max_length=299)
+
+def test_unpack_packet_body():
+    data = Buffer.pack_packet(b"\x00" + b"spam" * 100, 256)
+    buffer = Buffer(data)
+    body = buffer.unpack_packet_frame()
+    packet = Buffer(body).unpack_packet_body(256)
+    assert packet.read() == b"\x00" + b"spam" * 100
+    with pytest.raises(ValueError):
+        Buffer(body).unpack_packet_body(256, max_length=400)
+
+def test_unpack_packet_body_length_mismatch():
+    data = b"\x00" + b"spam" * 100
+    for length in (400, 402, 100000):
+        body = Buffer.pack_varint(length) + zlib.compress(data)
+        with pytest.raises(ValueError):
+            Buffer(body).unpack_packet_body(256)
+
+        packet = Buffer(body).unpack_packet_body(256, lazy=True)
+        assert len(packet) == length
+        with pytest.raises(ValueError):
+            packet.read()
+        assert packet.inflater is None
+        assert len(packet) == len(data)
+
+    # Short packets are inflated completely when unpacked lazily
+    body = Buffer.pack_varint(300) + zlib.compress(b"\x00spam")
+    with pytest.raises(ValueError):
+        Buffer(body).unpack_packet_body(256, lazy=True)
+
+def test_unpack_packet_body_lazy():
+    data = Buffer.pack_packet(b"\x20" + b"spam" * 100, 256)
+    body = Buffer(data).unpack_packet_frame()
+    packet = Buffer(body).unpack_packet_body(256, lazy=True)
+    assert packet.inflater is not None
+    assert len(packet) == 401
+    assert packet.unpack_varint() == 0x20
+    assert packet.read(4) == b"spam"
+    assert packet.inflater is not None
+    assert packet.unpack_array("4s", 99) == [b"spam"] * 99
+    assert packet.inflater is None
+    assert len(packet) == 0
+
+    packet = Buffer(body).unpack_packet_body(256, lazy=True)
+    packet.discard()
+    assert len(packet) == 0
+    assert packet.inflater is not None
+    packet.restore()
+    assert packet.read() == b"\x20" + b"spam" * 100
+
 def test_unpack():
     buffer = Buffer()
     for fmt, data, values in pack_unpack_vectors:
         buffer.add(data)
         assert buffer.unpack(fmt) == values
 
+def test_unpack_underrun():
+    buffer = Buffer()
+    buffer.add(b"\x00\x01\x02")
+    with pytest.raises(BufferUnderrun):
+        buffer.unpack("i")
+    assert buffer.unpack("bh") == (0, 0x0102)
+    assert Buffer.get_struct("bh") is Buffer.get_struct("bh")
+
+def test_unpack_array():
+    buffer = Buffer()
+    buffer.add(b"\x00\x01\xFF\xFF")
+    assert buffer.unpack_array("h", 2) == [1, -1]
+    assert len(buffer) == 0
+    assert Buffer.pack_array("h", [1, -1]) == b"\x00\x01\xFF\xFF"
+
 def test_unpack_string():
     buffer = Buffer()
     buffer.add(b"\x04spam")
@@ -163,6 +277,18 @@ def test_unpack_varint():
         assert buffer.unpack_varint() == value
         assert len(buffer) == 0
 
+def test_unpack_varint_array():
+    buffer = Buffer()
+    for value, data in varint_vectors:
+        buffer.add(data)
+    assert buffer.unpack_varint_array(len(varint_vectors)) == \
+        [value for value, data in varint_vectors]
+    assert len(buffer) == 0
+
+    buffer.add(b"\x01\xAC")
+    with pytest.raises(BufferUnderrun):
+        buffer.unpack_varint_array(2)
+
 def test_unpack_uuid():
     buffer = Buffer()
     buffer.add(uuid_vector)
@@ -201,6 +327,11 @@ def test_pack_varint():
     for value, data in varint_vectors:
         assert Buffer.pack_varint(value) == data
 
+def test_pack_varint_array():
+    assert Buffer.pack_varint_array(
+        [value for value, data in varint_vectors]) == \
+        b"".join(data for value, data in varint_vectors)
+
 def test_pack_uuid():
     assert Buffer.pack_uuid(UUID.from_bytes(uuid_vector)) == uuid_vector
 
@@ -210,4 +341,34 @@ def test_pack_slot():
 
 def test_pack_entity_metadata():
     for value, data in entity_metadata_vectors:
-        assert Buffer.pack_entity_metadata(value) == data
\ No newline at end of file
+        assert Buffer.pack_entity_metadata(value) == data
+
+def test_writer():
+    writer = Buffer.writer()
+    assert isinstance(writer, BufferWriter)
+    writer.write_struct("bh", 1, 2)
+    writer.write_varint(300)
+    writer.write_string("spam")
+    writer.write_uuid(UUID.from_bytes(uuid_vector))
+    writer.write_nbt()
+    writer.write(b"eggs")
+    assert len(writer) == 31
+    assert writer.to_bytes() == \
+        b"\x01\x00\x02\xAC\x02\x04spam" + uuid_vector + b"\x00eggs"
+
+def test_writer_pack_packet():
+    for threshold in (-1, 0, 256):
+        writer = Buffer.writer()
+        writer.write(b"spam" * 100)
+        assert writer.pack_packet(0x20, threshold) == Buffer.pack_packet(
+            Buffer.pack_varint(0x20) + b"spam" * 100, threshold)
+
+
+def test_pack_packet_compression_level():
+    data = Buffer.pack_varint(0x20) + b"spam" * 100
+    for level in (0, 1, 9):
+        packed = Buffer.pack_packet(data, 256, level, zlib.Z_FILTERED)
+        buff = Buffer(packed)
+        assert buff.unpack_packet(Buffer, 256).read() == data
+    assert len(Buffer.pack_packet(data, 256, 0)) > \
+        len(Buffer.pack_packet(data, 256, 9))
@@ -1,6 +1,5 @@
 import os.path
-
-import bitstring
+import random
 
 from quarry.types.buffer import Buffer1_13_2, Buffer1_14
 from quarry.types.chunk import PackedArray, BlockArray
@@ -16,10 +15,10 @@ packet_path = os.path.join(root_path, "packet.bin")
 
 def test_wikivg_example():
     # Example from https://wiki.vg/Chunk_Format#Example
-    data = bitstring.BitArray(length=13*4096)
-    data[0:64]   = '0b0000000000100000100001100011000101001000010000011000100001000001'
-    data[64:128] = '0b0000000100000001100010100111001001100000111101101000110010000111'
-    data = data.bytes
+    data = bytearray(13*512)
+    data[0:8]  = int('0b0000000000100000100001100011000101001000010000011000100001000001', 2).to_bytes(8, 'big')
+    data[8:16] = int('0b0000000100000001100010100111001001100000111101101000110010000111', 2).to_bytes(8, 'big')
+    data = bytes(data)
 
     blocks = BlockArray.from_bytes(data, 5, OpaqueRegistry(13), [])
     assert blocks[:24] == [
@@ -27,6 +26,53 @@ def test_wikivg_example():
         4, 3, 13, 15, 16, 9, 14, 10, 12, 0, 2]
 
 
+def test_packed_array_spanning():
+    # Pre-1.16 layout: values are split across sectors
+    values = [random.getrandbits(13) for _ in range(4096)]
+    packed = sum(value << (13 * idx) for idx, value in enumerate(values))
+    data = packed.to_bytes(13 * 512, 'little')
+    data = b"".join(data[idx:idx+8][::-1] for idx in range(0, len(data), 8))
+
+    array = PackedArray.from_block_bytes(data, 13, spanning=True)
+    assert array[:] == values
+    assert [array[idx] for idx in range(4096)] == values
+    assert array.to_bytes() == data
+
+    array = PackedArray.empty(4096, 64, 13, spanning=True)
+    for idx, value in enumerate(values):
+        array[idx] = value
+    assert array.to_bytes() == data
+
+
+def test_packed_array_non_spanning():
+    values = [random.getrandbits(5) for _ in range(4096)]
+    array = PackedArray.empty_block()
+    array.value_width = 5
+    array.purge()
+    array[:] = values
+    assert array[:] == values
+    assert len(array.to_bytes()) == 342 * 8
+
+    other = PackedArray.from_block_bytes(array.to_bytes(), 5)
+    assert [other[idx] for idx in range(4096)] == values
+    other[100] = 31
+    assert other[100] == 31
+    assert other[99] == values[99] and other[101] == values[101]
+
+
+def test_packed_array_round_trip():
+    for spanning in (False, True):
+        for value_width in (4, 8, 14):
+            array = PackedArray.empty(4096, 64, value_width, spanning)
+            array[:] = [random.getrandbits(value_width) for _ in range(4096)]
+            data = array.to_bytes()
+
+            array = PackedArray.from_block_bytes(data, value_width, spanning)
+            values = array[:]
+            array[:] = values
+            assert array.to_bytes() == data
+
+
 # See https://github.com/barneygale/quarry/issues/66
 # See https://github.com/barneygale/quarry/issues/100
 def test_packet_pack_unpack():
@@ -133,3 +179,88 @@ def test_chunk_internals():
             assert blocks[i] == i
         else:
             assert blocks[i] == 0
+
+
+def test_block_array_bulk():
+    registry = OpaqueRegistry(13)
+    blocks = BlockArray.empty(registry, non_air=0)
+    expected = [0] * 4096
+
+    # Set many blocks, growing the palette once
+    indices = list(range(0, 4096, 3))
+    values = [idx % 40 for idx in indices]
+    blocks.set_many(indices, values)
+    for idx, value in zip(indices, values):
+        expected[idx] = value
+    assert blocks[:] == expected
+    assert blocks.storage.value_width == 6
+    assert len(blocks.palette) == 40
+    assert blocks.non_air == 4096 - expected.count(0)
+
+    # Slice assignment
+    blocks[100:400] = range(1000, 1300)
+    expected[100:400] = range(1000, 1300)
+    assert blocks[:] == expected
+    assert blocks.palette == []
+    assert blocks.storage.value_width == 13
+    assert blocks.non_air == 4096 - expected.count(0)
+
+    # Set IDs
+    blocks.set_ids([idx % 3 for idx in range(4096)])
+    assert blocks.palette == [0, 1, 2]
+    assert blocks.storage.value_width == 4
+    assert blocks.get_ids() == [idx % 3 for idx in range(4096)]
+    assert blocks.non_air == 4096 - 1366
+
+    # Fill
+    blocks.fill(7)
+    assert blocks.palette == [7]
+    assert blocks[:] == [7] * 4096
+    assert blocks.non_air == 4096
+    blocks[5] = 0
+    assert blocks.palette == [7, 0]
+    assert blocks.non_air == 4095
+
+
+def test_block_array_palette_edit():
+    registry = OpaqueRegistry(13)
+    blocks = BlockArray.empty(registry)
+    blocks[:3] = [5, 6, 7]
+    assert blocks.palette == [0, 5, 6, 7]
+
+    # Replacing palette entries in place updates the lookup
+    blocks.palette[1] = 8
+    blocks.palette[3] = 5
+    blocks[10] = 5
+    blocks.set_many([11, 12], [8, 7])
+    assert blocks.palette == [0, 8, 6, 5, 7]
+    assert blocks[:3] == [8, 6, 5]
+    assert blocks[10:13] == [5, 8, 7]
+    assert 7 in blocks
+    blocks.palette[4] = 9
+    assert blocks.index(9) == 12
+    blocks.palette.reverse()
+    blocks[20] = 9
+    assert blocks[20] == 9
+    assert blocks.palette == [9, 5, 6, 8, 0]
+
+def test_block_array_histogram():
+    registry = BitShiftRegistry(13)
+    blocks = BlockArray.empty(registry)
+    blocks[:300] = [(1, 0)] * 100 + [(2, 3)] * 200
+    blocks[0:50] = [(0, 0)] * 50
+    blocks[1000] = (5, 1)
+    blocks[1000] = (0, 0)
+
+    histogram = blocks.histogram()
+    assert histogram == {0: 3846, 1: 50, 2: 200}
+    assert blocks.palette == [0, 16, 35, 81]
+    assert blocks.non_air == 250
+
+    # Unused entries are dropped even when the value width is unchanged
+    blocks.repack()
+    assert blocks.palette == [0, 16, 35]
+    assert blocks.storage.value_width == 4
+    assert blocks[:301] == [(0, 0)] * 50 + [(1, 0)] * 50 + [(2, 3)] * 200 + \
+        [(0, 0)]
+    assert blocks[1000] == (0, 0)
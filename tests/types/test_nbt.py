@@ -1,7 +1,15 @@
 # -*- coding: utf-8 -*-
 import gzip
+import io
+import operator
 import os.path
+
+import pytest
+
+from quarry.types.buffer import Buffer, BufferUnderrun
+from quarry.types.chunk import PackedArray
 from quarry.types.nbt import *
+from tests.types.nbt_data import make_chunk, make_snbt_corpus
 TagCompound.preserve_order = True # for testing purposes.
 
 
@@ -117,3 +125,776 @@ def test_manual_bigtest_to_obj():
                 "name": TagString("Eggbert"),
                 "value": TagFloat(0.5)})})})})
     assert bigtest.to_obj() == bigtest_to_obj
+
+
+def test_chunk_unpack_pack():
+    chunk = make_chunk()
+    data = chunk.to_bytes()
+
+    decoded = TagRoot.from_bytes(data)
+    assert decoded.to_obj() == chunk.to_obj()
+    assert decoded.to_bytes() == data
+
+    # Decoding from a buffer leaves the position after the tag
+    buff = Buffer(b"spam" + data + b"eggs")
+    buff.unpack('I')
+    assert buff.unpack_nbt().to_bytes() == data
+    assert buff.read() == b"eggs"
+
+    # Decoding from shared memory
+    assert TagRoot.from_bytes(memoryview(bytearray(data))).to_bytes() == data
+
+
+def test_unpack_invalid():
+    data = make_chunk().to_bytes()
+    with pytest.raises(BufferUnderrun):
+        TagRoot.from_bytes(data[:-1])
+    with pytest.raises(BufferUnderrun):
+        TagRoot.from_bytes(data[:100])
+    with pytest.raises(ValueError):
+        TagRoot.from_bytes(b"\x0a\x00\x00\x0d\x00\x00")
+
+
+def test_chunk_round_trip():
+    data = make_chunk().to_bytes()
+    assert TagRoot.from_bytes(data).to_bytes() == data
+
+
+def test_encode_strings():
+    tag = TagRoot.from_body(TagCompound({
+        'Name': TagString('plain'),
+        'n\x00ll': TagString('n\x00ll'),
+        'caf\xe9 \U0001f4e6': TagList([TagString('\U0001f4e6')]),
+        'empty': TagList([]),
+        'nested': TagCompound({})}))
+
+    for use_mutf8 in (True, False):
+        data = tag.to_bytes(use_mutf8)
+        assert TagRoot.from_bytes(data, use_mutf8).to_obj() == tag.to_obj()
+
+    data = tag.to_bytes()
+    assert b'\x08\x00\x05n\xc0\x80ll\x00\x05n\xc0\x80ll' in data
+    assert b'\x09\x00\x05empty\x01\x00\x00\x00\x00' in data
+    assert b'\x08\x00\x04n\x00ll\x00\x04n\x00ll' in \
+        tag.to_bytes(use_mutf8=False)
+    assert TagRoot({}).to_bytes() == b'\x00'
+
+    # BMP strings are encoded identically in UTF-8 and mutf8
+    text = 'caf\xe9 ✦'
+    assert TagString(text).to_bytes() == \
+        TagString(text).to_bytes(use_mutf8=False) == \
+        b'\x00\x09' + text.encode('utf-8')
+    assert TagString(text + '\U0001f4e6').to_bytes() != \
+        TagString(text + '\U0001f4e6').to_bytes(use_mutf8=False)
+
+    # Repeated strings are decoded once and shared
+    data = TagList([TagString(text), TagString(text)]).to_bytes()
+    first, second = TagList.from_bytes(data).value
+    assert first.value == text and first.value is second.value
+
+
+def test_unpack_include():
+    chunk = make_chunk()
+    data = chunk.to_bytes()
+
+    partial = TagRoot.from_bytes(
+        data, include=["sections[].block_states.palette", "xPos"])
+    body = partial.body.value
+    assert list(body) == ['xPos', 'sections']
+    assert body['xPos'].value == 3
+    for section, expected in zip(body['sections'].value,
+                                 chunk.body.value['sections'].value):
+        assert list(section.value) == ['block_states']
+        assert list(section.value['block_states'].value) == ['palette']
+        assert section.value['block_states'].value['palette'] == \
+            expected.value['block_states'].value['palette']
+
+    # Shorter paths select whole subtrees
+    partial = TagRoot.from_bytes(data, include=[
+        "block_entities.Items", "block_entities", "Heightmaps.WORLD_SURFACE"])
+    body = partial.body.value
+    assert list(body) == ['block_entities', 'Heightmaps']
+    assert body['block_entities'] == chunk.body.value['block_entities']
+    assert list(body['Heightmaps'].value) == ['WORLD_SURFACE']
+
+
+def test_unpack_lazy():
+    chunk = make_chunk()
+    data = chunk.to_bytes()
+
+    lazy = TagRoot.from_bytes(data, lazy=True)
+    sections = lazy.body.value['sections'].value
+    assert repr(sections[0]).startswith("TagCompound(<lazy compound")
+    assert lazy.to_bytes() == data
+
+    # Accessing a compound decodes it, and nested compounds stay lazy
+    section = sections[3]
+    assert section.value['Y'].value == -1
+    assert isinstance(section.value, dict)
+    assert repr(section.value['block_states']).startswith(
+        "TagCompound(<lazy compound")
+    assert lazy.to_bytes() == data
+
+    # Modifications are written out
+    section.value['Y'] = TagByte(100)
+    chunk.body.value['sections'].value[3].value['Y'] = TagByte(100)
+    assert lazy.to_bytes() == chunk.to_bytes()
+    assert lazy.to_obj() == chunk.to_obj()
+
+
+def test_unpack_lazy_modify():
+    chunk = make_chunk()
+    data = chunk.to_bytes()
+
+    def set_value(path, value):
+        return lambda body: setattr(body.at_path(path), 'value', value)
+
+    def flip_light(body):
+        light = body.at_path('sections[1].BlockLight').value
+        light[0] ^= 1
+
+    def reorder(body):
+        section = body.at_path('sections[5]').value
+        section['Y'] = section.pop('Y')
+
+    mutations = [
+        set_value('sections[3].Y', 5),
+        set_value('block_entities[2].Items[4].Count', 3),
+        set_value('sections[4].biomes', {'palette': TagList([])}),
+        lambda body: body.at_path('block_entities[0]').update(
+            TagCompound({'x': TagInt(9)})),
+        lambda body: body.set_at_path(
+            'block_entities[1].Items[{Slot:3b}].id',
+            TagString('minecraft:dirt')),
+        lambda body: body.remove_at_path('sections[2].biomes'),
+        lambda body: body.at_path('block_entities[5].Items').value.append(
+            TagCompound({'Slot': TagByte(27)})),
+        flip_light,
+        reorder,
+        lambda body: body.at_path('block_entities[4].Items').value.reverse(),
+        lambda body: body.at_path('sections[6].SkyLight').value.from_list(
+            [1] * 2048)]
+
+    # Decoded compounds are written out unchanged unless modified
+    for mutate in mutations:
+        eager = TagRoot.from_bytes(data)
+        lazy = TagRoot.from_bytes(data, lazy=True)
+        lazy.to_obj()
+        assert lazy.to_bytes() == data
+        mutate(eager.body)
+        mutate(lazy.body)
+        assert lazy.to_bytes() == eager.to_bytes() != data
+
+    # Modifications mark the enclosing compounds as modified
+    lazy = TagRoot.from_bytes(data, lazy=True)
+    entity = lazy.body.at_path('block_entities[2]')
+    item = entity.at_path('Items[4]')
+    count = item.value['Count']
+    assert not entity.value.span.dirty and not item.value.span.dirty
+    count.value = 3
+    assert item.value.span.dirty and entity.value.span.dirty
+    assert lazy.body.at_path('block_entities[3].Items[4].Count').value == 64
+    assert not lazy.body.at_path('block_entities[3]').value.span.dirty
+
+    # An empty list of ints is kept as such until its compound is modified
+    data = TagRoot.from_body(TagCompound({'a': TagCompound({
+        'l': TagList([]), 'n': TagInt(1)})})).to_bytes()
+    data = data.replace(b'\x09\x00\x01l\x01', b'\x09\x00\x01l\x03')
+    lazy = TagRoot.from_bytes(data, lazy=True)
+    assert lazy.body.at_path('a.n').value == 1
+    assert lazy.to_bytes() == data
+    lazy.body.value['a'].value['n'] = TagInt(1)
+    assert b'\x09\x00\x01l\x01' in lazy.to_bytes()
+
+    # Editing one block entity after reading all of them
+    lazy = TagRoot.from_bytes(chunk.to_bytes(), lazy=True)
+    for block_entity in lazy.body.value['block_entities'].value:
+        assert block_entity.value['id'].value == 'minecraft:chest'
+    lazy.body.set_at_path('block_entities[3].keepPacked', TagByte(1))
+    eager = TagRoot.from_bytes(chunk.to_bytes())
+    eager.body.set_at_path('block_entities[3].keepPacked', TagByte(1))
+    assert lazy.to_bytes() == eager.to_bytes()
+
+
+def test_unpack_compact():
+    chunk = make_chunk()
+    data = chunk.to_bytes()
+
+    compact = TagRoot.from_bytes(data, compact=True)
+    assert compact.equals_exact(chunk)
+    assert hash(compact) == hash(chunk)
+    assert compact.to_bytes() == data
+    assert compact.deep_copy().to_bytes() == data
+    assert type(compact.body.value) is dict
+
+    # Small integers and keys are shared
+    sections = compact.body.value['sections'].value
+    assert sections[0].value['block_states'] is not \
+        sections[1].value['block_states']
+    assert list(sections[0].value)[0] is list(sections[1].value)[0]
+    lists = compact.body.value['PostProcessing'].value
+    assert repr(lists[0]) == "TagList(<compact list: 5 TagShort values>)"
+    assert lists[0].value[1] is lists[1].value[1]
+    assert lists[0].value[1:3] == [TagShort(1), TagShort(2)]
+    assert compact.body.value['Lights'].to_obj() == [[-1, 7]]
+    assert compact.body.at_path('Lights[0][-1]').value == 7
+    assert compact.to_mojangson() == chunk.to_mojangson()
+
+    # Number tags are read-only, and are replaced rather than modified
+    with pytest.raises(AttributeError):
+        compact.body.value['xPos'].value = 99
+    with pytest.raises(AttributeError):
+        lists[0].value[3].value = 77
+    assert TagRoot.from_bytes(data, compact=True).equals_exact(chunk)
+    compact.body.set_at_path('xPos', TagInt(99))
+    compact.body.value['xPos'].value = 3
+    assert isinstance(compact.body.value['xPos'], TagInt)
+    copy = compact.deep_copy()
+    copy.body.value['DataVersion'].value = 99
+    copy.body.value['Lights'].value[0].value[1].value = 99
+    assert compact.equals_exact(chunk)
+
+    # Modifications are written out
+    lists[0].value.append(TagShort(5))
+    assert type(lists[0].value) is list
+    chunk.body.value['PostProcessing'].value[0].value.append(TagShort(5))
+    assert compact.to_bytes() == chunk.to_bytes()
+
+
+def test_unpack_interned(tmp_path):
+    chunk = make_chunk()
+    data = chunk.to_bytes()
+
+    interner = NBTInterner()
+    first = TagRoot.from_bytes(data, interner=interner)
+    assert first.equals_exact(chunk)
+    assert first.to_bytes() == data
+    items = first.body.at_path('block_entities[0].Items').value
+    other_items = first.body.at_path('block_entities[1].Items').value
+    assert all(map(operator.is_, items, other_items))
+    assert first.body.at_path('block_entities[0]') is not \
+        first.body.at_path('block_entities[1]')
+
+    # Statistics count every compound looked up
+    assert interner.unique == len(interner) < interner.total
+    item_size = len(items[0].to_bytes()) - 1
+    saved = interner.bytes_saved
+    assert saved >= 19 * 27 * item_size
+
+    # Compounds seen before are shared, without being decoded
+    second = TagRoot.from_bytes(data, interner=interner)
+    assert second.body.value['sections'] is not first.body.value['sections']
+    assert second.body.at_path('sections[0].biomes') is \
+        first.body.at_path('sections[0].biomes')
+    assert second.body.at_path('block_entities[3]') is \
+        first.body.at_path('block_entities[3]')
+    assert interner.bytes_saved > saved
+
+    # Shared tags are read-only, and copies can be modified
+    entity = first.body.value['block_entities'].value[0]
+    with pytest.raises(AttributeError):
+        items[3].value['Count'].value = 5
+    with pytest.raises(TypeError):
+        items[3].value['Count'] = TagByte(5)
+    with pytest.raises(TypeError):
+        entity.update(TagCompound({'x': TagInt(9)}))
+    with pytest.raises(TypeError):
+        entity.value['Items'].value.append(items[0])
+    with pytest.raises(TypeError):
+        second.body.at_path('sections[0].biomes.palette').value.pop()
+    entity = entity.deep_copy()
+    entity.at_path('Items[3].Count').value = 5
+    first.body.value['block_entities'].value[0] = entity
+    assert first.body.at_path('block_entities[0].Items[3].Count').value == 5
+    assert second.body.at_path('block_entities[0].Items[3].Count').value == \
+        items[3].value['Count'].value == 64
+    assert TagRoot.from_bytes(data, interner=interner).equals_exact(chunk)
+
+    # Interning existing trees, and partial trees
+    item = TagCompound({
+        'Slot': TagByte(3), 'id': TagString('minecraft:stone'),
+        'Count': TagByte(64)})
+    assert interner.intern(item) is items[3]
+    assert interner.intern(TagList([item])).value[0] is items[3]
+    partial = TagRoot.from_bytes(
+        data, include='block_entities[].Items', interner=interner)
+    assert partial.body.at_path('block_entities[0]') is not \
+        first.body.at_path('block_entities[0]')
+    assert partial.body.at_path('block_entities[0].Items[3]') is items[3]
+    lazy = TagRoot.from_bytes(data, lazy=True, interner=NBTInterner())
+    assert lazy.to_bytes() == data
+    assert lazy.body.at_path('block_entities[1].Items[5]') is \
+        lazy.body.at_path('block_entities[2].Items[5]')
+
+    # Large compounds are not interned
+    interner = NBTInterner(max_size=64)
+    TagRoot.from_bytes(data, interner=interner)
+    assert all(len(tag.to_bytes()) <= 64 for tag in interner.tags.values())
+    interner.clear()
+    assert (interner.unique, interner.total, interner.bytes_saved) == \
+        (0, 0, 0)
+
+    # Region scans
+    region_path = tmp_path / "r.0.0.mca"
+    region_path.write_bytes(bytes(8192))
+    with RegionFile(region_path) as region:
+        for x_pos in range(2):
+            chunk.body.value['xPos'] = TagInt(x_pos)
+            region.save_chunk(chunk)
+        interner = NBTInterner()
+        results = list(region.query_chunks(
+            ['block_entities[].Items'], interner=interner))
+        assert len(results) == 40
+        assert all(map(
+            operator.is_, results[0][4].value, results[20][4].value))
+        assert interner.unique < interner.total
+        interner = NBTInterner()
+        results = list(region.iter_subtrees(
+            'block_entities[].Items', interner=interner))
+        assert results[0][3].value == items
+        assert all(map(
+            operator.is_, results[0][3].value, results[39][3].value))
+
+
+def test_path_query():
+    bigtest = NBTFile.load(bigtest_path).root_tag.value["Level"]
+    path = '"listTest (compound)"[{name:"Compound tag #1"}].created-on'
+    assert NBTPath.compile(path) is NBTPath.compile(path)
+    assert bigtest.at_path(path).value == 1264099775885
+    assert bigtest.at_path('"nested compound test".egg.name').value == "Eggbert"
+    assert bigtest.at_path('"listTest (long)"[-1]').value == 15
+    assert bigtest.has_path('"listTest (long)"[4]')
+    assert not bigtest.has_path('"listTest (long)"[5]')
+    assert bigtest.count_multipath('"listTest (compound)"[].name') == 2
+    assert bigtest.count_multipath('{shortTest:32767s}.intTest') == 1
+    assert bigtest.count_multipath('{shortTest:0s}.intTest') == 0
+
+    pairs = list(bigtest.iter_multipath_pair('"nested compound test"{ham:{}}.ham.name'))
+    assert pairs == [('"nested compound test".ham.name', TagString("Hampus"))]
+    pairs = list(bigtest.iter_multipath_pair('"listTest (long)"[]'))
+    assert [p for p, _ in pairs] == ['"listTest (long)"[%d]' % i for i in range(5)]
+    assert list(bigtest.iter_multipath('"byteArrayTest (the first 1000 values of (n*n*255+n*7)%100, starting with n=0 (0, 62, 34, 16, 8, ...))"[1]')) == [62]
+
+    with pytest.raises(KeyError):
+        bigtest.at_path('missing')
+    with pytest.raises(KeyError):
+        bigtest.at_path('intTest.x')
+    with pytest.raises(IndexError):
+        bigtest.at_path('"listTest (long)"[5]')
+    with pytest.raises(ValueError):
+        bigtest.at_path('"listTest (long)"[]')
+    with pytest.raises(KeyError):
+        bigtest.at_path('"listTest (compound)"[{name:"x"}]')
+    for path in ('.intTest', 'a..b', 'a b', 'a[0', '{}{}'):
+        with pytest.raises(SyntaxError):
+            NBTPath.compile(path)
+
+
+def test_path_modify():
+    tag = TagCompound.from_mojangson(
+        '{Items:[{Slot:0b,id:"a"},{Slot:1b,id:"b"},{Slot:2b,id:"a"}]}')
+    tag.value['Data'] = TagIntArray(PackedArray.from_int_list([1, 2, 3], 32))
+
+    assert tag.set_at_path('Items[{id:"a"}].Count', TagByte(5)) == 2
+    assert [t.value for t in tag.iter_multipath('Items[].Count')] == [5, 5]
+    assert tag.set_at_path('Items[].Missing.Count', TagByte(5)) == 0
+    assert tag.set_at_path('Items[]{id:"b"}', TagString("c")) == 1
+    assert tag.at_path('Items[1]') == TagString("c")
+    assert tag.set_at_path('Data[1]', -1) == 1
+    assert tag.at_path('Data').to_obj() == [1, 0xFFFFFFFF, 3]
+    with pytest.raises(ValueError):
+        tag.set_at_path('', TagByte(0))
+
+    assert tag.remove_at_path('Items[{id:"a"}]') == 2
+    assert tag.at_path('Items').value == [TagString("c")]
+    assert tag.remove_at_path('Data[0]') == 1
+    assert tag.at_path('Data').to_obj() == [0xFFFFFFFF, 3]
+    assert tag.remove_at_path('Items') == 1
+    assert tag.remove_at_path('Items') == 0
+    assert not tag.has_path('Items')
+
+
+def test_query():
+    chunk = make_chunk()
+    paths = {
+        'chests': 'block_entities[{id:"minecraft:chest"}].CustomName',
+        'stone': 'block_entities[].Items[{id:"minecraft:stone"}].Slot',
+        'first': 'block_entities[0].Items[-1]',
+        'sections': 'sections[]{Y:0b}.biomes.palette[0]',
+        'pos': 'xPos',
+        'missing': 'missing.x',
+    }
+    query = NBTQuery(paths)
+    results = list(query.iter_root(chunk))
+    for query_id, path in paths.items():
+        expected = list(chunk.body.iter_multipath_pair(path))
+        assert [(p, t) for i, p, t in results if i == query_id] == expected
+    assert len(results) == 20 + 20 * 27 + 1 + 1 + 1
+
+    # Sequences of paths are numbered
+    query = NBTQuery(['xPos', 'zPos'])
+    assert [i for i, _, _ in query.iter_root(chunk)] == [0, 1]
+
+    # Only the tags needed by the query are decoded
+    assert sorted(NBTQuery(paths).include) == [
+        'block_entities[]', 'block_entities[].Items[]',
+        'block_entities[].Items[]', 'missing.x', 'sections[]', 'xPos']
+    assert NBTQuery(['{xPos:3}']).include is None
+    assert NBTQuery(['"a.b"']).include is None
+
+
+def test_query_files(tmp_path):
+    chunk = make_chunk()
+    region_path = tmp_path / "r.0.-1.mca"
+    region_path.write_bytes(bytes(8192))
+    with RegionFile(region_path) as region:
+        region.save_chunk(chunk)
+        results = list(region.query_chunks(['xPos', 'block_entities[0].Items[0].Slot']))
+    assert results == [
+        (3, 25, 0, 'xPos', TagInt(3)),
+        (3, 25, 1, 'block_entities[0].Items[0].Slot', TagByte(0))]
+
+    results = list(NBTFile.query(bigtest_path, {'long': 'longTest'}))
+    assert results == [('long', 'longTest', TagLong(9223372036854775807))]
+
+
+def test_diff(capsys):
+    chunk = make_chunk()
+    other = make_chunk()
+    assert chunk.changes(other) == []
+    body, other_body = chunk.body.value, other.body.value
+
+    other_body['sections'].value[2].value['Y'] = TagInt(-2)
+    other_body['Status'] = TagString('empty')
+    del other_body['LastUpdate']
+    other_body['Test'] = TagByte(1)
+    other_body['CarvingMasks'].value['AIR'].value[3] = 7
+    items = other_body['block_entities'].value[0].value['Items'].value
+    items[1].value['Count'] = TagByte(1)
+    assert chunk.body.changes(other.body) == [
+        NBTChange('LastUpdate', 'removed', TagLong(123456789), None),
+        NBTChange('Test', 'added', None, TagByte(1)),
+        NBTChange('Status', 'value', TagString('full'), TagString('empty')),
+        NBTChange('sections[2].Y', 'type', TagByte(-2), TagInt(-2)),
+        NBTChange('block_entities[0].Items[1].Count', 'value',
+                  TagByte(64), TagByte(1)),
+        NBTChange('CarvingMasks.AIR[3]', 'value',
+                  body['CarvingMasks'].value['AIR'].to_signed_list()[3], 7)]
+
+    # Lists may be aligned by position, content or an identifying key
+    del items[1]
+    changes = chunk.body.changes(other.body)
+    assert len([change for change in changes if 'Items' in change.path]) \
+        == 26
+    changes = chunk.body.changes(other.body, align='sequence')
+    assert [change[:2] for change in changes
+            if 'Items' in change.path] == \
+        [('block_entities[0].Items[1]', 'removed')]
+    changes = chunk.body.changes(other.body, keys=('Slot',))
+    assert [change[:2] for change in changes
+            if 'Items' in change.path] == \
+        [('block_entities[0].Items[{Slot:1b}]', 'removed')]
+
+    reordered = TagCompound({'b': TagInt(2), 'a': TagInt(1)})
+    compound = TagCompound({'a': TagInt(1), 'b': TagInt(2)})
+    assert compound.changes(reordered) == [
+        NBTChange('', 'order', ['a', 'b'], ['b', 'a'])]
+    assert compound.changes(reordered, order_matters=False) == []
+    assert TagList([]).changes(TagIntArray.from_bytes(b'\0\0\0\0')) == [
+        NBTChange('', 'type', TagList([]), TagIntArray([]))]
+
+    # Printing
+    assert TagCompound({'a': TagInt(1)}).diff(TagCompound({'a': TagInt(2)}))
+    assert not TagInt(1).diff(TagInt(1))
+    assert capsys.readouterr().out == (
+        "Diff at path 'a': value\n"
+        "  -  self is: 1\n"
+        "  - other is: 2\n")
+
+    # Identical lazy compounds are not decoded
+    lazy = TagRoot.from_bytes(chunk.to_bytes(), lazy=True)
+    other_lazy = TagRoot.from_bytes(other.to_bytes(), lazy=True)
+    assert lazy.body.changes(other_lazy.body) == \
+        chunk.body.changes(other.body)
+    sections = lazy.body.value['sections'].value
+    assert repr(sections[0]).startswith("TagCompound(<lazy compound")
+    assert not repr(sections[2]).startswith("TagCompound(<lazy compound")
+
+
+def test_diff_regions(tmp_path):
+    regions = []
+    for name, seeds in (('a', (0, 1)), ('b', (0, 2))):
+        region_path = tmp_path / name / 'r.0.0.mca'
+        region_path.parent.mkdir()
+        region_path.write_bytes(bytes(8192))
+        region = RegionFile(region_path)
+        for idx, seed in enumerate(seeds):
+            chunk = make_chunk(seed)
+            chunk.body.value['xPos'] = TagInt(idx)
+            region.save_chunk(chunk)
+        regions.append(region)
+
+    regions[1].delete_chunk(1, 25)
+    regions[1].save_chunk(make_chunk())
+    results = list(regions[0].diff_chunks(regions[1]))
+    assert [(x, z, [c[:2] for c in changes]) for x, z, changes in results] \
+        == [(1, 25, [('', 'removed')]), (3, 25, [('', 'added')])]
+
+    chunk = regions[1].load_chunk(0, 25)
+    chunk.body.value['Status'] = TagString('empty')
+    regions[1].save_chunk(chunk)
+    results = list(regions[0].diff_chunks(regions[1]))
+    assert results[0] == (0, 25, [
+        NBTChange('Status', 'value', TagString('full'), TagString('empty'))])
+    for region in regions:
+        region.close()
+
+
+class TrickleFile(io.BytesIO):
+    """
+    File object that returns at most a few bytes from each read.
+    """
+
+    def read(self, size=-1):
+        return super().read(min(size, 3) if size >= 0 else 3)
+
+
+def list_events(fp):
+    return [(event, name, kind, value.to_list()
+             if isinstance(value, PackedArray) else value)
+            for event, name, kind, value in fp]
+
+
+def test_events():
+    chunk = make_chunk()
+    data = chunk.to_bytes()
+    events = list_events(iter_events(TrickleFile(data)))
+    assert events == list_events(iter_events(data))
+    assert events[:3] == [
+        ('start_compound', '', TagCompound, None),
+        ('scalar', 'DataVersion', TagInt, 2975),
+        ('scalar', 'xPos', TagInt, 3)]
+    assert events[-2:] == [
+        ('scalar', 'Scale', TagFloat, 0.5),
+        ('end', None, None, None)]
+    assert ('start_list', 'fluid_ticks', None, 0) in events
+    assert ('start_list', 'PostProcessing', TagList, 24) in events
+    assert sum(event == 'end' for event, _, _, _ in events) == \
+        sum(event.startswith('start') for event, _, _, _ in events)
+
+    class Counter(NBTHandler):
+        def __init__(self):
+            self.counts = {}
+
+        def scalar(self, name, kind, value):
+            if kind is TagString:
+                self.counts[value] = self.counts.get(value, 0) + 1
+
+    counts = read_events(io.BytesIO(data), Counter()).counts
+    assert counts['minecraft:stone'] == 540
+    assert list(iter_events(TagRoot({}).to_bytes())) == []
+    with pytest.raises(BufferUnderrun):
+        list(iter_events(data[:-1]))
+
+    # Subtrees are built only for selected paths
+    include = ['sections[].block_states.palette', 'xPos', 'Heightmaps']
+    results = list(iter_subtrees(TrickleFile(data), include))
+    assert [path for path, _ in results[:3]] == [
+        'xPos', 'sections[0].block_states.palette',
+        'sections[1].block_states.palette']
+    expected = TagRoot.from_bytes(data, include=include).body
+    assert [tag for _, tag in results] == [
+        expected.at_path(path) for path, _ in results]
+    assert len(results) == 26
+    assert list(iter_subtrees(data, '')) == [('', chunk.body)]
+
+    results = list(NBTFile.iter_subtrees(
+        bigtest_path, ['listTest (compound)[].name', 'missing.key']))
+    assert results == [
+        ('"listTest (compound)"[0].name', TagString('Compound tag #0')),
+        ('"listTest (compound)"[1].name', TagString('Compound tag #1'))]
+    bigtest = NBTFile.load(bigtest_path).root_tag
+    assert list_events(NBTFile.iter_events(bigtest_path)) == \
+        list_events(iter_events(bigtest.to_bytes()))
+
+
+def test_events_files(tmp_path):
+    region_path = tmp_path / "r.0.0.mca"
+    region_path.write_bytes(bytes(8192))
+    with RegionFile(region_path) as region:
+        region.save_chunk(make_chunk())
+        assert list_events(region.iter_chunk_events(3, 25)) == \
+            list_events(iter_events(make_chunk().to_bytes()))
+        assert list(region.iter_chunk_events(0, 0)) == []
+        assert list(region.iter_subtrees('zPos')) == \
+            [(3, 25, 'zPos', TagInt(-7))]
+
+
+def test_compare_copy():
+    chunk = make_chunk()
+    other = make_chunk()
+    assert chunk == other and chunk.equals_exact(other)
+    assert hash(chunk) == hash(other)
+    assert chunk != make_chunk(1)
+    assert chunk != 1
+
+    # Compound key order only matters for exact comparisons
+    reordered = TagCompound({'b': TagInt(2), 'a': TagInt(1)})
+    compound = TagCompound({'a': TagInt(1), 'b': TagInt(2)})
+    assert compound == reordered and hash(compound) == hash(reordered)
+    assert not compound.equals_exact(reordered)
+
+    # Values are compared like to_obj(), so lists may equal arrays
+    ints = TagList([TagInt(1), TagInt(2)])
+    array = TagIntArray(PackedArray.from_int_list([1, 2], 32))
+    assert ints == array and hash(ints) == hash(array)
+    assert not ints.equals_exact(array)
+    assert TagByte(1) == TagInt(1) and not TagByte(1).equals_exact(TagInt(1))
+    assert TagFloat(0.0) == TagFloat(-0.0)
+    assert not TagFloat(0.0).equals_exact(TagFloat(-0.0))
+
+    # Copies can be modified without affecting the original
+    copy = chunk.deep_copy()
+    assert copy.equals_exact(chunk) and copy.to_bytes() == chunk.to_bytes()
+    body, copy_body = chunk.body.value, copy.body.value
+    assert copy_body['xPos'] is not body['xPos']
+    assert copy_body['sections'] is not body['sections']
+    copy_body['xPos'].value = 5
+    copy_body['Status'].value = 'empty'
+    copy_body['block_entities'].value[0].value['Items'].value[0] \
+        .value['Count'].value = 5
+    copy_body['sections'].value[0].value['Y'] = TagByte(100)
+    copy_body['Heightmaps'].value['MOTION_BLOCKING'].value[0] = 1
+    assert copy != chunk and chunk == other and chunk.equals_exact(other)
+    assert body['xPos'].value == 3 and body['Status'].value == 'full'
+    assert chunk.body.at_path('block_entities[0].Items[0].Count').value == 64
+    scalar = TagInt(3)
+    assert scalar.deep_copy() is not scalar
+
+    # Lazy compounds are compared and copied in serialized form
+    data = other.to_bytes()
+    lazy = TagRoot.from_bytes(data, lazy=True)
+    lazy_copy = lazy.deep_copy()
+    assert lazy_copy.to_bytes() == data
+    assert lazy_copy == TagRoot.from_bytes(data, lazy=True) == other
+
+
+def test_mojangson():
+    tag = TagCompound.from_mojangson(
+        "{a:1b, b : -2s,c:3L,d:4,e:5.5f,f:6.5d,g:7.,h:1e5,i:TRUE,"
+        "j:'it\\'s',k:\"\\\\\",l:[I;1,-1],m:[B;],n:[[],[1,2,],],o:{}}")
+    assert tag.equals_exact(TagCompound({
+        'a': TagByte(1), 'b': TagShort(-2), 'c': TagLong(3), 'd': TagInt(4),
+        'e': TagFloat(5.5), 'f': TagDouble(6.5), 'g': TagDouble(7.0),
+        'h': TagString('1e5'), 'i': TagByte(1), 'j': TagString("it's"),
+        'k': TagString('\\'),
+        'l': TagIntArray(PackedArray.from_int_list([1, -1], 32)),
+        'm': TagByteArray(PackedArray.from_int_list([], 8)),
+        'n': TagList([TagList([]), TagList([TagInt(1), TagInt(2)])]),
+        'o': TagCompound({})}))
+
+    corpus = make_snbt_corpus()
+    items = [TagCompound.from_mojangson(text) for text in corpus[:-3]]
+    assert items[3].at_path('tag.display.Lore[19]').value == \
+        '{"text":"Line 19 of lore, with \'quotes\'"}'
+    assert items[3].at_path('tag.pages[0]').value == '{"text":"Page 0"}'
+    assert items[3].at_path('tag.Unbreakable') == TagByte(1)
+    arrays = TagCompound.from_mojangson(corpus[-3])
+    assert [len(arrays.value[key]) for key in ('bytes', 'ints', 'longs')] \
+        == [4096] * 3
+    nested = TagCompound.from_mojangson(corpus[-2])
+    assert nested.at_path('a.' * 500 + 'depth').value == 500
+    nested = TagCompound.from_mojangson(corpus[-1])
+    assert nested.at_path('list' + '[0]' * 500).value == 1
+
+    # Errors leave the reader at the position of the error
+    for text, cursor in [('{a:1,b:[1,2b]}', 10),
+                         ('{a:1 b:2}', 5),
+                         ('{:1}', 1),
+                         ('{a:[I;1,2b]}', 8),
+                         ('{a:[X;1]}', 4),
+                         ('{a:}', 3),
+                         ('{a:"x\\y"}', 6),
+                         ('{a:[1,', 6),
+                         ('  [1]', 2),
+                         ('{a:\u00e9}', 3),
+                         ('{a:\u0663}', 3),
+                         ('{\u00e9:1}', 1),
+                         ('{a:1\u00e9}', 4),
+                         ('{a:[I;\u0663]}', 6)]:
+        reader = StringReader(text)
+        with pytest.raises(Exception):
+            MojangsonParser(reader).parse_compound()
+        assert reader.get_cursor() == cursor, text
+
+
+def test_write_mojangson(capsys):
+    for text in make_snbt_corpus()[:-3]:
+        tag = TagCompound.from_mojangson(text)
+        mojangson = tag.to_mojangson()
+        assert TagCompound.from_mojangson(mojangson).equals_exact(tag)
+        fp = io.StringIO()
+        tag.write_mojangson(fp)
+        assert fp.getvalue() == mojangson
+
+    tag = TagCompound.from_mojangson(
+        '{a:{b:{c:1}},"d e":[I;-1,2,3],f:[],g:"say \\"hi\\"",h:[1b,2b]}')
+    assert tag.to_mojangson() == \
+        '{a:{b:{c:1}},"d e":[I;-1,2,3],f:[],g:\'say "hi"\',h:[1b,2b]}'
+    assert tag.to_mojangson(sort=['h']) == \
+        '{h:[1b,2b],a:{b:{c:1}},"d e":[I;-1,2,3],f:[],g:\'say "hi"\'}'
+    assert tag.to_mojangson(max_depth=2, max_array_length=2) == \
+        '{a:{b:{...}},"d e":[I;-1,2,...(3 entries total)],f:[],' \
+        'g:\'say "hi"\',h:[1b,2b]}'
+
+    tag.tree(indent='  ', highlight=False)
+    assert capsys.readouterr().out == (
+        '{\n'
+        '  a:{\n'
+        '    b:{\n'
+        '      c:1\n'
+        '    }\n'
+        '  },\n'
+        '  "d e":[I;-1,2,3],\n'
+        '  f:[\n'
+        '  ],\n'
+        '  g:\'say "hi"\',\n'
+        '  h:[\n'
+        '    1b,\n'
+        '    2b\n'
+        '  ]\n'
+        '}\n')
+
+
+def test_array_signed():
+    for kind, width in ((TagByteArray, 8), (TagIntArray, 32),
+                        (TagLongArray, 64)):
+        values = [0, 1, -1, 1 - (1 << (width - 1)), (1 << (width - 1)) - 1]
+        tag = kind(PackedArray.from_int_list(values, width))
+        assert tag.to_obj() == [value % (1 << width) for value in values]
+        assert tag.to_json() == tag.to_signed_list() == values
+        assert tag.value.to_view(signed=True).tolist() == values
+        assert tag.value.to_view().tolist() == tag.to_obj()
+        assert kind.from_bytes(tag.to_bytes()).to_json() == values
+        text = tag.to_mojangson()
+        parsed = MojangsonParser(StringReader(text)).parse_any_tag()
+        assert parsed.to_json() == values
+
+        # Out-of-range values are wrapped
+        wrapped = PackedArray.from_int_list([1 << width, -1 << width], width)
+        assert wrapped.to_list() == [0, 0]
+
+    tag = TagByteArray(PackedArray.from_int_list([-2, 3], 8))
+    assert tag.to_mojangson() == '[B;-2b,3b]'
+    assert tag.to_mojangson(max_array_length=1) == \
+        '[B;-2b,...(2 entries total)]'
+    assert TagByteArray(PackedArray.from_int_list([], 8)).to_mojangson() == \
+        '[B;]'
+
+    # Repacked storage has no view of tag values
+    tag = TagLongArray(PackedArray.from_int_list([-1], 64))
+    tag.value.length = 16
+    tag.value.value_width = 4
+    with pytest.raises(ValueError):
+        tag.value.to_view()
+    assert tag.to_signed_list() == [15] * 16